@@ -0,0 +1,136 @@
+"""
+Cache des réponses du chatbot
+Recherche exacte sur la question normalisée, puis recherche sémantique
+(similarité cosinus des embeddings de la question), avec TTL et éviction LRU
+"""
+
+import re
+import time
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+# Renvoyé par get_exact quand la réponse à la même question a expiré (échec déjà compté)
+EXPIRED = object()
+
+
+def normalize_question(question: str) -> str:
+    """Normalise une question : minuscules, sans accents ni ponctuation, espaces compactés"""
+    text = unicodedata.normalize('NFKD', question.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"[^\w%]+", " ", text)
+    return text.strip()
+
+
+class AnswerCache:
+    """Cache LRU borné des réponses, indexé par question normalisée et par embedding"""
+
+    def __init__(self, max_size: int = 512, ttl: float = 3600, threshold: float = 0.95):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "exact_hits": 0, "semantic_hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0
+        }
+
+    def _expired(self, entry: dict, now: float) -> bool:
+        return now - entry["created"] > self.ttl
+
+    def _purge_expired(self, now: float):
+        for key in [k for k, e in self._entries.items() if self._expired(e, now)]:
+            del self._entries[key]
+
+    def get_exact(self, question: str):
+        """
+        Réponse en cache pour la même question normalisée, sinon None.
+        Une réponse expirée est supprimée et comptée comme un échec : EXPIRED est alors
+        renvoyé pour que l'appelant ne compte pas une seconde fois la même recherche.
+        """
+        key = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry, now):
+                del self._entries[key]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return EXPIRED
+            self._entries.move_to_end(key)
+            self.stats["exact_hits"] += 1
+            return entry["value"]
+
+    def get_similar(self, embedding):
+        """Réponse en cache pour une question proche (cosinus >= seuil), sinon None"""
+        query = _unit(embedding)
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            # Les entrées sans embedding ne servent qu'à la recherche exacte
+            keys = [k for k, e in self._entries.items() if e["embedding"] is not None]
+            if not keys:
+                self.stats["misses"] += 1
+                return None
+
+            matrix = np.stack([self._entries[k]["embedding"] for k in keys])
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+
+            if scores[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+
+            self._entries.move_to_end(keys[best])
+            self.stats["semantic_hits"] += 1
+            return self._entries[keys[best]]["value"]
+
+    def record_miss(self):
+        """Compte un échec quand la recherche sémantique n'a pas été tentée"""
+        with self._lock:
+            self.stats["misses"] += 1
+
+    def put(self, question: str, embedding, value: dict):
+        """
+        Ajoute une réponse au cache en évinçant les entrées les plus anciennes.
+        Sans embedding, l'entrée n'est retrouvée que par la question normalisée.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            self._entries[key] = {
+                "value": value,
+                "embedding": _unit(embedding) if embedding is not None else None,
+                "created": time.time()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        """Invalide tout le cache (par exemple quand le corpus change)"""
+        with self._lock:
+            self._entries.clear()
+            self.stats["invalidations"] += 1
+
+    def info(self) -> dict:
+        """Compteurs et taille du cache pour /health"""
+        with self._lock:
+            lookups = self.stats["exact_hits"] + self.stats["semantic_hits"] + self.stats["misses"]
+            hits = self.stats["exact_hits"] + self.stats["semantic_hits"]
+            return {
+                **self.stats,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+            }
+
+
+def _unit(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -1,24 +1,114 @@
 """
 Backend Flask pour le chatbot épargne retraite avec RAG
 Utilise ChromaDB pour la vectorisation et Ollama pour la génération
+
+Démarrage : `create_app()` est léger ; le modèle d'embedding et la base vectorielle
+sont chargés par une phase de préchauffage en arrière-plan (voir /health/ready).
+Avec PRELOAD_MODELS=true et `gunicorn --preload` (voir gunicorn.conf.py), le modèle
+est chargé une seule fois dans le processus maître et partagé par les workers (copy-on-write).
 """
 
 import os
-import glob
-from flask import Flask, request, jsonify
+import json
+import time
+import shutil
+import threading
+import multiprocessing
+from flask import Flask, Blueprint, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-import chromadb
-from chromadb.utils import embedding_functions
-import requests
+from answer_cache import AnswerCache, EXPIRED
+from chunking import create_chunker
+from context_builder import TokenCounter, build_context
+from embedding_batcher import EmbeddingBatcher
+from lexical import BM25Index, is_confident, reciprocal_rank_fusion
+from llm_client import OllamaClient, OllamaError, OllamaBusyError
+from faq import FAQIndex, load_faq_config, load_answers, save_answers, build_answers
+from sessions import SessionStore, SESSION_ID_PATTERN, conversation_topic, rewrite_query, format_history
+from metrics import (
+    registry, timed, observe_stage, record_request, timings_summary, ollama_collector,
+    REQUESTS_IN_FLIGHT, CONTENT_TYPE
+)
+from indexing import load_manifest
+from ingestion import IngestionProgress, copy_collection, run_sync
+from vector_store import MmapVectorStore, ensure_export
+from query_encoder import OnnxQueryEncoder
+from locks import file_lock, acquire_file_lock, release_file_lock
+from versions import (
+    load_pointer, save_pointer, pointer_mtime, new_version_name, promote, rollback,
+    idle_reload_state, load_reload_state, save_reload_state
+)
 
-app = Flask(__name__)
-CORS(app)
+bp = Blueprint("chatbot", __name__)
 
 # Configuration
+OLLAMA_OPTIONS = {
+    "temperature": 0.7,
+    "top_p": 0.9,
+    "num_predict": 1024
+}
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral")
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+OLLAMA_MAX_IN_FLIGHT = int(os.getenv("OLLAMA_MAX_IN_FLIGHT", "2"))
+OLLAMA_MAX_QUEUE = int(os.getenv("OLLAMA_MAX_QUEUE", "8"))
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "30"))
+OLLAMA_MAX_RETRIES = int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
 KNOWLEDGE_BASE_PATH = os.getenv("KNOWLEDGE_BASE_PATH", "../knowledge_base")
 CHROMA_PERSIST_PATH = os.getenv("CHROMA_PERSIST_PATH", "./chroma_db")
+MANIFEST_PATH = os.path.join(CHROMA_PERSIST_PATH, "kb_manifest.json")
+COLLECTION_NAME = "epargne_retraite"
+COLLECTION_POINTER_PATH = os.path.join(CHROMA_PERSIST_PATH, "active_collection.json")
+# Verrou inter-processus des écritures dans ChromaDB (synchronisation, rechargement, retour arrière)
+KB_LOCK_PATH = os.path.join(CHROMA_PERSIST_PATH, "kb.lock")
+RELOAD_STATE_PATH = os.path.join(CHROMA_PERSIST_PATH, "reload_state.json")
+RELOAD_STATE_INTERVAL = 1  # Publication de l'avancement d'un rechargement (secondes)
+COLLECTION_KEEP_VERSIONS = max(2, int(os.getenv("COLLECTION_KEEP_VERSIONS", "2")))
+COLLECTION_WATCH_INTERVAL = float(os.getenv("COLLECTION_WATCH_INTERVAL", "1"))
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma")
+VECTOR_STORE_DTYPE = os.getenv("VECTOR_STORE_DTYPE", "float16")
+VECTOR_STORE_PATH = os.path.join(CHROMA_PERSIST_PATH, "vectors")
+QUERY_ENCODER = os.getenv("QUERY_ENCODER", "sentence-transformers")
+QUERY_ENCODER_PATH = os.getenv("QUERY_ENCODER_PATH", "./onnx_encoder")
+QUERY_ENCODER_THREADS = int(os.getenv("QUERY_ENCODER_THREADS", "1"))
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() in ("1", "true")
+LEXICAL_SHORTCUT = os.getenv("LEXICAL_SHORTCUT", "true").lower() in ("1", "true")
+LEXICAL_SHORTCUT_SCORE = float(os.getenv("LEXICAL_SHORTCUT_SCORE", "1.5"))
+LEXICAL_SHORTCUT_MARGIN = float(os.getenv("LEXICAL_SHORTCUT_MARGIN", "1.2"))
+EMBEDDING_BATCHING = os.getenv("EMBEDDING_BATCHING", "true").lower() in ("1", "true")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+TOKENIZER_NAME = os.getenv("TOKENIZER_NAME") or None
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "8"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+CONTEXT_MAX_DISTANCE = float(os.getenv("CONTEXT_MAX_DISTANCE")) if os.getenv("CONTEXT_MAX_DISTANCE") else None
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.6"))
+CHUNKER = os.getenv("CHUNKER", "markdown")
+CHUNK_SIZE_TOKENS = int(os.getenv("CHUNK_SIZE_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "false").lower() in ("1", "true")
+INGEST_PROCESSES = int(os.getenv("INGEST_PROCESSES", str(min(4, os.cpu_count() or 1))))
+INGEST_POOL_MIN_FILES = int(os.getenv("INGEST_POOL_MIN_FILES", "32"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+INGEST_THREADS = int(os.getenv("INGEST_THREADS", "2"))
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() in ("1", "true")
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+CHAT_TIMINGS = os.getenv("CHAT_TIMINGS", "false").lower() in ("1", "true")
+SESSIONS_ENABLED = os.getenv("SESSIONS_ENABLED", "true").lower() in ("1", "true")
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "6"))
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "50000"))
+SESSION_MAX_MB = float(os.getenv("SESSION_MAX_MB", "64"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "300"))
+HISTORY_ANSWER_CHARS = int(os.getenv("HISTORY_ANSWER_CHARS", "500"))
+FAQ_ENABLED = os.getenv("FAQ_ENABLED", "true").lower() in ("1", "true")
+FAQ_CONFIG_PATH = os.getenv("FAQ_CONFIG_PATH", "./faq_questions.json")
+FAQ_ANSWERS_PATH = os.getenv("FAQ_ANSWERS_PATH", "./faq_answers.json")
+FAQ_THRESHOLD = float(os.getenv("FAQ_THRESHOLD", "0.9"))
+FAQ_REQUIRE_VETTED = os.getenv("FAQ_REQUIRE_VETTED", "true").lower() in ("1", "true")
+FAQ_AUTO_REBUILD = os.getenv("FAQ_AUTO_REBUILD", "false").lower() in ("1", "true")
 
 # System prompt strict pour le chatbot
 SYSTEM_PROMPT = """Tu es un assistant virtuel spécialisé dans l'épargne retraite française.
@@ -56,285 +146,1293 @@ RÈGLES STRICTES À RESPECTER :
 
 Contexte documentaire :
 {context}
-
+{history}
 Question de l'utilisateur : {question}
 """
 
-# Initialisation de ChromaDB avec embedding
-embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="paraphrase-multilingual-MiniLM-L12-v2"
+# Modèle d'embedding des documents (chargé au préchauffage, ou seulement à la première
+# ingestion si l'encodeur ONNX encode les questions) et client ChromaDB
+embedding_function = None
+chroma_client = None
+_model_lock = threading.Lock()
+
+# Collection pour les documents (version active, voir versions.py)
+collection = None
+
+# Index vectoriel mmap de la version active (VECTOR_STORE=mmap), sinon recherche ChromaDB
+vector_store = None
+
+# Version active dans ce processus et suivi du pointeur partagé entre workers
+active_collection = {"name": None, "pointer_mtime": None, "checked_at": 0.0}
+_activation_lock = threading.Lock()
+
+# Index lexical BM25 (reconstruit à chaque synchronisation ou changement de version)
+lexical_index = None
+lexical_shortcuts = 0
+
+# État du préchauffage (processus courant)
+service_state = {
+    "status": "starting",
+    "error": None,
+    "pid": None,
+    "started_at": None,
+    "ready_at": None
+}
+
+# Client Ollama partagé (pool de connexions + limite de concurrence)
+llm = OllamaClient(
+    OLLAMA_URL,
+    OLLAMA_MODEL,
+    options=OLLAMA_OPTIONS,
+    max_in_flight=OLLAMA_MAX_IN_FLIGHT,
+    max_waiting=OLLAMA_MAX_QUEUE,
+    queue_timeout=OLLAMA_QUEUE_TIMEOUT,
+    timeout=OLLAMA_TIMEOUT,
+    max_retries=OLLAMA_MAX_RETRIES
 )
 
-# Client ChromaDB persistant
-chroma_client = chromadb.PersistentClient(path=CHROMA_PERSIST_PATH)
+# Découpage des documents
+chunker = create_chunker(
+    CHUNKER,
+    **({"max_tokens": CHUNK_SIZE_TOKENS, "overlap_tokens": CHUNK_OVERLAP_TOKENS} if CHUNKER == "markdown" else {})
+)
 
-# Collection pour les documents
-collection = None
+# Comptage des tokens du modèle de génération
+token_counter = TokenCounter(OLLAMA_MODEL, TOKENIZER_NAME)
+
+# Encodeur ONNX des questions (QUERY_ENCODER=onnx), chargé au préchauffage
+query_encoder = OnnxQueryEncoder(
+    QUERY_ENCODER_PATH,
+    threads=QUERY_ENCODER_THREADS
+) if QUERY_ENCODER == "onnx" else None
+
+# Regroupement des embeddings de questions concurrentes
+embedding_batcher = EmbeddingBatcher(
+    lambda texts: encode_queries(texts),
+    max_batch_size=EMBEDDING_BATCH_SIZE,
+    max_wait_ms=EMBEDDING_BATCH_WAIT_MS
+) if EMBEDDING_BATCHING else None
+
+# Cache des réponses (exact puis sémantique)
+answer_cache = AnswerCache(
+    max_size=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    threshold=ANSWER_CACHE_THRESHOLD
+) if ANSWER_CACHE_ENABLED else None
+
+# Réponses précalculées de la FAQ (construites par `python faq.py`)
+faq_index = FAQIndex(threshold=FAQ_THRESHOLD, require_vetted=FAQ_REQUIRE_VETTED) if FAQ_ENABLED else None
+_faq_rebuild_lock = threading.Lock()
+
+# Historique des conversations (par session_id fourni par le client)
+session_store = SessionStore(
+    max_turns=SESSION_MAX_TURNS,
+    idle_ttl=SESSION_IDLE_TTL,
+    max_sessions=SESSION_MAX_SESSIONS,
+    max_bytes=int(SESSION_MAX_MB * 1024 * 1024),
+    max_answer_chars=HISTORY_ANSWER_CHARS
+) if SESSIONS_ENABLED else None
+
+
+def load_embedding_function():
+    """Charge le modèle sentence-transformers une seule fois par processus (ou dans le maître en preload)"""
+    global embedding_function
+
+    with _model_lock:
+        if embedding_function is None:
+            from chromadb.utils import embedding_functions
+
+            embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
+                model_name=EMBEDDING_MODEL
+            )
+
+    return embedding_function
+
+
+def embed_documents(texts: list) -> list:
+    """Embeddings des chunks à l'ingestion : le modèle n'est chargé qu'au premier lot à encoder"""
+    return load_embedding_function()(texts)
+
+
+def connect_vector_db():
+    """Ouvre le client ChromaDB et la version active de la collection (sans synchronisation)"""
+    global chroma_client, collection
+
+    # Le client SQLite de ChromaDB est ouvert dans chaque worker, jamais avant le fork
+    import chromadb
+    chroma_client = chromadb.PersistentClient(path=CHROMA_PERSIST_PATH)
+
+    mtime = pointer_mtime(COLLECTION_POINTER_PATH)
+    name = load_pointer(COLLECTION_POINTER_PATH)["active"] or COLLECTION_NAME
+    # Sans modèle chargé (encodeur ONNX), la collection est lue et écrite par embeddings
+    collection = chroma_client.get_or_create_collection(
+        name=name,
+        embedding_function=embedding_function
+    )
+    active_collection.update({"name": name, "pointer_mtime": mtime})
 
 
-def load_markdown_files():
-    """Charge et découpe les fichiers markdown en chunks"""
-    chunks = []
-    metadatas = []
-    ids = []
-
-    # Chemin absolu vers la base de connaissances
-    kb_path = os.path.abspath(os.path.join(os.path.dirname(__file__), KNOWLEDGE_BASE_PATH))
-
-    # Chercher tous les fichiers markdown
-    md_files = glob.glob(os.path.join(kb_path, "*.md"))
-
-    chunk_id = 0
-    for file_path in md_files:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        filename = os.path.basename(file_path)
-
-        # Découper en sections basées sur les titres
-        sections = content.split('\n## ')
-
-        for i, section in enumerate(sections):
-            if i == 0:
-                # Première section (peut contenir le titre principal)
-                section_text = section
-            else:
-                section_text = '## ' + section
-
-            # Découper les sections longues en chunks plus petits
-            if len(section_text) > 1500:
-                # Découper par paragraphes
-                paragraphs = section_text.split('\n\n')
-                current_chunk = ""
-
-                for para in paragraphs:
-                    if len(current_chunk) + len(para) < 1500:
-                        current_chunk += para + "\n\n"
-                    else:
-                        if current_chunk.strip():
-                            chunks.append(current_chunk.strip())
-                            metadatas.append({"source": filename, "chunk": chunk_id})
-                            ids.append(f"chunk_{chunk_id}")
-                            chunk_id += 1
-                        current_chunk = para + "\n\n"
-
-                if current_chunk.strip():
-                    chunks.append(current_chunk.strip())
-                    metadatas.append({"source": filename, "chunk": chunk_id})
-                    ids.append(f"chunk_{chunk_id}")
-                    chunk_id += 1
-            else:
-                if section_text.strip():
-                    chunks.append(section_text.strip())
-                    metadatas.append({"source": filename, "chunk": chunk_id})
-                    ids.append(f"chunk_{chunk_id}")
-                    chunk_id += 1
-
-    return chunks, metadatas, ids
+def version_manifest_path(name: str = None) -> str:
+    """Manifeste d'une version de la collection (par défaut la version active)"""
+    name = name or active_collection["name"]
+    if name == COLLECTION_NAME:
+        return MANIFEST_PATH
+    return os.path.join(CHROMA_PERSIST_PATH, f"kb_manifest.{name}.json")
 
 
-def init_vector_db():
-    """Initialise ou charge la base vectorielle"""
-    global collection
+def warm_up():
+    """Préchauffage : modèle d'embedding, client ChromaDB puis ouverture de la version active"""
+    try:
+        # Encodeur ONNX chargé : sentence-transformers n'est chargé que si ce worker ingère
+        if query_encoder is None or not query_encoder.load():
+            load_embedding_function()
+        token_counter.load()
+        # Un seul processus à la fois : si la base de connaissances a changé, le premier
+        # worker publie une nouvelle version, les suivants l'ouvrent sans rien encoder
+        with file_lock(KB_LOCK_PATH):
+            connect_vector_db()
+            init_vector_db()
+        service_state["status"] = "ready"
+        service_state["ready_at"] = time.time()
+        print(f"Service prêt en {service_state['ready_at'] - service_state['started_at']:.1f}s")
+    except Exception as e:
+        service_state["status"] = "error"
+        service_state["error"] = str(e)
+        print(f"Échec du préchauffage : {e}")
+
+
+def start_warm_up():
+    """Lance le préchauffage en arrière-plan, une seule fois par processus"""
+    # Processus auxiliaire du pool de découpage (spawn) : rien à préchauffer
+    if multiprocessing.parent_process() is not None:
+        return
+
+    with _model_lock:
+        if service_state["pid"] == os.getpid():
+            return
+        service_state.update({
+            "status": "starting",
+            "error": None,
+            "pid": os.getpid(),
+            "started_at": time.time(),
+            "ready_at": None
+        })
+
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+def is_ready() -> bool:
+    return service_state["status"] == "ready" and service_state["pid"] == os.getpid()
+
 
-    # Essayer de récupérer la collection existante
+def get_kb_path() -> str:
+    """Chemin absolu vers la base de connaissances"""
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), KNOWLEDGE_BASE_PATH))
+
+
+def rebuild_lexical_index(source=None):
+    """Reconstruit l'index BM25 sur les chunks de la collection (par défaut la version active)"""
+    global lexical_index
+
+    data = (source or collection).get(include=["documents", "metadatas"])
+    # Remplacement atomique : les requêtes en cours gardent l'ancien index
+    lexical_index = BM25Index(data["ids"], data["documents"], [m or {} for m in data["metadatas"]])
+
+
+def open_vector_store(source, name: str):
+    """
+    Index mmap d'une version de la collection (None si VECTOR_STORE=chroma).
+    L'export n'est refait que si les chunks ont changé, par un seul worker : les
+    autres ouvrent les fichiers qu'il a publiés.
+    """
+    if VECTOR_STORE != "mmap":
+        return None
+    return MmapVectorStore(ensure_export(source, os.path.join(VECTOR_STORE_PATH, name), VECTOR_STORE_DTYPE))
+
+
+def ingest(target, manifest_path: str, dry_run: bool = False, progress: IngestionProgress = None) -> dict:
+    """Synchronise une collection avec la base de connaissances (pipeline d'ingestion)"""
+    return run_sync(
+        target,
+        get_kb_path(),
+        manifest_path,
+        chunker,
+        embed_documents,
+        processes=INGEST_PROCESSES,
+        batch_size=INGEST_BATCH_SIZE,
+        threads=INGEST_THREADS,
+        pool_min_files=INGEST_POOL_MIN_FILES,
+        dry_run=dry_run,
+        progress=progress
+    )
+
+
+def pending_changes(progress: IngestionProgress = None) -> dict:
+    """
+    Diff entre la base de connaissances et la version active de la collection, sans
+    rien écrire : la version active n'est jamais modifiée sur place (d'autres workers
+    la servent), les changements passent par build_collection_version.
+    """
+    result = ingest(collection, version_manifest_path(), dry_run=True, progress=progress)
+    return {**result["report"], "stages": result["stages"]}
+
+
+def has_changes(report: dict) -> bool:
+    return any(report[key] for key in ("files_added", "files_modified", "files_removed",
+                                       "chunks_added", "chunks_updated", "chunks_deleted"))
+
+
+def refresh_faq(manifest_files: dict):
+    """Recharge l'index de la FAQ ; régénère en arrière-plan les réponses périmées si FAQ_AUTO_REBUILD"""
+    if faq_index is None:
+        return
+    stale = faq_index.load(
+        load_faq_config(FAQ_CONFIG_PATH),
+        load_answers(FAQ_ANSWERS_PATH),
+        manifest_files,
+        encode_queries
+    )
+    if stale:
+        print(f"FAQ : {len(stale)} réponse(s) à (re)construire : {', '.join(stale)}")
+        if FAQ_AUTO_REBUILD:
+            threading.Thread(target=rebuild_faq, name="faq-rebuild", daemon=True).start()
+
+
+def generate_faq_answer(question: str) -> dict:
+    """Réponse d'une question de la FAQ par le pipeline complet (recherche, prompt, génération)"""
+    hits = retrieve(question, CONTEXT_CANDIDATES)
+    prompt, used_hits, _ = build_prompt(question, hits)
+    completion = llm.complete(prompt)
+    return {
+        "response": completion["response"],
+        "sources": sources_from_hits(used_hits),
+        "chunks": chunks_from_hits(used_hits)
+    }
+
+
+def rebuild_faq(force: bool = False, ids: list = None) -> dict:
+    """Construit les réponses de la FAQ manquantes ou périmées, puis recharge l'index"""
+    if not _faq_rebuild_lock.acquire(blocking=False):
+        return {"status": "already_running"}
     try:
-        collection = chroma_client.get_collection(
-            name="epargne_retraite",
-            embedding_function=embedding_function
+        manifest_files = load_manifest(version_manifest_path(), chunker.signature())["files"]
+        answers, report = build_answers(
+            load_faq_config(FAQ_CONFIG_PATH),
+            load_answers(FAQ_ANSWERS_PATH),
+            manifest_files,
+            generate_faq_answer,
+            force=force,
+            ids=ids
         )
-        print(f"Collection existante chargée avec {collection.count()} documents")
-    except:
-        # Créer une nouvelle collection
-        collection = chroma_client.create_collection(
-            name="epargne_retraite",
-            embedding_function=embedding_function
+        save_answers(FAQ_ANSWERS_PATH, answers)
+        if faq_index is not None:
+            faq_index.load(load_faq_config(FAQ_CONFIG_PATH), answers, manifest_files, encode_queries)
+        return {"status": "success", **report}
+    finally:
+        _faq_rebuild_lock.release()
+
+
+def collection_names() -> set:
+    return {c.name for c in chroma_client.list_collections()}
+
+
+def drop_collection_version(name: str):
+    """Supprime une version de la collection et son manifeste"""
+    try:
+        chroma_client.delete_collection(name)
+    except Exception:
+        pass
+    if os.path.exists(version_manifest_path(name)):
+        os.remove(version_manifest_path(name))
+    shutil.rmtree(os.path.join(VECTOR_STORE_PATH, name), ignore_errors=True)
+
+
+def activate_collection(name: str):
+    """
+    Bascule ce processus sur une version de la collection : index BM25 et FAQ
+    reconstruits sur cette version, cache des réponses vidé.
+    """
+    global collection, vector_store
+
+    target = chroma_client.get_collection(name=name, embedding_function=embedding_function)
+    if HYBRID_SEARCH:
+        rebuild_lexical_index(target)
+    target_store = open_vector_store(target, name)
+    # Changement de référence atomique : une requête en cours garde l'ancienne version
+    collection = target
+    vector_store = target_store
+    active_collection["name"] = name
+    if answer_cache:
+        answer_cache.clear()
+    refresh_faq(load_manifest(version_manifest_path(name), chunker.signature())["files"])
+    print(f"Collection active : {name} ({target.count()} documents)")
+
+
+def follow_pointer(mtime):
+    try:
+        name = load_pointer(COLLECTION_POINTER_PATH)["active"] or COLLECTION_NAME
+        if name != active_collection["name"]:
+            activate_collection(name)
+        active_collection["pointer_mtime"] = mtime
+    except Exception as e:
+        print(f"Changement de version de la collection impossible : {e}")
+    finally:
+        _activation_lock.release()
+
+
+def follow_active_collection():
+    """
+    Suit le pointeur de version active (bascule faite par un autre worker ou par la
+    ligne de commande) : vérifié au plus une fois par COLLECTION_WATCH_INTERVAL,
+    la bascule se fait en arrière-plan, l'ancienne version sert en attendant.
+    """
+    now = time.monotonic()
+    if now - active_collection["checked_at"] < COLLECTION_WATCH_INTERVAL:
+        return
+    active_collection["checked_at"] = now
+
+    mtime = pointer_mtime(COLLECTION_POINTER_PATH)
+    if mtime == active_collection["pointer_mtime"] or not _activation_lock.acquire(blocking=False):
+        return
+    threading.Thread(target=follow_pointer, args=(mtime,), name="collection-switch", daemon=True).start()
+
+
+def catch_up_active_collection():
+    """
+    Bascule immédiatement sur la version désignée par le pointeur (appelé sous le verrou
+    KB_LOCK_PATH, avant de construire ou de quitter une version : un autre processus a
+    pu en publier une pendant l'attente du verrou).
+    """
+    with _activation_lock:
+        mtime = pointer_mtime(COLLECTION_POINTER_PATH)
+        name = load_pointer(COLLECTION_POINTER_PATH)["active"] or COLLECTION_NAME
+        if name != active_collection["name"]:
+            activate_collection(name)
+        active_collection["pointer_mtime"] = mtime
+
+
+def build_collection_version(full: bool = False, progress: IngestionProgress = None):
+    """
+    Construit une nouvelle version de la collection à côté de la version active, qui
+    continue de servir : copie de la version active (embeddings compris, sauf `full`)
+    puis synchronisation incrémentale. En cas d'échec la version partielle est supprimée.
+    Renvoie (nom de la version, résultat de l'ingestion).
+    """
+    name = new_version_name(COLLECTION_NAME, collection_names())
+    target = chroma_client.create_collection(name=name, embedding_function=embedding_function)
+    try:
+        if not full:
+            copy_collection(collection, target, batch_size=INGEST_BATCH_SIZE, progress=progress)
+            if os.path.exists(version_manifest_path()):
+                shutil.copyfile(version_manifest_path(), version_manifest_path(name))
+        result = ingest(target, version_manifest_path(name), progress=progress)
+        if target.count() == 0:
+            raise ValueError("La nouvelle version de la collection est vide")
+    except Exception:
+        drop_collection_version(name)
+        raise
+    return name, result
+
+
+def promote_collection_version(name: str, full: bool = False):
+    """Rend une version active (ici, puis dans les autres workers via le pointeur)"""
+    with _activation_lock:
+        # Une version vide (première installation) n'est pas gardée pour un retour arrière
+        current = active_collection["name"] if collection.count() else None
+        activate_collection(name)
+        pointer, dropped = promote(
+            load_pointer(COLLECTION_POINTER_PATH),
+            current,
+            {"name": name, "created_at": time.time(), "documents": collection.count(), "full": full},
+            keep=COLLECTION_KEEP_VERSIONS
         )
+        save_pointer(COLLECTION_POINTER_PATH, pointer)
+        active_collection["pointer_mtime"] = pointer_mtime(COLLECTION_POINTER_PATH)
+
+    for old_name in dropped:
+        drop_collection_version(old_name)
+
+
+def rollback_collection() -> dict:
+    """
+    Revient à la version précédente de la collection (gardée lors de la dernière bascule).
+    Appelé sous le verrou KB_LOCK_PATH.
+    """
+    catch_up_active_collection()
+    with _activation_lock:
+        current = active_collection["name"]
+        pointer = rollback(load_pointer(COLLECTION_POINTER_PATH), current)
+        if pointer["active"] not in collection_names():
+            raise ValueError(f"La version {pointer['active']} n'existe plus")
+        activate_collection(pointer["active"])
+        save_pointer(COLLECTION_POINTER_PATH, pointer)
+        active_collection["pointer_mtime"] = pointer_mtime(COLLECTION_POINTER_PATH)
+    return collection_versions()
+
+
+def collection_versions() -> dict:
+    """Version active de ce processus et versions connues du pointeur"""
+    pointer = load_pointer(COLLECTION_POINTER_PATH)
+    return {
+        "active": active_collection["name"],
+        "previous": pointer["previous"],
+        "versions": pointer["versions"]
+    }
 
-        # Charger les documents
-        chunks, metadatas, ids = load_markdown_files()
 
-        if chunks:
-            # Ajouter par lots de 100
-            batch_size = 100
-            for i in range(0, len(chunks), batch_size):
-                batch_chunks = chunks[i:i+batch_size]
-                batch_metadatas = metadatas[i:i+batch_size]
-                batch_ids = ids[i:i+batch_size]
+def init_vector_db():
+    """
+    Ouvre la version active ouverte par connect_vector_db (sous KB_LOCK_PATH). Si la base
+    de connaissances a changé depuis (ou si rien n'est encore indexé), une nouvelle version
+    est construite puis activée, comme pour un rechargement.
+    """
+    report = pending_changes()
+    if collection.count() and not has_changes(report):
+        with _activation_lock:
+            activate_collection(active_collection["name"])
+        return
+
+    full = collection.count() == 0
+    name, result = build_collection_version(full=full)
+    promote_collection_version(name, full=full)
+    report = result["report"]
+    print(
+        f"Nouvelle version {name} ({report['chunks_added']} chunks ajoutés, "
+        f"{report['chunks_updated']} mis à jour, {report['chunks_deleted']} supprimés)"
+    )
 
-                collection.add(
-                    documents=batch_chunks,
-                    metadatas=batch_metadatas,
-                    ids=batch_ids
-                )
 
-            print(f"Nouvelle collection créée avec {len(chunks)} chunks")
-        else:
-            print("Aucun document trouvé dans la base de connaissances")
+def encode_queries(texts: list) -> list:
+    """Embeddings de questions : encodeur ONNX s'il est chargé, sinon modèle de la collection"""
+    if query_encoder is not None and query_encoder.loaded:
+        return query_encoder(texts)
+    return (embedding_function or load_embedding_function())(texts)
 
 
-def search_relevant_chunks(query: str, n_results: int = 5) -> str:
-    """Recherche les chunks les plus pertinents pour une requête"""
+def embed_query(query: str) -> list:
+    """Embedding d'une question avec le modèle de la collection (par lots si activé)"""
+    if embedding_batcher is not None:
+        return embedding_batcher.embed(query)
+    return encode_queries([query])[0]
+
+
+def vector_search(query: str, n_results: int = 5, query_embedding=None) -> list:
+    """
+    Recherche vectorielle des chunks les plus proches d'une requête.
+    Une seule requête renvoie documents, métadonnées et distances :
+    chaque résultat est un dict {id, document, metadata, distance}.
+    Si l'embedding de la question est déjà calculé, il est réutilisé.
+    Avec VECTOR_STORE=mmap, la recherche se fait dans l'index mmap de la version active.
+    """
     if collection is None:
-        return ""
+        return []
+
+    if query_embedding is None:
+        query_embedding = embed_query(query)
+
+    store = vector_store
+    if store is not None:
+        return store.query(query_embedding, n_results)
 
     results = collection.query(
-        query_texts=[query],
-        n_results=n_results
+        query_embeddings=[query_embedding],
+        n_results=n_results,
+        include=["documents", "metadatas", "distances"]
     )
 
-    if results and results['documents'] and results['documents'][0]:
-        # Combiner les chunks pertinents
-        context = "\n\n---\n\n".join(results['documents'][0])
-        return context
+    if not results or not results['ids'] or not results['ids'][0]:
+        return []
+
+    return [
+        {
+            "id": chunk_id,
+            "document": document,
+            "metadata": metadata or {},
+            "distance": distance
+        }
+        for chunk_id, document, metadata, distance in zip(
+            results['ids'][0],
+            results['documents'][0],
+            results['metadatas'][0],
+            results['distances'][0]
+        )
+    ]
+
+
+def lexical_search(query: str, n_results: int = 5) -> list:
+    """Recherche BM25 (vide si la recherche hybride est désactivée)"""
+    index = lexical_index
+    if index is None:
+        return []
+    return index.search(query, n_results)
 
-    return ""
+
+def retrieve(query: str, n_results: int = 5, query_embedding=None, lexical_hits=None) -> list:
+    """
+    Recherche hybride : résultats vectoriels et BM25 fusionnés par Reciprocal Rank Fusion.
+    Chaque liste fournit deux fois plus de candidats que de résultats retenus.
+    """
+    if not HYBRID_SEARCH:
+        return vector_search(query, n_results, query_embedding)
+
+    if lexical_hits is None:
+        lexical_hits = lexical_search(query, n_results * 2)
+
+    vector_hits = vector_search(query, n_results * 2, query_embedding)
+    return reciprocal_rank_fusion([vector_hits, lexical_hits], n_results)
+
+
+def format_context(hits: list) -> str:
+    """Combine les chunks pertinents en un contexte pour le prompt"""
+    return "\n\n---\n\n".join(hit["document"] for hit in hits)
+
+
+def search_relevant_chunks(query: str, n_results: int = 5) -> str:
+    """Recherche les chunks les plus pertinents pour une requête"""
+    return format_context(retrieve(query, n_results))
+
+
+def sources_from_hits(hits: list, n_sources: int = 3) -> list:
+    """Fichiers sources des meilleurs résultats, sans doublon, par pertinence"""
+    sources = []
+    for hit in hits[:n_sources]:
+        source = hit["metadata"].get('source', 'inconnu')
+        if source not in sources:
+            sources.append(source)
+    return sources
+
+
+def chunks_from_hits(hits: list) -> list:
+    """Références des chunks utilisés (id, source, distance) pour la réponse"""
+    return [
+        {
+            "id": hit["id"],
+            "source": hit["metadata"].get('source', 'inconnu'),
+            "section": hit["metadata"].get('heading_path'),
+            "start_char": hit["metadata"].get('start_char'),
+            "end_char": hit["metadata"].get('end_char'),
+            "distance": round(hit["distance"], 4) if hit["distance"] is not None else None,
+            "bm25": round(hit["bm25"], 4) if hit.get("bm25") is not None else None
+        }
+        for hit in hits
+    ]
 
 
 def query_ollama(prompt: str) -> str:
-    """Envoie une requête à Ollama et récupère la réponse"""
+    """Envoie une requête à Ollama et récupère la réponse (ou le message d'erreur)"""
     try:
-        response = requests.post(
-            f"{OLLAMA_URL}/api/generate",
-            json={
-                "model": OLLAMA_MODEL,
-                "prompt": prompt,
-                "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                    "num_predict": 1024
-                }
-            },
-            timeout=120
-        )
+        return llm.generate(prompt)
+    except OllamaError as e:
+        return str(e)
 
-        if response.status_code == 200:
-            return response.json().get("response", "Désolé, je n'ai pas pu générer de réponse.")
-        else:
-            return f"Erreur de communication avec le modèle de langage (code {response.status_code})."
 
-    except requests.exceptions.ConnectionError:
-        return "Le service de génération de texte n'est pas disponible. Veuillez réessayer plus tard."
-    except requests.exceptions.Timeout:
-        return "La requête a pris trop de temps. Veuillez réessayer avec une question plus simple."
-    except Exception as e:
-        return f"Une erreur inattendue s'est produite : {str(e)}"
+def sse_event(event: str, data) -> str:
+    """Formate un événement Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Endpoint de vérification de l'état du service"""
+def sources_event(prepared: dict) -> dict:
+    """Premier événement du flux : sources et comptage des tokens du prompt"""
+    return {"sources": prepared["sources"], "chunks": prepared["chunks"], "usage": prepared["usage"]}
+
+
+def cached_events(cached: dict):
+    """Événements SSE d'une réponse servie depuis le cache"""
+    yield sse_event("sources", {"sources": cached["sources"], "chunks": cached["chunks"]})
+    yield sse_event("token", {"text": cached["response"]})
+    yield sse_event("done", {**cached, "cached": True})
+
+
+@bp.route('/health/live', methods=['GET'])
+def liveness():
+    """Liveness : le processus répond, même pendant le préchauffage"""
+    return jsonify({"status": "alive"})
+
+
+@bp.route('/health/ready', methods=['GET'])
+def readiness():
+    """Readiness : modèle chargé et collection synchronisée"""
+    ready = is_ready()
     return jsonify({
-        "status": "healthy",
+        "status": "ready" if ready else service_state["status"],
+        "error": service_state["error"]
+    }), 200 if ready else 503
+
+
+def health_payload() -> dict:
+    """État du service et de ses composants"""
+    return {
+        "status": "healthy" if is_ready() else service_state["status"],
         "ollama_url": OLLAMA_URL,
         "model": OLLAMA_MODEL,
-        "documents_count": collection.count() if collection else 0
-    })
+        "documents_count": collection.count() if collection else 0,
+        "collection": active_collection["name"],
+        "vector_store": vector_store.info() if vector_store else {"backend": "chroma"},
+        "query_encoder": query_encoder.info() if query_encoder else {"backend": "sentence-transformers"},
+        # Modèle des documents : chargé seulement si ce worker encode des questions ou ingère
+        "embedding_model_loaded": embedding_function is not None,
+        "answer_cache": answer_cache.info() if answer_cache else None,
+        "llm": llm.info(),
+        "token_counter": token_counter.info(),
+        "embedding_batcher": embedding_batcher.info() if embedding_batcher else None,
+        "sessions": session_store.info() if session_store else None,
+        "faq": faq_index.info() if faq_index else None,
+        "lexical_index": {
+            **lexical_index.info(),
+            "shortcuts": lexical_shortcuts
+        } if lexical_index else None
+    }
+
+
+@bp.route('/health', methods=['GET'])
+def health_check():
+    """Endpoint de vérification de l'état du service"""
+    return jsonify(health_payload())
+
+
+def service_collector():
+    """Valeurs lues à chaque collecte de /metrics : état, collection, caches et lots"""
+    families = [
+        ("chatbot_ready", "gauge", "1 si le service est prêt (préchauffage terminé)",
+         [({}, 1 if is_ready() else 0)]),
+        ("chatbot_collection_chunks", "gauge", "Chunks indexés dans la collection",
+         [({}, collection.count() if collection else 0)]),
+        ("chatbot_lexical_shortcuts_total", "counter", "Questions servies par BM25 seul (sans embedding)",
+         [({}, lexical_shortcuts)])
+    ]
+    if answer_cache:
+        info = answer_cache.info()
+        families += [
+            ("chatbot_answer_cache_entries", "gauge", "Réponses en cache", [({}, info["size"])]),
+            ("chatbot_answer_cache_lookups_total", "counter", "Consultations du cache par résultat", [
+                ({"result": "exact_hit"}, info["exact_hits"]),
+                ({"result": "semantic_hit"}, info["semantic_hits"]),
+                ({"result": "miss"}, info["misses"])
+            ])
+        ]
+    if session_store:
+        info = session_store.info()
+        families += [
+            ("chatbot_sessions", "gauge", "Sessions de conversation en mémoire", [({}, info["sessions"])]),
+            ("chatbot_session_bytes", "gauge", "Mémoire estimée des sessions (octets)", [({}, info["bytes"])]),
+            ("chatbot_sessions_removed_total", "counter", "Sessions supprimées par cause", [
+                ({"reason": "expired"}, info["expired"]),
+                ({"reason": "evicted"}, info["evicted"])
+            ])
+        ]
+    if embedding_batcher:
+        info = embedding_batcher.info()
+        families += [
+            ("chatbot_embedding_batches_total", "counter", "Lots d'embeddings calculés", [({}, info["batches"])]),
+            ("chatbot_embedding_items_total", "counter", "Questions encodées par lots", [({}, info["items"])])
+        ]
+    return families
+
+
+registry.set_collector("service", service_collector)
+registry.set_collector("ollama", ollama_collector(llm))
+
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Métriques au format texte Prometheus (processus courant)"""
+    return Response(registry.render(), content_type=CONTENT_TYPE)
+
+
+@bp.before_request
+def track_chat_start():
+    if request.path.startswith("/chat"):
+        REQUESTS_IN_FLIGHT.inc()
+
+
+@bp.teardown_request
+def track_chat_end(error=None):
+    # Avec stream_with_context, appelé à la fin du flux et non au retour de la vue
+    if request.path.startswith("/chat"):
+        REQUESTS_IN_FLIGHT.dec()
+
+
+def not_ready_response():
+    """Réponse 503 tant que le préchauffage n'est pas terminé"""
+    response = jsonify({"error": "Le service démarre, veuillez réessayer dans quelques instants."})
+    response.status_code = 503
+    response.headers["Retry-After"] = "5"
+    return response
+
+
+def busy_response(error: OllamaBusyError):
+    """Réponse 503 avec Retry-After quand Ollama est saturé"""
+    response = jsonify({"error": str(error)})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+def validate_message(data):
+    """Valide le corps de la requête et renvoie (message, erreur)"""
+    if not data or 'message' not in data:
+        return None, "Le champ 'message' est requis"
+
+    user_message = data['message'].strip()
+
+    if not user_message:
+        return None, "Le message ne peut pas être vide"
+
+    # Limiter la longueur du message
+    if len(user_message) > 1000:
+        return None, "Le message est trop long (maximum 1000 caractères)"
+
+    return user_message, None
+
+
+def validate_session_id(data):
+    """Identifiant de session facultatif (8 à 64 caractères alphanumériques, - ou _) : (id, erreur)"""
+    session_id = data.get('session_id') if isinstance(data, dict) else None
+    if session_id is None:
+        return None, None
+    if not isinstance(session_id, str) or not SESSION_ID_PATTERN.match(session_id):
+        return None, "Le champ 'session_id' est invalide (8 à 64 caractères : lettres, chiffres, - ou _)"
+    return session_id, None
+
+
+def build_prompt(user_message: str, hits: list, history: tuple = ()):
+    """
+    Construit le prompt complet à partir des chunks retrouvés, sous budget de tokens,
+    et des derniers échanges de la session (budget séparé HISTORY_TOKEN_BUDGET).
+    Renvoie (prompt, chunks réellement utilisés, comptage des tokens).
+    """
+    selected, context, usage = build_context(
+        hits,
+        token_counter,
+        CONTEXT_TOKEN_BUDGET,
+        max_distance=CONTEXT_MAX_DISTANCE,
+        dedup_threshold=CONTEXT_DEDUP_THRESHOLD
+    )
 
+    if not context:
+        context = "Aucun contexte spécifique trouvé. Réponds de manière générale sur l'épargne retraite."
 
-@app.route('/chat', methods=['POST'])
+    conversation = format_history(history, token_counter, HISTORY_TOKEN_BUDGET) if history else ""
+    usage["history_tokens"] = token_counter.count(conversation) if conversation else 0
+
+    prompt = SYSTEM_PROMPT.format(
+        context=context,
+        history=f"\nÉchanges précédents de la conversation :\n{conversation}\n" if conversation else "",
+        question=user_message
+    )
+    usage["prompt_tokens"] = token_counter.count(prompt)
+    usage["exact_count"] = token_counter.exact
+
+    return prompt, selected, usage
+
+
+def record_prompt_usage(prompt: str, usage: dict, stats: dict):
+    """Complète le comptage avec les tokens réellement évalués par Ollama"""
+    usage["evaluated_prompt_tokens"] = stats.get("prompt_eval_count")
+    usage["completion_tokens"] = stats.get("eval_count")
+    token_counter.observe(prompt, stats.get("prompt_eval_count"))
+
+
+def find_context(user_message: str, n_results: int = CONTEXT_CANDIDATES, timings: dict = None,
+                 search_query: str = None, use_cache: bool = True):
+    """
+    Cherche une réponse en cache ou, à défaut, le contexte de la question.
+    Ordre : cache exact, FAQ précalculée (exacte puis par embedding), recherche BM25
+    (si elle suffit, pas d'embedding), cache sémantique, puis recherche hybride
+    réutilisant l'embedding déjà calculé.
+    `search_query` remplace la question pour la recherche (relance reformulée) ;
+    le cache n'est alors pas consulté (use_cache=False).
+    Renvoie (réponse en cache ou None, chunks retrouvés, embedding ou None).
+    """
+    global lexical_shortcuts
+
+    query = search_query or user_message
+    cache = answer_cache if use_cache else None
+    faq = faq_index if use_cache and faq_index is not None and faq_index.size else None
+    query_embedding = None
+
+    if cache is not None:
+        cached = cache.get_exact(user_message)
+        if cached is EXPIRED:
+            # Réponse expirée pour la même question (échec déjà compté) : elle est régénérée
+            cache = None
+        elif cached is not None:
+            return cached, [], None
+
+    if faq is not None:
+        # Réponses précalculées : l'embedding est calculé d'emblée (réutilisé ensuite)
+        answer = faq.match_exact(user_message)
+        if answer is not None:
+            return answer, [], None
+        with timed("embedding", timings):
+            query_embedding = embed_query(query)
+        answer = faq.match(query_embedding)
+        if answer is not None:
+            return answer, [], query_embedding
+
+    with timed("lexical", timings):
+        lexical_hits = lexical_search(query, n_results * 2) if HYBRID_SEARCH else []
+
+    if LEXICAL_SHORTCUT and is_confident(lexical_hits, LEXICAL_SHORTCUT_SCORE, LEXICAL_SHORTCUT_MARGIN):
+        lexical_shortcuts += 1
+        if cache is not None:
+            cache.record_miss()
+        return None, lexical_hits[:n_results], query_embedding
+
+    if query_embedding is None:
+        with timed("embedding", timings):
+            query_embedding = embed_query(query)
+
+    if cache is not None:
+        cached = cache.get_similar(query_embedding)
+        if cached is not None:
+            return cached, [], query_embedding
+
+    with timed("vector_search", timings):
+        hits = retrieve(query, n_results, query_embedding=query_embedding, lexical_hits=lexical_hits)
+    return None, hits, query_embedding
+
+
+def prepare_answer(user_message: str, timings: dict = None, session_id: str = None) -> dict:
+    """
+    Étapes bloquantes avant la génération : cache, recherche et construction du prompt.
+    Avec une session, une relance est recherchée avec le sujet de la conversation et
+    les derniers échanges sont ajoutés au prompt.
+    Renvoie {"cached": réponse} ou {"cached": None, "prompt", "sources", "chunks", "usage", ...}.
+    Les durées des étapes sont ajoutées à `timings` (ms) si fourni.
+    """
+    follow_active_collection()
+    history = session_store.history(session_id) if session_store is not None and session_id else ()
+    topic = conversation_topic(user_message, history)
+    search_query = rewrite_query(user_message, history)
+    # Seules les questions autonomes passent par le cache : la réponse à une relance
+    # dépend de la conversation
+    standalone = topic is user_message
+
+    cached, hits, query_embedding = find_context(
+        user_message,
+        timings=timings,
+        search_query=search_query,
+        use_cache=standalone
+    )
+    if cached is not None:
+        if session_id and session_store is not None:
+            session_store.append(session_id, user_message, topic, cached["response"])
+        return {"cached": cached}
+
+    with timed("prompt", timings):
+        full_prompt, used_hits, usage = build_prompt(user_message, hits, history)
+    if not standalone:
+        usage["search_query"] = search_query
+    return {
+        "cached": None,
+        "prompt": full_prompt,
+        "sources": sources_from_hits(used_hits),
+        "chunks": chunks_from_hits(used_hits),
+        "usage": usage,
+        "query_embedding": query_embedding,
+        "session_id": session_id,
+        "topic": topic,
+        "cacheable": standalone
+    }
+
+
+def observe_prefill(stats: dict, timings: dict = None):
+    """
+    Génération non streamée : le délai avant le premier token est celui mesuré par
+    Ollama (chargement du modèle + évaluation du prompt), s'il est fourni.
+    """
+    prefill = (stats.get("load_duration") or 0) + (stats.get("prompt_eval_duration") or 0)
+    if prefill:
+        observe_stage("first_token", prefill / 1e9, timings)
+
+
+def wants_timings(data) -> bool:
+    """Bloc `timings` dans la réponse : CHAT_TIMINGS=true ou `"timings": true` dans la requête"""
+    return CHAT_TIMINGS or (isinstance(data, dict) and data.get("timings") is True)
+
+
+def store_answer(user_message: str, prepared: dict, response: str, stats: dict) -> dict:
+    """Enregistre une génération aboutie (cache, session, calibration des tokens) et renvoie le résultat"""
+    result = {
+        "response": response,
+        "sources": prepared["sources"],
+        "chunks": prepared["chunks"]
+    }
+    if answer_cache and prepared["cacheable"]:
+        answer_cache.put(user_message, prepared["query_embedding"], result)
+    if prepared["session_id"] and session_store is not None:
+        session_store.append(prepared["session_id"], user_message, prepared["topic"], response)
+    record_prompt_usage(prepared["prompt"], prepared["usage"], stats)
+    return result
+
+
+@bp.route('/chat', methods=['POST'])
 def chat():
     """Endpoint principal du chatbot"""
-    try:
-        data = request.get_json()
+    started = time.perf_counter()
+    timings = {}
+    outcome = "error"
 
-        if not data or 'message' not in data:
-            return jsonify({
-                "error": "Le champ 'message' est requis"
-            }), 400
+    try:
+        if not is_ready():
+            outcome = "not_ready"
+            return not_ready_response()
 
-        user_message = data['message'].strip()
+        data = request.get_json()
+        user_message, error = validate_message(data)
+        if not error:
+            session_id, error = validate_session_id(data)
+
+        if error:
+            outcome = "invalid"
+            return jsonify({"error": error}), 400
+
+        # Rechercher une réponse en cache ou le contexte pertinent, puis construire le prompt
+        prepared = prepare_answer(user_message, timings, session_id)
+        if prepared["cached"] is not None:
+            outcome = "faq" if "faq" in prepared["cached"] else "cached"
+            payload = {**prepared["cached"], "cached": True}
+        else:
+            # Interroger Ollama (seules les réponses abouties sont mises en cache)
+            try:
+                with timed("generation", timings):
+                    completion = llm.complete(prepared["prompt"])
+                observe_prefill(completion["stats"], timings)
+                result = store_answer(user_message, prepared, completion["response"], completion["stats"])
+                outcome = "answered"
+            except OllamaBusyError as e:
+                outcome = "busy"
+                return busy_response(e)
+            except OllamaError as e:
+                outcome = "llm_error"
+                result = {
+                    "response": str(e),
+                    "sources": prepared["sources"],
+                    "chunks": prepared["chunks"]
+                }
+            payload = {**result, "usage": prepared["usage"], "cached": False}
 
-        if not user_message:
-            return jsonify({
-                "error": "Le message ne peut pas être vide"
-            }), 400
+        if wants_timings(data):
+            payload["timings"] = timings_summary(timings, started)
+        return jsonify(payload)
 
-        # Limiter la longueur du message
-        if len(user_message) > 1000:
-            return jsonify({
-                "error": "Le message est trop long (maximum 1000 caractères)"
-            }), 400
+    except Exception as e:
+        return jsonify({
+            "error": f"Erreur interne du serveur : {str(e)}"
+        }), 500
 
-        # Rechercher le contexte pertinent
-        context = search_relevant_chunks(user_message)
+    finally:
+        record_request("chat", outcome, started)
 
-        if not context:
-            context = "Aucun contexte spécifique trouvé. Réponds de manière générale sur l'épargne retraite."
 
-        # Construire le prompt complet
-        full_prompt = SYSTEM_PROMPT.format(
-            context=context,
-            question=user_message
-        )
+@bp.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Variante streaming du chatbot (Server-Sent Events).
+    Événements émis : `sources` (avant la génération), `token` (fragments de texte),
+    puis `done` (réponse complète et statistiques) ou `error`.
+    """
+    started = time.perf_counter()
+    timings = {}
+    outcome = "error"
 
-        # Interroger Ollama
-        response = query_ollama(full_prompt)
+    try:
+        if not is_ready():
+            outcome = "not_ready"
+            return not_ready_response()
 
-        return jsonify({
-            "response": response,
-            "sources": list(set([
-                r.get('source', 'inconnu')
-                for r in (collection.query(query_texts=[user_message], n_results=3)['metadatas'][0] or [])
-            ])) if collection else []
-        })
+        data = request.get_json()
+        user_message, error = validate_message(data)
+        if not error:
+            session_id, error = validate_session_id(data)
+
+        if error:
+            outcome = "invalid"
+            return jsonify({"error": error}), 400
+
+        prepared = prepare_answer(user_message, timings, session_id)
+        cached = prepared["cached"]
+        show_timings = wants_timings(data)
+        generation_started = time.perf_counter()
+
+        if cached is None:
+            try:
+                stream = llm.open_stream(prepared["prompt"])
+            except OllamaBusyError as e:
+                outcome = "busy"
+                return busy_response(e)
+            except OllamaError as e:
+                stream = iter([("error", str(e))])
+            # L'issue est enregistrée à la fin du flux
+            outcome = None
+        else:
+            outcome = "faq" if "faq" in prepared["cached"] else "cached"
 
     except Exception as e:
         return jsonify({
             "error": f"Erreur interne du serveur : {str(e)}"
         }), 500
 
+    finally:
+        if outcome is not None:
+            record_request("chat_stream", outcome, started)
 
-@app.route('/reload', methods=['POST'])
-def reload_knowledge_base():
-    """Recharge la base de connaissances"""
-    global collection
+    def stream_generation():
+        # Client déconnecté avant la fin : issue `interrupted`
+        generation_outcome = "interrupted"
+        first_token = True
+        try:
+            yield sse_event("sources", sources_event(prepared))
+
+            parts = []
+            for kind, value in stream:
+                if kind == "token":
+                    if first_token:
+                        first_token = False
+                        observe_stage("first_token", time.perf_counter() - generation_started, timings)
+                    parts.append(value)
+                    yield sse_event("token", {"text": value})
+                elif kind == "done":
+                    observe_stage("generation", time.perf_counter() - generation_started, timings)
+                    generation_outcome = "answered"
+                    result = store_answer(user_message, prepared, "".join(parts), value)
+                    done = {**result, "stats": value, "usage": prepared["usage"], "cached": False}
+                    if show_timings:
+                        done["timings"] = timings_summary(timings, started)
+                    yield sse_event("done", done)
+                else:
+                    generation_outcome = "llm_error"
+                    yield sse_event("error", {"error": value})
+        finally:
+            record_request("chat_stream", generation_outcome, started)
+
+    return Response(
+        stream_with_context(cached_events(cached) if cached is not None else stream_generation()),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+def forget_session(session_id: str) -> dict:
+    """Oublie l'historique d'une session (nouvelle conversation)"""
+    removed = session_store.clear(session_id) if session_store is not None else False
+    return {"session_id": session_id, "removed": removed}
+
+
+@bp.route('/sessions/<session_id>', methods=['DELETE'])
+def reset_session(session_id):
+    """Efface l'historique d'une conversation"""
+    return jsonify(forget_session(session_id))
 
+
+def reload_collection(dry_run: bool = False, full: bool = False, progress: IngestionProgress = None) -> dict:
+    """
+    Recharge la base de connaissances sans interruption (bleu/vert) : une nouvelle
+    version de la collection est construite (reconstruction complète si `full`) puis
+    devient active d'un coup ; la version précédente est gardée pour un retour arrière.
+    """
+    if dry_run:
+        report = pending_changes(progress=progress)
+        return {
+            "status": "dry_run",
+            "collection": active_collection["name"],
+            "documents_count": collection.count(),
+            "changes": report
+        }
+
+    # Un rechargement à la fois, tous processus confondus (workers, ligne de commande)
+    with file_lock(KB_LOCK_PATH):
+        return publish_collection_version(full=full, progress=progress)
+
+
+def publish_collection_version(full: bool = False, progress: IngestionProgress = None) -> dict:
+    """Construit puis active une nouvelle version (appelé sous le verrou KB_LOCK_PATH)"""
+    catch_up_active_collection()
+    previous = active_collection["name"]
+    name, result = build_collection_version(full=full, progress=progress)
+    promote_collection_version(name, full=full)
+
+    return {
+        "status": "success",
+        "collection": name,
+        "previous": previous,
+        "documents_count": collection.count(),
+        "changes": {**result["report"], "stages": result["stages"]}
+    }
+
+
+# Rechargement en arrière-plan : un seul à la fois, tous workers confondus. Le worker qui le
+# lance garde le verrou KB_LOCK_PATH jusqu'à la fin et publie son état dans RELOAD_STATE_PATH,
+# lu par /reload/status quel que soit le worker qui répond.
+
+
+def run_reload_job(lock, state: dict, progress: IngestionProgress):
+    stop = threading.Event()
+
+    def publish_progress():
+        while not stop.wait(RELOAD_STATE_INTERVAL):
+            save_reload_state(RELOAD_STATE_PATH, {**state, "progress": progress.snapshot()})
+
+    publisher = threading.Thread(target=publish_progress, name="reload-progress", daemon=True)
+    publisher.start()
     try:
-        # Supprimer l'ancienne collection
+        result = publish_collection_version(full=state["full"], progress=progress)
+        state.update({"status": "success", "result": result})
+    except Exception as e:
+        state.update({"status": "error", "error": str(e)})
+        print(f"Échec du rechargement : {e}")
+    finally:
+        stop.set()
+        publisher.join()
+        state.update({"finished_at": time.time(), "progress": progress.snapshot()})
         try:
-            chroma_client.delete_collection("epargne_retraite")
-        except:
-            pass
-
-        # Recréer la collection
-        collection = chroma_client.create_collection(
-            name="epargne_retraite",
-            embedding_function=embedding_function
-        )
-
-        # Charger les documents
-        chunks, metadatas, ids = load_markdown_files()
+            save_reload_state(RELOAD_STATE_PATH, state)
+        finally:
+            release_file_lock(lock)
+
+
+def start_reload(full: bool = False) -> bool:
+    """
+    Lance un rechargement en arrière-plan ; False si la base est déjà en cours de mise
+    à jour (rechargement, retour arrière ou préchauffage d'un autre processus)
+    """
+    lock = acquire_file_lock(KB_LOCK_PATH, blocking=False)
+    if lock is None:
+        return False
+    try:
+        progress = IngestionProgress()
+        state = {
+            **idle_reload_state(),
+            "status": "running",
+            "full": full,
+            "started_at": time.time(),
+            "pid": os.getpid()
+        }
+        save_reload_state(RELOAD_STATE_PATH, state)
+        threading.Thread(target=run_reload_job, args=(lock, state, progress), name="reload", daemon=True).start()
+    except Exception:
+        release_file_lock(lock)
+        raise
+    return True
+
+
+def reload_status() -> dict:
+    """État du dernier rechargement (tous workers confondus) et versions de la collection"""
+    state = load_reload_state(RELOAD_STATE_PATH)
+    if state["status"] == "running":
+        # Verrou libre : le processus qui rechargeait s'est arrêté avant la fin
+        lock = acquire_file_lock(KB_LOCK_PATH, blocking=False)
+        if lock is not None:
+            try:
+                state = load_reload_state(RELOAD_STATE_PATH)
+                if state["status"] == "running":
+                    state.update({"status": "error", "error": "Rechargement interrompu (processus arrêté)",
+                                  "finished_at": time.time()})
+                    save_reload_state(RELOAD_STATE_PATH, state)
+            finally:
+                release_file_lock(lock)
+    return {**state, "collections": collection_versions()}
+
+
+def request_reload(dry_run: bool = False, full: bool = False):
+    """
+    Demande de rechargement : le diff (dry_run) est calculé immédiatement, l'ingestion
+    est lancée en arrière-plan et suivie par /reload/status. Renvoie (corps, code HTTP).
+    """
+    if dry_run:
+        return reload_collection(dry_run=True), 200
+    if not start_reload(full=full):
+        return {"error": "Un rechargement est déjà en cours", "reload": reload_status()}, 409
+    return {"status": "started", "reload": reload_status()}, 202
+
+
+@bp.route('/reload', methods=['POST'])
+def reload_knowledge_base():
+    """
+    Recharge la base de connaissances en arrière-plan (202) dans une nouvelle version
+    de la collection, activée une fois complète (voir /reload/status, /reload/rollback).
+    Paramètres (query string ou JSON) :
+    - dry_run : renvoie le diff sans modifier la collection
+    - full : reconstruit entièrement la nouvelle version (sans copie de la version active)
+    """
+    if not is_ready():
+        return not_ready_response()
 
-        if chunks:
-            batch_size = 100
-            for i in range(0, len(chunks), batch_size):
-                batch_chunks = chunks[i:i+batch_size]
-                batch_metadatas = metadatas[i:i+batch_size]
-                batch_ids = ids[i:i+batch_size]
+    try:
+        data = request.get_json(silent=True) or {}
+        dry_run = str(data.get('dry_run', request.args.get('dry_run', ''))).lower() in ('1', 'true')
+        full = str(data.get('full', request.args.get('full', ''))).lower() in ('1', 'true')
 
-                collection.add(
-                    documents=batch_chunks,
-                    metadatas=batch_metadatas,
-                    ids=batch_ids
-                )
+        payload, status_code = request_reload(dry_run=dry_run, full=full)
+        return jsonify(payload), status_code
 
+    except Exception as e:
         return jsonify({
-            "status": "success",
-            "documents_count": len(chunks)
-        })
+            "error": f"Erreur lors du rechargement : {str(e)}"
+        }), 500
+
+
+def request_rollback():
+    """Retour à la version précédente de la collection ; renvoie (corps, code HTTP)"""
+    lock = acquire_file_lock(KB_LOCK_PATH, blocking=False)
+    if lock is None:
+        return {"error": "Un rechargement est en cours", "reload": reload_status()}, 409
+    try:
+        return {"status": "rolled_back", "collections": rollback_collection()}, 200
+    except ValueError as e:
+        return {"error": str(e), "collections": collection_versions()}, 409
+    finally:
+        release_file_lock(lock)
+
+
+@bp.route('/reload/rollback', methods=['POST'])
+def rollback_knowledge_base():
+    """Réactive la version précédente de la collection"""
+    if not is_ready():
+        return not_ready_response()
 
+    try:
+        payload, status_code = request_rollback()
+        return jsonify(payload), status_code
     except Exception as e:
         return jsonify({
-            "error": f"Erreur lors du rechargement : {str(e)}"
+            "error": f"Erreur lors du retour arrière : {str(e)}"
         }), 500
 
 
-# Initialiser la base vectorielle au démarrage
-with app.app_context():
-    init_vector_db()
+@bp.route('/reload/status', methods=['GET'])
+def reload_status_endpoint():
+    """Avancement et résultat du dernier rechargement"""
+    return jsonify(reload_status())
+
+
+def create_app() -> Flask:
+    """
+    Fabrique de l'application : ne charge rien de lourd.
+    En mode preload, le modèle sentence-transformers est chargé ici (processus maître,
+    sauf si l'encodeur ONNX encode les questions) et le préchauffage de chaque worker
+    est lancé après le fork par gunicorn.conf.py.
+    """
+    flask_app = Flask(__name__)
+    CORS(flask_app)
+    flask_app.register_blueprint(bp)
+
+    if PRELOAD_MODELS:
+        if query_encoder is None:
+            load_embedding_function()
+    else:
+        start_warm_up()
+
+    return flask_app
+
+
+app = create_app()
 
 
 if __name__ == '__main__':
+    start_warm_up()
     app.run(host='0.0.0.0', port=5008, debug=True)
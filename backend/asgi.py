@@ -0,0 +1,325 @@
+"""
+Mode de service asynchrone (ASGI) du chatbot
+Mêmes endpoints que l'application Flask (/health, /chat, /chat/stream, /reload) :
+la recherche et la construction du prompt s'exécutent dans un pool de threads,
+la génération Ollama est non bloquante (httpx), si bien qu'un seul processus peut
+garder des centaines de conversations en attente sans multiplier les workers.
+
+Lancement : uvicorn asgi:app --host 0.0.0.0 --port 5008
+"""
+
+import os
+import time
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse, Response
+from starlette.routing import Route
+
+import app as core
+from llm_client import AsyncOllamaClient, OllamaError, OllamaBusyError
+from metrics import (
+    registry, timed, observe_stage, record_request, timings_summary, ollama_collector,
+    REQUESTS_IN_FLIGHT, CONTENT_TYPE
+)
+
+RETRIEVAL_THREADS = int(os.getenv("RETRIEVAL_THREADS", "8"))
+
+# Pool dédié aux étapes bloquantes (embedding, ChromaDB, BM25, rechargement)
+executor = ThreadPoolExecutor(max_workers=RETRIEVAL_THREADS, thread_name_prefix="retrieval")
+
+llm = AsyncOllamaClient(
+    core.OLLAMA_URL,
+    core.OLLAMA_MODEL,
+    options=core.OLLAMA_OPTIONS,
+    max_in_flight=core.OLLAMA_MAX_IN_FLIGHT,
+    max_waiting=core.OLLAMA_MAX_QUEUE,
+    queue_timeout=core.OLLAMA_QUEUE_TIMEOUT,
+    timeout=core.OLLAMA_TIMEOUT,
+    max_retries=core.OLLAMA_MAX_RETRIES
+)
+
+# Les métriques Ollama sont celles du client asynchrone
+registry.set_collector("ollama", ollama_collector(llm))
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, lambda: func(*args, **kwargs))
+
+
+def error_response(message: str, status_code: int, retry_after=None) -> JSONResponse:
+    headers = {"Retry-After": str(retry_after)} if retry_after is not None else None
+    return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+
+
+def not_ready_response() -> JSONResponse:
+    return error_response("Le service démarre, veuillez réessayer dans quelques instants.", 503, retry_after=5)
+
+
+async def read_message(request):
+    """Lit et valide le corps JSON ; renvoie (message, session_id, timings demandés, réponse d'erreur)"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    user_message, error = core.validate_message(data)
+    if not error:
+        session_id, error = core.validate_session_id(data)
+    if error:
+        return None, None, False, error_response(error, 400)
+    return user_message, session_id, core.wants_timings(data), None
+
+
+async def liveness(request):
+    return JSONResponse({"status": "alive"})
+
+
+async def readiness(request):
+    ready = core.is_ready()
+    return JSONResponse(
+        {"status": "ready" if ready else core.service_state["status"], "error": core.service_state["error"]},
+        status_code=200 if ready else 503
+    )
+
+
+async def health_check(request):
+    payload = await run_blocking(core.health_payload)
+    payload["llm"] = llm.info()
+    payload["mode"] = "asgi"
+    return JSONResponse(payload)
+
+
+async def chat(request):
+    """Endpoint principal du chatbot"""
+    started = time.perf_counter()
+    timings = {}
+    outcome = "error"
+
+    try:
+        if not core.is_ready():
+            outcome = "not_ready"
+            return not_ready_response()
+
+        user_message, session_id, show_timings, error = await read_message(request)
+        if error:
+            outcome = "invalid"
+            return error
+
+        prepared = await run_blocking(core.prepare_answer, user_message, timings, session_id)
+        if prepared["cached"] is not None:
+            outcome = "faq" if "faq" in prepared["cached"] else "cached"
+            payload = {**prepared["cached"], "cached": True}
+        else:
+            try:
+                with timed("generation", timings):
+                    completion = await llm.complete(prepared["prompt"])
+                core.observe_prefill(completion["stats"], timings)
+                result = await run_blocking(
+                    core.store_answer, user_message, prepared, completion["response"], completion["stats"]
+                )
+                outcome = "answered"
+            except OllamaBusyError as e:
+                outcome = "busy"
+                return error_response(str(e), 503, retry_after=e.retry_after)
+            except OllamaError as e:
+                outcome = "llm_error"
+                result = {
+                    "response": str(e),
+                    "sources": prepared["sources"],
+                    "chunks": prepared["chunks"]
+                }
+            payload = {**result, "usage": prepared["usage"], "cached": False}
+
+        if show_timings:
+            payload["timings"] = timings_summary(timings, started)
+        return JSONResponse(payload)
+
+    except Exception as e:
+        return error_response(f"Erreur interne du serveur : {str(e)}", 500)
+
+    finally:
+        record_request("chat", outcome, started)
+
+
+async def chat_stream(request):
+    """Variante streaming (Server-Sent Events), mêmes événements que le mode Flask"""
+    started = time.perf_counter()
+    timings = {}
+    outcome = "error"
+    stream = None
+
+    try:
+        if not core.is_ready():
+            outcome = "not_ready"
+            return not_ready_response()
+
+        user_message, session_id, show_timings, error = await read_message(request)
+        if error:
+            outcome = "invalid"
+            return error
+
+        prepared = await run_blocking(core.prepare_answer, user_message, timings, session_id)
+        generation_started = time.perf_counter()
+        if prepared["cached"] is not None:
+            outcome = "faq" if "faq" in prepared["cached"] else "cached"
+        else:
+            try:
+                stream = await llm.open_stream(prepared["prompt"])
+            except OllamaBusyError as e:
+                outcome = "busy"
+                return error_response(str(e), 503, retry_after=e.retry_after)
+            except OllamaError as e:
+                failure = str(e)
+            # L'issue est enregistrée à la fin du flux
+            outcome = None
+    except Exception as e:
+        return error_response(f"Erreur interne du serveur : {str(e)}", 500)
+    finally:
+        if outcome is not None:
+            record_request("chat_stream", outcome, started)
+
+    async def cached_events():
+        for event in core.cached_events(prepared["cached"]):
+            yield event
+
+    async def generation_events():
+        # Client déconnecté avant la fin : issue `interrupted`
+        generation_outcome = "interrupted"
+        try:
+            yield core.sse_event("sources", core.sources_event(prepared))
+            if stream is None:
+                generation_outcome = "llm_error"
+                yield core.sse_event("error", {"error": failure})
+                return
+
+            parts = []
+            async for kind, value in stream:
+                if kind == "token":
+                    if not parts:
+                        observe_stage("first_token", time.perf_counter() - generation_started, timings)
+                    parts.append(value)
+                    yield core.sse_event("token", {"text": value})
+                elif kind == "done":
+                    observe_stage("generation", time.perf_counter() - generation_started, timings)
+                    generation_outcome = "answered"
+                    result = await run_blocking(core.store_answer, user_message, prepared, "".join(parts), value)
+                    done = {**result, "stats": value, "usage": prepared["usage"], "cached": False}
+                    if show_timings:
+                        done["timings"] = timings_summary(timings, started)
+                    yield core.sse_event("done", done)
+                else:
+                    generation_outcome = "llm_error"
+                    yield core.sse_event("error", {"error": value})
+        finally:
+            # Client déconnecté ou flux terminé : libérer la connexion et la place
+            if stream is not None:
+                await stream.aclose()
+            record_request("chat_stream", generation_outcome, started)
+
+    return StreamingResponse(
+        cached_events() if prepared["cached"] is not None else generation_events(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+async def reload_status(request):
+    """Avancement et résultat du dernier rechargement"""
+    return JSONResponse(await run_blocking(core.reload_status))
+
+
+async def rollback_knowledge_base(request):
+    """Réactive la version précédente de la collection (comme en mode Flask)"""
+    if not core.is_ready():
+        return not_ready_response()
+
+    try:
+        payload, status_code = await run_blocking(core.request_rollback)
+        return JSONResponse(payload, status_code=status_code)
+    except Exception as e:
+        return error_response(f"Erreur lors du retour arrière : {str(e)}", 500)
+
+
+async def metrics_endpoint(request):
+    """Métriques au format texte Prometheus (processus courant)"""
+    return Response(await run_blocking(registry.render), media_type=CONTENT_TYPE)
+
+
+async def reset_session(request):
+    """Efface l'historique d'une conversation"""
+    return JSONResponse(core.forget_session(request.path_params["session_id"]))
+
+
+async def reload_knowledge_base(request):
+    """Recharge la base de connaissances en arrière-plan (dry_run / full, comme en mode Flask)"""
+    if not core.is_ready():
+        return not_ready_response()
+
+    try:
+        try:
+            data = await request.json()
+        except ValueError:
+            data = {}
+        data = data or {}
+        dry_run = str(data.get('dry_run', request.query_params.get('dry_run', ''))).lower() in ('1', 'true')
+        full = str(data.get('full', request.query_params.get('full', ''))).lower() in ('1', 'true')
+
+        payload, status_code = await run_blocking(core.request_reload, dry_run=dry_run, full=full)
+        return JSONResponse(payload, status_code=status_code)
+
+    except Exception as e:
+        return error_response(f"Erreur lors du rechargement : {str(e)}", 500)
+
+
+class InFlightMiddleware:
+    """Compte les requêtes /chat en cours, jusqu'à la fin de la réponse en streaming"""
+
+    def __init__(self, asgi_app):
+        self.app = asgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/chat"):
+            await self.app(scope, receive, send)
+            return
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(asgi_app):
+    core.start_warm_up()
+    yield
+    await llm.aclose()
+    executor.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route('/health/live', liveness, methods=['GET']),
+        Route('/health/ready', readiness, methods=['GET']),
+        Route('/health', health_check, methods=['GET']),
+        Route('/chat', chat, methods=['POST']),
+        Route('/chat/stream', chat_stream, methods=['POST']),
+        Route('/sessions/{session_id}', reset_session, methods=['DELETE']),
+        Route('/reload', reload_knowledge_base, methods=['POST']),
+        Route('/reload/status', reload_status, methods=['GET']),
+        Route('/reload/rollback', rollback_knowledge_base, methods=['POST']),
+        Route('/metrics', metrics_endpoint, methods=['GET'])
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+        Middleware(InFlightMiddleware)
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1 @@
+"""Outils de mesure de performance du backend chatbot (voir run_bench.py)"""
@@ -0,0 +1,120 @@
+"""
+Serveur Ollama factice pour les benchmarks
+Imite /api/generate (streaming NDJSON ou réponse complète) et /api/tags avec une
+latence configurable : temps de prefill proportionnel à la taille du prompt, puis
+un délai fixe par token généré.
+
+Lancement : python -m bench.fake_ollama --port 11435 --token-latency-ms 20 --tokens 120
+"""
+
+import json
+import time
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = (
+    "Le plan d'épargne retraite permet de se constituer une épargne disponible au moment "
+    "de la retraite sous forme de rente ou de capital selon les règles applicables"
+).split()
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = {
+        "tokens": 120,
+        "token_latency": 0.02,
+        "prefill_per_token": 0.0002,
+        "chars_per_token": 3.5
+    }
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload: dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": "fake"}]})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if self.path != "/api/generate":
+            self._send_json({"error": "not found"}, 404)
+            return
+
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        config = self.config
+        prompt_tokens = int(len(payload.get("prompt", "")) / config["chars_per_token"]) + 1
+        n_tokens = min(config["tokens"], payload.get("options", {}).get("num_predict", config["tokens"]))
+        started = time.perf_counter()
+
+        # Prefill proportionnel à la taille du prompt
+        time.sleep(prompt_tokens * config["prefill_per_token"])
+
+        stats = {
+            "done": True,
+            "prompt_eval_count": prompt_tokens,
+            "eval_count": n_tokens
+        }
+
+        if not payload.get("stream", True):
+            time.sleep(n_tokens * config["token_latency"])
+            text = " ".join(WORDS[i % len(WORDS)] for i in range(n_tokens))
+            stats["total_duration"] = int((time.perf_counter() - started) * 1e9)
+            self._send_json({"model": payload.get("model"), "response": text, **stats})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_chunk(data: dict):
+            line = (json.dumps(data) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(line):X}\r\n".encode() + line + b"\r\n")
+            self.wfile.flush()
+
+        try:
+            for i in range(n_tokens):
+                time.sleep(config["token_latency"])
+                write_chunk({"model": payload.get("model"), "response": WORDS[i % len(WORDS)] + " ", "done": False})
+            stats["total_duration"] = int((time.perf_counter() - started) * 1e9)
+            write_chunk({"model": payload.get("model"), "response": "", **stats})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def serve(port: int, tokens: int, token_latency_ms: float, prefill_ms_per_100_tokens: float):
+    FakeOllamaHandler.config.update({
+        "tokens": tokens,
+        "token_latency": token_latency_ms / 1000,
+        "prefill_per_token": prefill_ms_per_100_tokens / 100 / 1000
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOllamaHandler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur Ollama factice")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--tokens", type=int, default=120, help="tokens générés par réponse")
+    parser.add_argument("--token-latency-ms", type=float, default=20, help="délai par token généré")
+    parser.add_argument("--prefill-ms-per-100-tokens", type=float, default=20, help="délai de prefill")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.tokens, args.token_latency_ms, args.prefill_ms_per_100_tokens)
+    print(f"Ollama factice sur http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Corpus de questions françaises pour les benchmarks
+Questions fréquentes écrites à la main, complétées par des questions générées à partir
+des titres (##, ###) de la base de connaissances
+"""
+
+import os
+import re
+import glob
+
+COMMON_QUESTIONS = [
+    "C'est quoi un PER individuel ?",
+    "Quelle est la différence entre un PERO et un PERECO ?",
+    "Quel est le plafond de déduction des versements sur un PER ?",
+    "Comment racheter des trimestres de retraite ?",
+    "Peut-on débloquer son PER avant la retraite pour acheter sa résidence principale ?",
+    "Comment est imposée la sortie en capital d'un PER ?",
+    "À quel âge puis-je partir à la retraite ?",
+    "Combien de trimestres faut-il pour une retraite à taux plein ?",
+    "Que devient mon contrat Madelin depuis la loi PACTE ?",
+    "Peut-on transférer un PERP vers un PER individuel ?",
+    "Qu'est-ce que l'ex Article 83 ?",
+    "Quel abattement s'applique sur les rentes de retraite ?",
+    "Le PERCOL est-il obligatoire dans mon entreprise ?",
+    "Peut-on sortir en capital fractionné ?",
+    "Les versements volontaires sont-ils déductibles à 10 % ?"
+]
+
+TEMPLATES = [
+    "Qu'est-ce que {} ?",
+    "Peux-tu m'expliquer {} ?",
+    "Quelles sont les règles concernant {} ?"
+]
+
+
+def questions_from_knowledge_base(kb_path: str) -> list:
+    """Une question par titre de section, en alternant les formulations"""
+    questions = []
+    for file_path in sorted(glob.glob(os.path.join(kb_path, "*.md"))):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                match = re.match(r"^#{2,3}\s+(.+?)\s*$", line)
+                if match:
+                    title = match.group(1).strip("*: ")
+                    template = TEMPLATES[len(questions) % len(TEMPLATES)]
+                    questions.append(template.format(title[0].lower() + title[1:]))
+    return questions
+
+
+def load_questions(kb_path: str) -> list:
+    return COMMON_QUESTIONS + questions_from_knowledge_base(kb_path)
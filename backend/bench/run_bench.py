@@ -0,0 +1,366 @@
+"""
+Benchmark du backend chatbot avec un Ollama factice
+Deux modes, lancés depuis backend/ :
+
+  python -m bench.run_bench stages   profil en processus des étapes d'une requête : requêtes
+                                     /chat (ou /chat/stream) avec "timings": true, réparties
+                                     selon les durées d'étapes renvoyées par l'endpoint
+  python -m bench.run_bench load     charge HTTP sur un serveur lancé pour l'occasion
+                                     (gunicorn ou uvicorn), latence de bout en bout, premier token,
+                                     requêtes/s et mémoire de chaque worker
+
+La génération est servie par bench.fake_ollama : sa latence par token est configurable,
+ce qui isole le coût propre du backend. Les résultats sont écrits en JSON dans
+bench/results/ pour comparer deux versions (--output pour choisir le fichier).
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.fake_ollama import serve as serve_fake_ollama
+from bench.questions import load_questions
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "bench", "results")
+
+
+def percentiles(values: list) -> dict:
+    """p50/p95/p99, moyenne et extrêmes en millisecondes"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * 1000, 2),
+        "min": round(ordered[0] * 1000, 2),
+        "p50": round(pick(50) * 1000, 2),
+        "p95": round(pick(95) * 1000, 2),
+        "p99": round(pick(99) * 1000, 2),
+        "max": round(ordered[-1] * 1000, 2)
+    }
+
+
+def rss_mb(pid: int):
+    """Mémoire résidente d'un processus (Linux, /proc)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def worker_pids(pid: int) -> list:
+    """Processus enfants directs (workers), ou le serveur lui-même s'il n'a pas de workers"""
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # Le nom du processus peut contenir des espaces : lire après la parenthèse
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            children.append(int(entry))
+    return sorted(children) or [pid]
+
+
+def start_fake_ollama(args):
+    server = serve_fake_ollama(args.ollama_port, args.tokens, args.token_latency_ms, args.prefill_ms)
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+
+def bench_environment(args) -> dict:
+    """Variables d'environnement du backend mesuré"""
+    env = {
+        "OLLAMA_URL": f"http://127.0.0.1:{args.ollama_port}",
+        "OLLAMA_MAX_IN_FLIGHT": str(args.max_in_flight),
+        "OLLAMA_MAX_QUEUE": str(args.max_queue)
+    }
+    if not args.cache:
+        # Chaque question répétée doit parcourir tout le pipeline
+        env["ANSWER_CACHE_ENABLED"] = "false"
+    return env
+
+
+def run_stages(args, questions: list) -> dict:
+    """
+    Profil en processus : les questions passent par l'endpoint réel (client de test Flask),
+    avec le même ordre d'étapes que le service (cache, FAQ, raccourci BM25, reformulation
+    des relances). Chaque réponse renvoie la durée de ses étapes (`timings`).
+    """
+    os.environ.update(bench_environment(args))
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(BACKEND_DIR)
+    import app as core
+
+    started = time.perf_counter()
+    core.start_warm_up()
+    while not core.is_ready():
+        if core.service_state["status"] == "error":
+            raise RuntimeError(f"Préchauffage impossible : {core.service_state['error']}")
+        time.sleep(0.1)
+    warm_up_seconds = time.perf_counter() - started
+
+    client = core.app.test_client()
+    stages = {}
+    outcomes = {}
+    errors = 0
+
+    for i in range(args.requests):
+        body = {"message": questions[i % len(questions)], "timings": True}
+        if args.session_turns:
+            # Relances : les questions suivantes d'une session sont reformulées avec son sujet
+            body["session_id"] = f"bench-{i // args.session_turns:06d}"
+
+        timings = None
+        if not args.stream:
+            response = client.post("/chat", json=body)
+            payload = response.get_json(silent=True) or {}
+            timings = payload.get("timings")
+            outcome = "faq" if "faq" in payload else "cached" if payload.get("cached") else "answered"
+        else:
+            response = client.post("/chat/stream", json=body)
+            outcome = "answered"
+            for event, data in parse_sse(response.get_data(as_text=True)):
+                if event == "done":
+                    timings = data.get("timings")
+                    if data.get("cached"):
+                        outcome = "faq" if "faq" in data else "cached"
+                elif event == "error":
+                    outcome = "error"
+
+        if response.status_code != 200 or outcome == "error":
+            errors += 1
+            outcome = "error" if response.status_code == 200 else str(response.status_code)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        # Réponse en cache servie en flux : pas de détail des étapes
+        for stage, milliseconds in (timings or {}).items():
+            stages.setdefault(stage, []).append(milliseconds / 1000)
+
+    return {
+        "warm_up_seconds": round(warm_up_seconds, 2),
+        "errors": errors,
+        "outcomes": outcomes,
+        "stages": {name: percentiles(values) for name, values in stages.items()},
+        "memory_mb": rss_mb(os.getpid())
+    }
+
+
+def parse_sse(text: str):
+    """Événements (nom, données JSON) d'une réponse text/event-stream complète"""
+    for block in text.split("\n\n"):
+        event, data = None, None
+        for line in block.splitlines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                data = json.loads(line[len("data: "):])
+        if event is not None:
+            yield event, data or {}
+
+
+def server_command(args) -> list:
+    address = f"127.0.0.1:{args.port}"
+    if args.server == "asgi":
+        return [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1",
+                "--port", str(args.port), "--workers", str(args.workers), "--log-level", "warning"]
+    return [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app",
+            "--bind", address, "--workers", str(args.workers), "--threads", str(args.threads)]
+
+
+def wait_until_ready(base_url: str, process, timeout: float = 300):
+    """Attend /health/ready (chaque worker préchauffe ses modèles)"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Le serveur s'est arrêté (code {process.returncode})")
+        try:
+            if requests.get(f"{base_url}/health/ready", timeout=2).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("Serveur non prêt dans le délai imparti")
+
+
+def one_request(session, base_url: str, question: str, stream: bool) -> dict:
+    """Une requête /chat (ou /chat/stream) : statut, latence et premier token"""
+    started = time.perf_counter()
+    result = {"status": None, "latency": None, "first_token": None, "error": None}
+    try:
+        if not stream:
+            response = session.post(f"{base_url}/chat", json={"message": question}, timeout=300)
+            result["status"] = response.status_code
+        else:
+            with session.post(f"{base_url}/chat/stream", json={"message": question},
+                              stream=True, timeout=300) as response:
+                result["status"] = response.status_code
+                for line in response.iter_lines(decode_unicode=True):
+                    if line == "event: token" and result["first_token"] is None:
+                        result["first_token"] = time.perf_counter() - started
+                    elif line == "event: error":
+                        result["error"] = "sse_error"
+    except requests.RequestException as e:
+        result["error"] = type(e).__name__
+    result["latency"] = time.perf_counter() - started
+    return result
+
+
+def run_load(args, questions: list) -> dict:
+    """Charge HTTP : `concurrency` clients envoient des questions pendant `duration` secondes"""
+    base_url = f"http://127.0.0.1:{args.port}"
+    env = {**os.environ, **bench_environment(args), "PRELOAD_MODELS": "true" if args.preload else "false"}
+    process = subprocess.Popen(server_command(args), cwd=BACKEND_DIR, env=env)
+
+    try:
+        started = time.perf_counter()
+        wait_until_ready(base_url, process)
+        startup_seconds = time.perf_counter() - started
+        memory_idle = {pid: rss_mb(pid) for pid in worker_pids(process.pid)}
+
+        results = []
+        lock = threading.Lock()
+        stop_at = time.monotonic() + args.duration
+        memory_peak = dict(memory_idle)
+
+        def client(worker_index: int):
+            rng = random.Random(args.seed + worker_index)
+            session = requests.Session()
+            while time.monotonic() < stop_at:
+                outcome = one_request(session, base_url, rng.choice(questions), args.stream)
+                with lock:
+                    results.append(outcome)
+
+        def sample_memory():
+            while time.monotonic() < stop_at:
+                for pid in worker_pids(process.pid):
+                    value = rss_mb(pid)
+                    if value is not None:
+                        memory_peak[pid] = max(memory_peak.get(pid) or 0, value)
+                time.sleep(0.5)
+
+        load_started = time.perf_counter()
+        sampler = threading.Thread(target=sample_memory, daemon=True)
+        sampler.start()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(client, range(args.concurrency)))
+        elapsed = time.perf_counter() - load_started
+        sampler.join()
+
+        health = requests.get(f"{base_url}/health", timeout=10).json()
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    statuses = {}
+    errors = {}
+    for outcome in results:
+        statuses[str(outcome["status"])] = statuses.get(str(outcome["status"]), 0) + 1
+        if outcome["error"]:
+            errors[outcome["error"]] = errors.get(outcome["error"], 0) + 1
+    succeeded = [outcome for outcome in results if outcome["status"] == 200 and not outcome["error"]]
+
+    return {
+        "startup_seconds": round(startup_seconds, 2),
+        "elapsed_seconds": round(elapsed, 2),
+        "requests": len(results),
+        "requests_per_second": round(len(succeeded) / elapsed, 2) if elapsed else 0.0,
+        "statuses": statuses,
+        "errors": errors,
+        "latency": percentiles([outcome["latency"] for outcome in succeeded]),
+        "first_token": percentiles([outcome["first_token"] for outcome in succeeded
+                                    if outcome["first_token"] is not None]),
+        "memory_mb": {
+            "master": rss_mb(process.pid),
+            "workers_idle": list(memory_idle.values()),
+            "workers_peak": list(memory_peak.values())
+        },
+        "server_health": health
+    }
+
+
+def save_results(results: dict, output: str = None) -> str:
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{results['mode']}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    return output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du backend chatbot")
+    parser.add_argument("mode", choices=["stages", "load"])
+    parser.add_argument("--requests", type=int, default=100, help="stages : nombre de questions")
+    parser.add_argument("--duration", type=float, default=30, help="load : durée de la charge (s)")
+    parser.add_argument("--concurrency", type=int, default=8, help="load : clients simultanés")
+    parser.add_argument("--server", choices=["gunicorn", "asgi"], default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--port", type=int, default=5098)
+    parser.add_argument("--preload", action="store_true", help="PRELOAD_MODELS=true")
+    parser.add_argument("--stream", action="store_true", help="utiliser /chat/stream")
+    parser.add_argument("--session-turns", type=int, default=0,
+                        help="stages : questions par session (0 = questions indépendantes)")
+    parser.add_argument("--cache", action="store_true", help="garder le cache de réponses actif")
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--max-queue", type=int, default=64)
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--tokens", type=int, default=120)
+    parser.add_argument("--token-latency-ms", type=float, default=20)
+    parser.add_argument("--prefill-ms", type=float, default=20, help="prefill pour 100 tokens de prompt")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    kb_path = os.path.join(BACKEND_DIR, os.getenv("KNOWLEDGE_BASE_PATH", "../knowledge_base"))
+    questions = load_questions(kb_path)
+    fake_ollama = start_fake_ollama(args)
+
+    try:
+        if args.mode == "stages":
+            measures = run_stages(args, questions)
+        else:
+            measures = run_load(args, questions)
+    finally:
+        fake_ollama.shutdown()
+
+    results = {
+        "mode": args.mode,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "questions": len(questions),
+        "platform": {"python": platform.python_version(), "cpus": os.cpu_count()},
+        **measures
+    }
+    path = save_results(results, args.output)
+    print(json.dumps({key: value for key, value in results.items() if key != "server_health"},
+                     ensure_ascii=False, indent=2))
+    print(f"Résultats enregistrés dans {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Découpage des documents de la base de connaissances
+Chunkers interchangeables : `markdown` lit les fichiers ligne à ligne, respecte la
+hiérarchie des titres (#, ##, ###), mesure les tailles en tokens avec recouvrement
+et enregistre le chemin des titres et les positions en caractères de chaque chunk ;
+`legacy` reproduit l'ancien découpage (sections ## puis paragraphes de 1500 caractères)
+"""
+
+import re
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.+?)\s*#*\s*$")
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimation déterministe du nombre de tokens (mots et ponctuation)"""
+    return len(TOKEN_PATTERN.findall(text))
+
+
+class Chunker:
+    """Interface d'un chunker : génère des tuples (texte, métadonnées) pour un fichier"""
+
+    name = None
+
+    def signature(self) -> str:
+        """Identifie le découpage : la changer force la ré-indexation des fichiers"""
+        raise NotImplementedError
+
+    def chunk_lines(self, lines, source: str):
+        raise NotImplementedError
+
+    def chunk_file(self, file_path: str, source: str):
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            yield from self.chunk_lines(f, source)
+
+
+class LegacyChunker(Chunker):
+    """Découpage historique : sections `## ` puis paragraphes jusqu'à 1500 caractères"""
+
+    name = "legacy"
+
+    def __init__(self, max_chars: int = 1500):
+        self.max_chars = max_chars
+
+    def signature(self) -> str:
+        return f"legacy:{self.max_chars}"
+
+    def chunk_lines(self, lines, source: str):
+        content = "".join(lines)
+        chunks = []
+
+        # Découper en sections basées sur les titres
+        sections = content.split('\n## ')
+
+        for i, section in enumerate(sections):
+            section_text = section if i == 0 else '## ' + section
+
+            # Découper les sections longues par paragraphes
+            if len(section_text) > self.max_chars:
+                current_chunk = ""
+                for para in section_text.split('\n\n'):
+                    if len(current_chunk) + len(para) < self.max_chars:
+                        current_chunk += para + "\n\n"
+                    else:
+                        if current_chunk.strip():
+                            chunks.append(current_chunk.strip())
+                        current_chunk = para + "\n\n"
+                if current_chunk.strip():
+                    chunks.append(current_chunk.strip())
+            elif section_text.strip():
+                chunks.append(section_text.strip())
+
+        for i, text in enumerate(chunks):
+            yield text, {"source": source, "chunk": i}
+
+
+class MarkdownChunker(Chunker):
+    """
+    Découpage structuré en flux : les titres de niveau <= split_level sont des frontières
+    strictes, les sous-sections et paragraphes sont regroupés jusqu'à max_tokens, et
+    chaque nouveau chunk d'une même section reprend la fin du précédent (overlap_tokens).
+    """
+
+    name = "markdown"
+
+    def __init__(self, max_tokens: int = 256, overlap_tokens: int = 32, split_level: int = 2,
+                 token_len=estimate_tokens):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.split_level = split_level
+        self.token_len = token_len
+
+    def signature(self) -> str:
+        return f"markdown:{self.max_tokens}:{self.overlap_tokens}:{self.split_level}"
+
+    def chunk_lines(self, lines, source: str):
+        headings = []     # pile des titres [(niveau, titre)]
+        section = []      # unités de la section courante : dict {text, start, end, path, tokens}
+        paragraph = []    # lignes du paragraphe courant : (texte, début)
+        offset = 0
+        in_code = False
+        index = 0
+
+        def close_paragraph():
+            if paragraph:
+                text = "\n".join(line for line, _ in paragraph)
+                end = paragraph[-1][1] + len(paragraph[-1][0])
+                section.append(self._unit(text, paragraph[0][1], end, headings))
+                paragraph.clear()
+
+        def flush_section():
+            nonlocal index
+            close_paragraph()
+            # Une section réduite à son titre (titre de document suivi d'un ##) n'est pas indexée :
+            # le titre figure dans le heading_path des chunks suivants
+            if all(unit["heading"] for unit in section):
+                section.clear()
+                return
+            for text, metadata in self._pack(section):
+                yield text, {"source": source, "chunk": index, **metadata}
+                index += 1
+            section.clear()
+
+        for raw_line in lines:
+            line = raw_line.rstrip("\r\n")
+            start = offset
+            offset += len(raw_line)
+
+            if line.lstrip().startswith("```"):
+                in_code = not in_code
+
+            match = None if in_code else HEADING_PATTERN.match(line)
+            if match:
+                level = len(match.group(1))
+                if level <= self.split_level:
+                    yield from flush_section()
+                else:
+                    close_paragraph()
+                while headings and headings[-1][0] >= level:
+                    headings.pop()
+                headings.append((level, match.group(2)))
+                section.append(self._unit(line, start, start + len(line), headings, heading=True))
+            elif not line.strip() and not in_code:
+                close_paragraph()
+            else:
+                paragraph.append((line, start))
+
+        yield from flush_section()
+
+    def _unit(self, text: str, start: int, end: int, headings: list, heading: bool = False) -> dict:
+        return {
+            "heading": heading,
+            "text": text,
+            "start": start,
+            "end": end,
+            "path": tuple(title for _, title in headings),
+            "tokens": self.token_len(text)
+        }
+
+    def _split_unit(self, unit: dict) -> list:
+        """Découpe une unité trop longue par lignes, puis par mots"""
+        if unit["tokens"] <= self.max_tokens:
+            return [unit]
+
+        lines = unit["text"].split("\n")
+        if len(lines) > 1:
+            pieces = []
+            position = unit["start"]
+            for line in lines:
+                piece = {**unit, "text": line, "start": position, "end": position + len(line),
+                         "tokens": self.token_len(line)}
+                pieces.extend(self._split_unit(piece))
+                position += len(line) + 1
+            return pieces
+
+        pieces = []
+        words = list(re.finditer(r"\S+", unit["text"]))
+        current = []
+        for word in words:
+            current.append(word)
+            text = unit["text"][current[0].start():current[-1].end()]
+            if self.token_len(text) > self.max_tokens and len(current) > 1:
+                current.pop()
+                pieces.append(self._slice(unit, current))
+                current = [word]
+        if current:
+            pieces.append(self._slice(unit, current))
+        return pieces
+
+    def _slice(self, unit: dict, words: list) -> dict:
+        text = unit["text"][words[0].start():words[-1].end()]
+        return {**unit, "text": text, "start": unit["start"] + words[0].start(),
+                "end": unit["start"] + words[-1].end(), "tokens": self.token_len(text)}
+
+    def _pack(self, units: list):
+        """Regroupe les unités d'une section en chunks avec recouvrement"""
+        units = [piece for unit in units for piece in self._split_unit(unit)]
+        i = 0
+        while i < len(units):
+            chunk = [units[i]]
+            tokens = units[i]["tokens"]
+            j = i + 1
+            while j < len(units) and tokens + units[j]["tokens"] <= self.max_tokens:
+                chunk.append(units[j])
+                tokens += units[j]["tokens"]
+                j += 1
+
+            yield self._render(chunk)
+
+            if j >= len(units):
+                break
+
+            # Reprendre les dernières unités du chunk (dans la limite du recouvrement)
+            next_start = j
+            overlap = 0
+            while next_start - 1 > i and overlap + units[next_start - 1]["tokens"] <= self.overlap_tokens:
+                next_start -= 1
+                overlap += units[next_start]["tokens"]
+            i = next_start
+
+    def _render(self, chunk: list):
+        # Chemin de titres commun à toutes les unités du chunk
+        path = list(chunk[0]["path"])
+        for unit in chunk[1:]:
+            common = 0
+            while common < min(len(path), len(unit["path"])) and path[common] == unit["path"][common]:
+                common += 1
+            del path[common:]
+
+        text = "\n\n".join(unit["text"] for unit in chunk)
+        return text, {
+            "heading_path": " > ".join(path),
+            "section": path[-1] if path else "",
+            "start_char": chunk[0]["start"],
+            "end_char": chunk[-1]["end"],
+            "tokens": sum(unit["tokens"] for unit in chunk)
+        }
+
+
+CHUNKERS = {
+    "markdown": MarkdownChunker,
+    "legacy": LegacyChunker
+}
+
+
+def create_chunker(name: str = "markdown", **params) -> Chunker:
+    """Instancie un chunker par son nom (les paramètres inconnus sont une erreur)"""
+    if name not in CHUNKERS:
+        raise ValueError(f"Chunker inconnu : {name} (disponibles : {', '.join(CHUNKERS)})")
+    return CHUNKERS[name](**params)
@@ -0,0 +1,149 @@
+"""
+Construction du contexte sous budget de tokens
+Filtre les chunks trop éloignés, supprime les doublons et remplit un budget de tokens
+par ordre de pertinence, pour limiter la taille du prompt (et le temps de prefill d'Ollama)
+"""
+
+import re
+import threading
+
+# Tokenizers Hugging Face correspondant aux modèles Ollama courants
+OLLAMA_TOKENIZERS = {
+    "mistral": "mistralai/Mistral-7B-Instruct-v0.2",
+    "mixtral": "mistralai/Mixtral-8x7B-Instruct-v0.1",
+    "llama2": "meta-llama/Llama-2-7b-chat-hf",
+    "llama3": "meta-llama/Meta-Llama-3-8B-Instruct",
+    "gemma": "google/gemma-7b-it",
+    "qwen2": "Qwen/Qwen2-7B-Instruct",
+    "phi3": "microsoft/Phi-3-mini-4k-instruct"
+}
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+
+class TokenCounter:
+    """
+    Compte les tokens avec le tokenizer du modèle si disponible (transformers),
+    sinon estime à partir du nombre de caractères. Le ratio caractères/token de
+    l'estimation est recalibré avec les `prompt_eval_count` renvoyés par Ollama.
+    """
+
+    def __init__(self, model: str, tokenizer_name: str = None, chars_per_token: float = 3.5):
+        self.model = model
+        self.tokenizer_name = tokenizer_name or OLLAMA_TOKENIZERS.get(model.split(":")[0])
+        self.chars_per_token = chars_per_token
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Charge le tokenizer (à faire au préchauffage, une seule fois)"""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if not self.tokenizer_name:
+                return
+            try:
+                from transformers import AutoTokenizer
+
+                self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+            except Exception as e:
+                print(f"Tokenizer {self.tokenizer_name} indisponible, estimation par caractères : {e}")
+
+    @property
+    def exact(self) -> bool:
+        return self._tokenizer is not None
+
+    def count(self, text: str) -> int:
+        if not self._loaded:
+            self.load()
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False))
+        return int(len(text) / self.chars_per_token) + 1
+
+    def observe(self, prompt: str, evaluated_tokens):
+        """Recalibre l'estimation avec le nombre de tokens réellement évalués par Ollama"""
+        if self._tokenizer is not None or not evaluated_tokens:
+            return
+        observed = len(prompt) / evaluated_tokens
+        self.chars_per_token = 0.9 * self.chars_per_token + 0.1 * observed
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Tronque un texte à `max_tokens`, sur une fin de ligne si possible"""
+        if self.count(text) <= max_tokens:
+            return text
+        if self._tokenizer is not None:
+            ids = self._tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+            cut = self._tokenizer.decode(ids)
+        else:
+            cut = text[:int(max_tokens * self.chars_per_token)]
+        newline = cut.rfind("\n")
+        return cut[:newline] if newline > len(cut) // 2 else cut
+
+    def info(self) -> dict:
+        return {
+            "tokenizer": self.tokenizer_name if self.exact else None,
+            "chars_per_token": None if self.exact else round(self.chars_per_token, 3)
+        }
+
+
+def _shingles(text: str, size: int = 3) -> set:
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def is_duplicate(text: str, kept_shingles: list, threshold: float) -> bool:
+    """Vrai si le texte recouvre largement un chunk déjà retenu (Jaccard ou inclusion)"""
+    shingles = _shingles(text)
+    for other in kept_shingles:
+        common = len(shingles & other)
+        if not common:
+            continue
+        if common / len(shingles | other) >= threshold or common / min(len(shingles), len(other)) >= 0.9:
+            return True
+    return False
+
+
+def build_context(hits: list, counter: TokenCounter, budget_tokens: int,
+                  max_distance: float = None, dedup_threshold: float = 0.6):
+    """
+    Sélectionne les chunks à placer dans le prompt, par ordre de pertinence.
+    Renvoie (chunks retenus, texte du contexte, statistiques).
+    """
+    selected = []
+    parts = []
+    kept_shingles = []
+    used = 0
+    separator_tokens = counter.count(CONTEXT_SEPARATOR)
+    stats = {"dropped_distance": 0, "dropped_duplicate": 0, "dropped_budget": 0, "truncated": 0}
+
+    for hit in hits:
+        distance = hit.get("distance")
+        if max_distance is not None and distance is not None and distance > max_distance:
+            stats["dropped_distance"] += 1
+            continue
+
+        text = hit["document"]
+        if is_duplicate(text, kept_shingles, dedup_threshold):
+            stats["dropped_duplicate"] += 1
+            continue
+
+        cost = counter.count(text) + (separator_tokens if parts else 0)
+        if used + cost > budget_tokens:
+            if parts:
+                # Un chunk plus court plus loin dans la liste peut encore tenir
+                stats["dropped_budget"] += 1
+                continue
+            # Le chunk le plus pertinent ne tient pas seul : il est tronqué
+            text = counter.truncate(text, budget_tokens)
+            cost = counter.count(text)
+            stats["truncated"] += 1
+
+        selected.append(hit)
+        parts.append(text)
+        kept_shingles.append(_shingles(text))
+        used += cost
+
+    stats["context_tokens"] = used
+    return selected, CONTEXT_SEPARATOR.join(parts), stats
@@ -0,0 +1,88 @@
+"""
+Micro-batching des embeddings de questions
+Les requêtes concurrentes sont regroupées pendant quelques millisecondes puis encodées
+en un seul passage du modèle (beaucoup plus efficace sur CPU qu'une question à la fois)
+"""
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class EmbeddingBatcher:
+    """Regroupe les appels à `embed_fn(textes) -> vecteurs` faits par plusieurs threads"""
+
+    def __init__(self, embed_fn, max_batch_size: int = 16, max_wait_ms: float = 5):
+        self.embed_fn = embed_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = {"batches": 0, "items": 0, "errors": 0, "max_batch": 0}
+        self.batch_sizes = {}
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Le thread de traitement ne survit pas au fork : un par processus
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            threading.Thread(target=self._run, args=(self._queue,), name="embedding-batcher", daemon=True).start()
+            self._pid = os.getpid()
+
+    def embed(self, text: str, timeout: float = 30):
+        """Embedding d'un texte, calculé dans le prochain lot"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, future))
+        return future.result(timeout)
+
+    def _collect(self, requests_queue: queue.Queue) -> list:
+        """Attend une requête puis complète le lot pendant au plus max_wait"""
+        batch = [requests_queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(requests_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, requests_queue: queue.Queue):
+        while True:
+            batch = self._collect(requests_queue)
+            try:
+                vectors = self.embed_fn([text for text, _ in batch])
+            except Exception as e:
+                self.stats["errors"] += 1
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+
+            size = len(batch)
+            self.stats["batches"] += 1
+            self.stats["items"] += size
+            self.stats["max_batch"] = max(self.stats["max_batch"], size)
+            self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+
+    def info(self) -> dict:
+        """Taille des lots obtenus, pour /health"""
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "avg_batch": round(self.stats["items"] / batches, 2) if batches else 0.0,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000
+        }
@@ -0,0 +1,262 @@
+"""
+Réponses précalculées aux questions fréquentes (définitions, FAQ)
+Étape hors ligne : chaque question de faq_questions.json reçoit une réponse produite par
+le pipeline RAG (ou écrite à la main dans le fichier), enregistrée avec ses sources et le
+hash des fichiers de la base de connaissances utilisés. Au service, une question identique
+ou très proche (similarité des embeddings) d'une question de la FAQ reçoit directement
+cette réponse, sans recherche ni génération. Une réponse générée n'est servie qu'après
+relecture (`vetted`, sauf FAQ_REQUIRE_VETTED=false) ; une réponse dont un fichier source
+a changé n'est plus servie jusqu'à sa régénération (et sa nouvelle relecture).
+
+Construction puis validation (depuis backend/) :
+
+    python faq.py [--all] [--ids definition-perp ...]
+    python faq.py --vet definition-perp ...
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+
+import numpy as np
+
+from answer_cache import normalize_question
+
+
+def load_faq_config(config_path: str) -> list:
+    """Questions de la FAQ : [{id, question, variants, answer?, sources?}]"""
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get("faq", [])
+    except FileNotFoundError:
+        return []
+
+
+def load_answers(answers_path: str) -> dict:
+    """Réponses construites, indexées par identifiant de question"""
+    try:
+        with open(answers_path, 'r', encoding='utf-8') as f:
+            return {record["id"]: record for record in json.load(f).get("answers", [])}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_answers(answers_path: str, answers: dict):
+    """Écrit les réponses de façon atomique (fichier relu par les workers)"""
+    tmp_path = answers_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"answers": sorted(answers.values(), key=lambda r: r["id"])}, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, answers_path)
+
+
+def vet_answers(answers: dict, ids: list) -> list:
+    """Marque des réponses relues comme validées ; renvoie les identifiants inconnus"""
+    unknown = [faq_id for faq_id in ids if faq_id not in answers]
+    for faq_id in ids:
+        if faq_id in answers:
+            answers[faq_id]["vetted"] = True
+            answers[faq_id]["vetted_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+    return unknown
+
+
+def source_hashes(sources: list, manifest_files: dict) -> dict:
+    """Hash actuel de chaque fichier source (None si le fichier a disparu)"""
+    return {source: manifest_files.get(source, {}).get("sha256") for source in sources}
+
+
+def is_stale(entry: dict, record: dict, manifest_files: dict) -> bool:
+    """Réponse absente, question modifiée, ou fichier source modifié depuis la construction"""
+    if record is None or record["question"] != entry["question"]:
+        return True
+    if entry.get("answer") is not None and record["response"] != entry["answer"]:
+        return True
+    return source_hashes(list(record["source_hashes"]), manifest_files) != record["source_hashes"]
+
+
+def build_answers(config: list, answers: dict, manifest_files: dict, answer_fn,
+                  force: bool = False, ids: list = None):
+    """
+    Construit les réponses manquantes ou périmées.
+    `answer_fn(question)` renvoie {response, sources, chunks} (pipeline RAG complet).
+    Une réponse écrite à la main (`answer` dans la configuration) est reprise telle quelle
+    et considérée comme validée ; une réponse générée doit être relue (`vetted`).
+    Renvoie (réponses, rapport).
+    """
+    built = {}
+    report = {"generated": [], "unchanged": [], "failed": {}, "removed": []}
+
+    for entry in config:
+        faq_id = entry["id"]
+        record = answers.get(faq_id)
+        selected = ids is None or faq_id in ids
+
+        if not selected or (not force and not is_stale(entry, record, manifest_files)):
+            if record is not None:
+                built[faq_id] = record
+                report["unchanged"].append(faq_id)
+            continue
+
+        if entry.get("answer") is not None:
+            result = {"response": entry["answer"], "sources": entry.get("sources", []), "chunks": []}
+            vetted = True
+        else:
+            try:
+                result = answer_fn(entry["question"])
+            except Exception as e:
+                report["failed"][faq_id] = str(e)
+                if record is not None:
+                    built[faq_id] = record
+                continue
+            vetted = False
+
+        # Tous les fichiers des chunks utilisés, pas seulement les sources citées
+        files = sorted(set(result["sources"]) | {chunk["source"] for chunk in result["chunks"]})
+        built[faq_id] = {
+            "id": faq_id,
+            "question": entry["question"],
+            "response": result["response"],
+            "sources": result["sources"],
+            "chunks": result["chunks"],
+            "source_hashes": source_hashes(files, manifest_files),
+            "vetted": vetted,
+            "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+        report["generated"].append(faq_id)
+
+    report["removed"] = sorted(set(answers) - {entry["id"] for entry in config})
+    return built, report
+
+
+class FAQIndex:
+    """Questions de la FAQ servables, par question normalisée et par embedding (thread-safe)"""
+
+    def __init__(self, threshold: float = 0.9, require_vetted: bool = True):
+        self.threshold = threshold
+        self.require_vetted = require_vetted
+        self._exact = {}
+        self._matrix = None
+        self._owners = []
+        self._lock = threading.Lock()
+        self.state = {"entries": 0, "stale": [], "unvetted": 0, "loaded_at": None}
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+
+    @property
+    def size(self) -> int:
+        return len(self._owners)
+
+    def load(self, config: list, answers: dict, manifest_files: dict, embed_fn):
+        """Indexe les réponses à jour (et validées si require_vetted) ; renvoie les ids périmés"""
+        exact = {}
+        texts = []
+        owners = []
+        stale = []
+        unvetted = 0
+
+        for entry in config:
+            record = answers.get(entry["id"])
+            if is_stale(entry, record, manifest_files):
+                stale.append(entry["id"])
+                continue
+            if not record["vetted"]:
+                unvetted += 1
+                if self.require_vetted:
+                    continue
+            for question in [entry["question"], *entry.get("variants", [])]:
+                exact[normalize_question(question)] = record
+                texts.append(question)
+                owners.append(record)
+
+        matrix = None
+        if texts:
+            matrix = np.asarray(embed_fn(texts), dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix = matrix / np.where(norms == 0, 1, norms)
+
+        with self._lock:
+            self._exact = exact
+            self._matrix = matrix
+            self._owners = owners
+            self.state = {
+                "entries": len({record["id"] for record in owners}),
+                "stale": stale,
+                "unvetted": unvetted,
+                "loaded_at": time.time()
+            }
+        return stale
+
+    def _result(self, record: dict, similarity: float) -> dict:
+        return {
+            "response": record["response"],
+            "sources": record["sources"],
+            "chunks": record["chunks"],
+            "faq": {"id": record["id"], "question": record["question"], "similarity": round(similarity, 4)}
+        }
+
+    def match_exact(self, question: str):
+        """Réponse de la FAQ pour la même question normalisée (ou une variante), sinon None"""
+        record = self._exact.get(normalize_question(question))
+        if record is None:
+            return None
+        with self._lock:
+            self.stats["exact_hits"] += 1
+        return self._result(record, 1.0)
+
+    def match(self, embedding):
+        """Réponse de la FAQ si une question est assez proche (cosinus >= seuil), sinon None"""
+        with self._lock:
+            matrix, owners = self._matrix, self._owners
+        if matrix is None:
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        scores = matrix @ (query / norm if norm else query)
+        best = int(np.argmax(scores))
+
+        with self._lock:
+            if scores[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+            self.stats["semantic_hits"] += 1
+        return self._result(owners[best], float(scores[best]))
+
+    def info(self) -> dict:
+        """État de l'index pour /health"""
+        with self._lock:
+            return {**self.state, **self.stats, "threshold": self.threshold, "require_vetted": self.require_vetted}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construit les réponses précalculées de la FAQ")
+    parser.add_argument("--all", action="store_true", help="régénérer toutes les réponses")
+    parser.add_argument("--ids", nargs="+", help="ne (re)construire que ces questions")
+    parser.add_argument("--vet", nargs="+", metavar="ID", help="valider ces réponses après relecture")
+    args = parser.parse_args()
+
+    if args.vet:
+        # Même réglage que l'application ; pas de préchauffage pour une validation
+        answers_path = os.getenv("FAQ_ANSWERS_PATH", "./faq_answers.json")
+        answers = load_answers(answers_path)
+        unknown = vet_answers(answers, args.vet)
+        if unknown:
+            raise SystemExit(f"Réponses inconnues (à construire d'abord) : {', '.join(unknown)}")
+        save_answers(answers_path, answers)
+        print(f"{len(args.vet)} réponse(s) validée(s) ; servies après /reload ou redémarrage")
+        return
+
+    import app as core
+
+    core.start_warm_up()
+    while not core.is_ready():
+        if core.service_state["status"] == "error":
+            raise SystemExit(f"Préchauffage impossible : {core.service_state['error']}")
+        time.sleep(0.2)
+
+    report = core.rebuild_faq(force=args.all, ids=args.ids)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
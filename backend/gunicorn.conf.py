@@ -0,0 +1,26 @@
+"""
+Configuration gunicorn du backend chatbot
+Lancement : gunicorn -c gunicorn.conf.py app:app
+
+Avec PRELOAD_MODELS=true, l'application est importée dans le processus maître :
+le modèle d'embedding y est chargé une fois et partagé par les workers (copy-on-write).
+Chaque worker ouvre ensuite son propre client ChromaDB et la version active de la
+collection au préchauffage, sous un verrou sur fichier (chroma_db/kb.lock) : si la base
+de connaissances a changé, le premier worker construit et publie une nouvelle version,
+les suivants l'ouvrent. La version qui sert n'est jamais modifiée sur place.
+"""
+
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5008")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+preload_app = os.getenv("PRELOAD_MODELS", "false").lower() in ("1", "true")
+
+
+def post_fork(server, worker):
+    # Les threads ne survivent pas au fork : le préchauffage démarre dans chaque worker
+    import app
+
+    app.start_warm_up()
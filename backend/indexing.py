@@ -0,0 +1,212 @@
+"""
+Indexation incrémentale de la base de connaissances
+Identifiants de chunks dérivés du contenu et manifeste par fichier (mtime/hash)
+pour ne ré-encoder que les chunks ajoutés ou modifiés lors d'un rechargement
+"""
+
+import os
+import glob
+import json
+import hashlib
+
+
+def list_markdown_files(kb_path: str) -> list:
+    """Liste triée des fichiers markdown de la base de connaissances"""
+    return sorted(glob.glob(os.path.join(kb_path, "*.md")))
+
+
+def make_chunk_ids(filename: str, chunks: list) -> list:
+    """
+    Identifiants stables dérivés du contenu : `<fichier>-<hash>`.
+    Un chunk identique répété dans le même fichier reçoit un suffixe d'occurrence.
+    """
+    stem = os.path.splitext(filename)[0]
+    ids = []
+    seen = {}
+    for text in chunks:
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+        chunk_id = f"{stem}-{digest}"
+        seen[chunk_id] = seen.get(chunk_id, 0) + 1
+        if seen[chunk_id] > 1:
+            chunk_id = f"{chunk_id}-{seen[chunk_id]}"
+        ids.append(chunk_id)
+    return ids
+
+
+def file_sha256(file_path: str) -> str:
+    """Hash du fichier calculé par blocs (sans le charger entièrement)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def chunk_file(file_path: str, chunker):
+    """Découpe un fichier et renvoie (chunks, metadatas, ids)"""
+    filename = os.path.basename(file_path)
+    chunks = []
+    metadatas = []
+    for text, metadata in chunker.chunk_file(file_path, filename):
+        chunks.append(text)
+        metadatas.append(metadata)
+    ids = make_chunk_ids(filename, chunks)
+    return chunks, metadatas, ids
+
+
+def load_manifest(manifest_path: str, chunker_signature: str) -> dict:
+    """Charge le manifeste d'indexation (vide s'il n'existe pas ou est illisible)"""
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"chunker": chunker_signature, "files": {}}
+
+    if manifest.get("chunker") != chunker_signature:
+        # Découpage différent : aucun fichier du manifeste n'est réutilisable
+        return {"chunker": chunker_signature, "files": {}}
+
+    manifest.setdefault("files", {})
+    return manifest
+
+
+def save_manifest(manifest_path: str, manifest: dict):
+    """Écrit le manifeste de façon atomique"""
+    os.makedirs(os.path.dirname(os.path.abspath(manifest_path)), exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def chunk_files(chunker, file_paths: list) -> list:
+    """Découpe séquentielle : [(chunks, metadatas, ids)] dans l'ordre des fichiers"""
+    return [chunk_file(file_path, chunker) for file_path in file_paths]
+
+
+def plan_sync(kb_path: str, manifest: dict, existing_ids: set, chunker, chunk_many=chunk_files) -> dict:
+    """
+    Compare la base de connaissances au manifeste et au contenu de la collection.
+    Les fichiers dont mtime et taille n'ont pas changé ne sont pas relus ; les fichiers
+    à découper le sont en un seul appel à `chunk_many(chunker, chemins)` (parallélisable).
+    Les chunks d'un fichier modifié dont le texte n'a pas changé gardent leur embedding
+    mais leurs métadonnées (titres, positions) sont réécrites : elles dépendent du reste
+    du fichier. Renvoie un plan {to_add, to_update, to_delete, files, manifest} sans rien modifier.
+    """
+    old_files = manifest.get("files", {})
+    new_files = {}
+    pending = []
+    to_add = {"documents": [], "metadatas": [], "ids": []}
+    to_update = {"metadatas": [], "ids": []}
+    report = {"added": [], "modified": [], "removed": [], "unchanged": []}
+
+    for file_path in list_markdown_files(kb_path):
+        filename = os.path.basename(file_path)
+        stat = os.stat(file_path)
+        previous = old_files.get(filename)
+
+        # Un fichier dont des chunks manquent dans la collection est ré-indexé
+        complete = previous is not None and all(
+            chunk_id in existing_ids for chunk_id in previous["chunk_ids"]
+        )
+
+        if complete and previous["mtime_ns"] == stat.st_mtime_ns and previous["size"] == stat.st_size:
+            new_files[filename] = previous
+            report["unchanged"].append(filename)
+            continue
+
+        file_hash = file_sha256(file_path)
+
+        entry = {
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "sha256": file_hash
+        }
+
+        if complete and previous["sha256"] == file_hash:
+            # Seul le mtime a changé (touch, checkout...)
+            entry["chunk_ids"] = previous["chunk_ids"]
+            new_files[filename] = entry
+            report["unchanged"].append(filename)
+            continue
+
+        new_files[filename] = entry
+        pending.append((filename, file_path, entry))
+        report["modified" if previous is not None else "added"].append(filename)
+
+    results = chunk_many(chunker, [file_path for _, file_path, _ in pending]) if pending else []
+
+    for (filename, _, entry), (chunks, metadatas, ids) in zip(pending, results):
+        entry["chunk_ids"] = ids
+        for text, metadata, chunk_id in zip(chunks, metadatas, ids):
+            if chunk_id not in existing_ids:
+                to_add["documents"].append(text)
+                to_add["metadatas"].append(metadata)
+                to_add["ids"].append(chunk_id)
+            else:
+                to_update["metadatas"].append(metadata)
+                to_update["ids"].append(chunk_id)
+
+    report["removed"] = sorted(set(old_files) - set(new_files))
+
+    # Tout identifiant présent dans la collection mais absent de l'état voulu est supprimé
+    # (fichiers retirés, chunks modifiés, anciens identifiants positionnels)
+    wanted_ids = {chunk_id for entry in new_files.values() for chunk_id in entry["chunk_ids"]}
+    to_delete = sorted(existing_ids - wanted_ids)
+
+    return {
+        "to_add": to_add,
+        "to_update": to_update,
+        "to_delete": to_delete,
+        "files": report,
+        "manifest": {"chunker": chunker.signature(), "files": new_files}
+    }
+
+
+def apply_sync(collection, plan: dict, batch_size: int = 100, embedded_batches=None):
+    """
+    Applique un plan de synchronisation à la collection ChromaDB (ajouts, mise à jour
+    des métadonnées des chunks inchangés de fichiers modifiés, suppressions).
+    `embedded_batches`, s'il est fourni, est un itérable de (début, fin, embeddings)
+    couvrant to_add dans l'ordre : les chunks sont écrits avec leurs embeddings déjà
+    calculés, au fur et à mesure, au lieu d'être encodés par la collection.
+    """
+    to_add = plan["to_add"]
+    if embedded_batches is None:
+        embedded_batches = (
+            (i, min(i + batch_size, len(to_add["ids"])), None)
+            for i in range(0, len(to_add["ids"]), batch_size)
+        )
+
+    for start, end, embeddings in embedded_batches:
+        collection.upsert(
+            documents=to_add["documents"][start:end],
+            metadatas=to_add["metadatas"][start:end],
+            ids=to_add["ids"][start:end],
+            **({"embeddings": embeddings} if embeddings is not None else {})
+        )
+
+    to_update = plan.get("to_update", {"ids": []})
+    for i in range(0, len(to_update["ids"]), batch_size):
+        collection.update(
+            ids=to_update["ids"][i:i+batch_size],
+            metadatas=to_update["metadatas"][i:i+batch_size]
+        )
+
+    to_delete = plan["to_delete"]
+    for i in range(0, len(to_delete), batch_size):
+        collection.delete(ids=to_delete[i:i+batch_size])
+
+
+def summarize_plan(plan: dict) -> dict:
+    """Rapport lisible (diff) d'un plan de synchronisation"""
+    files = plan["files"]
+    return {
+        "files_added": files["added"],
+        "files_modified": files["modified"],
+        "files_removed": files["removed"],
+        "files_unchanged": len(files["unchanged"]),
+        "chunks_added": len(plan["to_add"]["ids"]),
+        "chunks_updated": len(plan.get("to_update", {"ids": []})["ids"]),
+        "chunks_deleted": len(plan["to_delete"])
+    }
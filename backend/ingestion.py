@@ -0,0 +1,208 @@
+"""
+Pipeline d'ingestion de la base de connaissances
+Découpage des fichiers dans un pool de processus, embeddings par grands lots calculés
+par plusieurs threads pendant que les lots précédents sont écrits dans ChromaDB, avec
+suivi de la progression et du débit. Un rechargement écrit dans une nouvelle version
+de la collection (voir versions.py), jamais dans celle qui sert les requêtes.
+Utilisé par l'application (préchauffage si la base a changé, /reload en arrière-plan)
+et en ligne de commande :
+
+    python ingestion.py [--full] [--dry-run] [--processes 8] [--batch-size 256] [--threads 2]
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from indexing import chunk_file, load_manifest, save_manifest, plan_sync, apply_sync, summarize_plan
+
+
+class IngestionProgress:
+    """Avancement d'une ingestion (étape, éléments traités, débit), lisible depuis un autre thread"""
+
+    def __init__(self, log_every: float = 0.1):
+        self.log_every = log_every
+        self._lock = threading.Lock()
+        self._state = {"stage": None, "done": 0, "total": 0, "started_at": None, "stages": {}}
+        self._next_log = 0
+
+    def start(self, stage: str, total: int):
+        with self._lock:
+            self._close_stage()
+            self._state.update({"stage": stage, "done": 0, "total": total, "started_at": time.perf_counter()})
+            self._next_log = self.log_every
+        print(f"Ingestion : {stage} ({total})")
+
+    def advance(self, count: int = 1):
+        with self._lock:
+            self._state["done"] += count
+            done, total = self._state["done"], self._state["total"]
+            if not total or done / total < self._next_log:
+                return
+            self._next_log = done / total + self.log_every
+            elapsed = time.perf_counter() - self._state["started_at"]
+            stage = self._state["stage"]
+        print(f"Ingestion : {stage} {done}/{total} ({done / max(elapsed, 1e-9):.1f}/s)")
+
+    def _close_stage(self):
+        stage = self._state["stage"]
+        if stage is None:
+            return
+        elapsed = time.perf_counter() - self._state["started_at"]
+        self._state["stages"][stage] = {
+            "items": self._state["done"],
+            "seconds": round(elapsed, 3),
+            "per_second": round(self._state["done"] / elapsed, 1) if elapsed > 0 else None
+        }
+        self._state["stage"] = None
+
+    def finish(self) -> dict:
+        """Termine l'étape en cours et renvoie durée et débit de chaque étape"""
+        with self._lock:
+            self._close_stage()
+            return dict(self._state["stages"])
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            state = {key: value for key, value in self._state.items() if key != "started_at"}
+            state["stages"] = dict(state["stages"])
+            return state
+
+
+def _chunk_file_task(args):
+    file_path, chunker = args
+    return chunk_file(file_path, chunker)
+
+
+def parallel_chunker(processes: int, min_files: int = 32, progress: IngestionProgress = None):
+    """
+    Fonction `chunk_many(chunker, chemins)` pour plan_sync : pool de processus au-delà
+    de `min_files` fichiers (en dessous, le démarrage des processus coûte plus qu'il ne rapporte).
+    Les processus sont lancés en mode spawn : l'appelant peut avoir des threads actifs.
+    """
+    def chunk_many(chunker, file_paths: list) -> list:
+        if progress:
+            progress.start("chunking", len(file_paths))
+        if processes <= 1 or len(file_paths) < min_files:
+            results = []
+            for file_path in file_paths:
+                results.append(chunk_file(file_path, chunker))
+                if progress:
+                    progress.advance()
+            return results
+
+        results = []
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+            chunksize = max(1, len(file_paths) // (processes * 4))
+            for result in pool.map(_chunk_file_task, ((path, chunker) for path in file_paths), chunksize=chunksize):
+                results.append(result)
+                if progress:
+                    progress.advance()
+        return results
+
+    return chunk_many
+
+
+def _as_lists(vectors) -> list:
+    return [vector.tolist() if hasattr(vector, "tolist") else list(vector) for vector in vectors]
+
+
+def embed_in_batches(documents: list, embed_fn, batch_size: int = 256, threads: int = 2,
+                     progress: IngestionProgress = None):
+    """
+    Génère (début, fin, embeddings) dans l'ordre des documents. Jusqu'à `threads` lots
+    sont encodés en parallèle, et au plus 2 x threads lots attendent d'être écrits.
+    """
+    if progress:
+        progress.start("embedding", len(documents))
+    bounds = [(i, min(i + batch_size, len(documents))) for i in range(0, len(documents), batch_size)]
+
+    with ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="ingest-embed") as pool:
+        window = deque()
+        for start, end in bounds:
+            window.append((start, end, pool.submit(embed_fn, documents[start:end])))
+            if len(window) >= 2 * max(1, threads):
+                start_done, end_done, future = window.popleft()
+                yield start_done, end_done, _as_lists(future.result())
+                if progress:
+                    progress.advance(end_done - start_done)
+        while window:
+            start_done, end_done, future = window.popleft()
+            yield start_done, end_done, _as_lists(future.result())
+            if progress:
+                progress.advance(end_done - start_done)
+
+
+def copy_collection(source, target, batch_size: int = 256, progress: IngestionProgress = None) -> int:
+    """Copie chunks, métadonnées et embeddings d'une collection vers une autre (sans ré-encoder)"""
+    total = source.count()
+    if progress:
+        progress.start("copy", total)
+    for offset in range(0, total, batch_size):
+        batch = source.get(include=["documents", "metadatas", "embeddings"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        target.upsert(
+            ids=batch["ids"],
+            documents=batch["documents"],
+            metadatas=batch["metadatas"],
+            embeddings=_as_lists(batch["embeddings"])
+        )
+        if progress:
+            progress.advance(len(batch["ids"]))
+    return total
+
+
+def run_sync(collection, kb_path: str, manifest_path: str, chunker, embed_fn,
+             processes: int = 1, batch_size: int = 256, threads: int = 2, pool_min_files: int = 32,
+             dry_run: bool = False, progress: IngestionProgress = None) -> dict:
+    """
+    Synchronise la collection avec la base de connaissances (seuls les chunks ajoutés ou
+    modifiés sont encodés). Renvoie le diff, le plan et les durées/débits par étape.
+    """
+    progress = progress or IngestionProgress()
+    manifest = load_manifest(manifest_path, chunker.signature())
+
+    progress.start("scan", 0)
+    existing_ids = set(collection.get(include=[])['ids'])
+    plan = plan_sync(kb_path, manifest, existing_ids, chunker,
+                     chunk_many=parallel_chunker(processes, pool_min_files, progress))
+
+    if not dry_run:
+        batches = embed_in_batches(plan["to_add"]["documents"], embed_fn, batch_size, threads, progress)
+        apply_sync(collection, plan, batch_size=batch_size, embedded_batches=batches)
+        save_manifest(manifest_path, plan["manifest"])
+
+    return {"report": summarize_plan(plan), "plan": plan, "stages": progress.finish()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion de la base de connaissances dans ChromaDB")
+    parser.add_argument("--full", action="store_true", help="reconstruire entièrement la collection")
+    parser.add_argument("--dry-run", action="store_true", help="afficher le diff sans rien écrire")
+    parser.add_argument("--processes", type=int, help="processus de découpage (INGEST_PROCESSES)")
+    parser.add_argument("--batch-size", type=int, help="taille des lots d'embeddings (INGEST_BATCH_SIZE)")
+    parser.add_argument("--threads", type=int, help="threads d'embedding (INGEST_THREADS)")
+    args = parser.parse_args()
+
+    # Réglages repris de l'environnement de l'application ; pas de préchauffage à l'import
+    for name, value in (("INGEST_PROCESSES", args.processes), ("INGEST_BATCH_SIZE", args.batch_size),
+                        ("INGEST_THREADS", args.threads)):
+        if value is not None:
+            os.environ[name] = str(value)
+    os.environ["PRELOAD_MODELS"] = "true"
+    import app as core
+
+    core.connect_vector_db()
+    result = core.reload_collection(dry_run=args.dry_run, full=args.full)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
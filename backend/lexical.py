@@ -0,0 +1,156 @@
+"""
+Index lexical BM25 en mémoire sur les chunks de la base de connaissances
+Normalisation française (minuscules, sans accents, mots vides, racinisation légère)
+et fusion avec les résultats vectoriels par Reciprocal Rank Fusion
+"""
+
+import re
+import math
+import unicodedata
+from collections import Counter
+
+STOP_WORDS = {
+    "a", "au", "aux", "avec", "ce", "ces", "c", "d", "dans", "de", "des", "du", "elle", "en",
+    "est", "et", "eux", "il", "ils", "je", "j", "l", "la", "le", "les", "leur", "lui", "m",
+    "ma", "mais", "me", "mes", "mon", "n", "ne", "ni", "nos", "notre", "nous", "on", "ou",
+    "par", "pas", "pour", "qu", "que", "qui", "quoi", "s", "sa", "se", "ses", "son", "sont",
+    "sur", "t", "ta", "te", "tes", "ton", "tu", "un", "une", "vos", "votre", "vous", "y",
+    "comment", "quel", "quelle", "quels", "quelles", "combien", "peut", "peux", "faut", "etre"
+}
+
+# Suffixes retirés par la racinisation légère (du plus long au plus court)
+SUFFIXES = (
+    "issements", "issement", "ements", "ement", "ations", "ation", "ateurs", "ateur",
+    "atrices", "atrice", "ances", "ance", "ences", "ence", "ables", "able", "iques", "ique",
+    "istes", "iste", "ismes", "isme", "euses", "euse", "ives", "ive", "eaux", "eau"
+)
+
+TOKEN_PATTERN = re.compile(r"\d+(?:[.,]\d+)?|[a-z]+|%")
+
+
+def fold(text: str) -> str:
+    """Minuscules et suppression des accents"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def stem(word: str) -> str:
+    """Racinisation légère du français (suffixes dérivationnels, pluriel, e final)"""
+    if len(word) <= 4 or not word.isalpha():
+        return word
+    for suffix in SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[:-len(suffix)]
+    if word[-1] in "sx":
+        word = word[:-1]
+    if word.endswith("e"):
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: str) -> list:
+    """Termes indexés : nombres, pourcentages et mots racinisés hors mots vides"""
+    return [
+        stem(token)
+        for token in TOKEN_PATTERN.findall(fold(text))
+        if token not in STOP_WORDS
+    ]
+
+
+class BM25Index:
+    """Index inversé BM25 (immuable : reconstruire un nouvel index à chaque rechargement)"""
+
+    def __init__(self, ids: list, documents: list, metadatas: list, k1: float = 1.2, b: float = 0.75):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lengths = []
+
+        for doc_index, document in enumerate(documents):
+            terms = tokenize(document)
+            self.doc_lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                self.postings.setdefault(term, []).append((doc_index, tf))
+
+        n_docs = len(documents)
+        self.avg_length = sum(self.doc_lengths) / n_docs if n_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def search(self, query: str, n_results: int = 10) -> list:
+        """
+        Chunks triés par score BM25, au format des résultats vectoriels
+        ({id, document, metadata, distance}) avec en plus `bm25`, `bm25_norm`
+        (score rapporté à la somme des idf des termes de la requête) et `coverage`
+        (part des termes de la requête présents dans le chunk).
+        """
+        terms = set(tokenize(query))
+        known = [term for term in terms if term in self.postings]
+        if not known:
+            return []
+
+        scores = {}
+        matched = {}
+        for term in known:
+            idf = self.idf[term]
+            for doc_index, tf in self.postings[term]:
+                norm = 1 - self.b + self.b * self.doc_lengths[doc_index] / self.avg_length
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+                matched[doc_index] = matched.get(doc_index, 0) + 1
+
+        max_score = sum(self.idf[term] for term in known)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+
+        return [
+            {
+                "id": self.ids[doc_index],
+                "document": self.documents[doc_index],
+                "metadata": self.metadatas[doc_index] or {},
+                "distance": None,
+                "bm25": score,
+                "bm25_norm": score / max_score if max_score else 0.0,
+                "coverage": matched[doc_index] / len(terms)
+            }
+            for doc_index, score in ranked
+        ]
+
+    def info(self) -> dict:
+        return {"documents": len(self.documents), "terms": len(self.postings)}
+
+
+def is_confident(hits: list, min_score: float, min_margin: float) -> bool:
+    """
+    Le meilleur résultat lexical suffit-il à lui seul ? Il doit couvrir tous les termes
+    de la requête, atteindre le score normalisé minimal et devancer nettement le suivant.
+    """
+    if not hits:
+        return False
+    best = hits[0]
+    if best["coverage"] < 1.0 or best["bm25_norm"] < min_score:
+        return False
+    if len(hits) > 1 and best["bm25"] < min_margin * hits[1]["bm25"]:
+        return False
+    return True
+
+
+def reciprocal_rank_fusion(result_lists: list, n_results: int, k: int = 60) -> list:
+    """Fusionne plusieurs listes de résultats classés (RRF) en conservant les infos de chaque liste"""
+    fused = {}
+    for hits in result_lists:
+        for rank, hit in enumerate(hits):
+            entry = fused.get(hit["id"])
+            if entry is None:
+                entry = fused[hit["id"]] = {**hit, "rrf": 0.0}
+            else:
+                # Compléter avec les champs de l'autre liste (distance vectorielle, score BM25)
+                for key, value in hit.items():
+                    if entry.get(key) is None:
+                        entry[key] = value
+            entry["rrf"] += 1.0 / (k + rank + 1)
+
+    return sorted(fused.values(), key=lambda hit: hit["rrf"], reverse=True)[:n_results]
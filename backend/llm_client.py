@@ -0,0 +1,546 @@
+"""
+Client Ollama avec pool de connexions, limite de concurrence et contre-pression
+Une session HTTP keep-alive est partagée par le processus ; le nombre de générations
+simultanées est borné, avec une file d'attente bornée au-delà de laquelle les
+requêtes sont refusées immédiatement (OllamaBusyError -> HTTP 503 + Retry-After).
+La limite s'applique par processus : avec N workers gunicorn, Ollama reçoit au plus
+N x max_in_flight générations.
+"""
+
+import json
+import time
+import asyncio
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+MSG_UNAVAILABLE = "Le service de génération de texte n'est pas disponible. Veuillez réessayer plus tard."
+MSG_TIMEOUT = "La requête a pris trop de temps. Veuillez réessayer avec une question plus simple."
+MSG_BUSY = "Le service est très sollicité. Veuillez réessayer dans quelques instants."
+MSG_INTERRUPTED = "La génération a été interrompue avant la fin."
+MSG_EMPTY = "Désolé, je n'ai pas pu générer de réponse."
+
+
+class OllamaError(Exception):
+    """Erreur de génération, avec un message destiné à l'utilisateur"""
+
+
+class OllamaBusyError(OllamaError):
+    """Trop de générations en cours : la requête est refusée (HTTP 503)"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def generation_stats(data: dict) -> dict:
+    """Compteurs de tokens et durée renvoyés par Ollama en fin de génération"""
+    return {
+        "eval_count": data.get("eval_count"),
+        "prompt_eval_count": data.get("prompt_eval_count"),
+        "total_duration": data.get("total_duration"),
+        "load_duration": data.get("load_duration"),
+        "prompt_eval_duration": data.get("prompt_eval_duration")
+    }
+
+
+def parse_stream_line(line) -> list:
+    """Événements (type, valeur) d'une ligne NDJSON du flux /api/generate"""
+    chunk = json.loads(line)
+    if chunk.get("error"):
+        return [("error", chunk["error"])]
+    events = []
+    if chunk.get("response"):
+        events.append(("token", chunk["response"]))
+    if chunk.get("done"):
+        events.append(("done", generation_stats(chunk)))
+    return events
+
+
+class ConcurrencyLimiter:
+    """Sémaphore avec file d'attente bornée et délai d'attente maximal"""
+
+    def __init__(self, max_in_flight: int, max_waiting: int):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout: float) -> bool:
+        """Réserve une place ; renvoie False si la file est pleine ou le délai dépassé"""
+        with self._cond:
+            if self.in_flight < self.max_in_flight and self.waiting == 0:
+                self.in_flight += 1
+                return True
+
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                return False
+
+            self.waiting += 1
+            try:
+                acquired = self._cond.wait_for(lambda: self.in_flight < self.max_in_flight, timeout)
+            finally:
+                self.waiting -= 1
+
+            if not acquired:
+                self.rejected += 1
+                return False
+
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+
+class GenerationStream:
+    """
+    Itérateur d'événements d'une génération en streaming.
+    La place réservée dans le limiteur est libérée une seule fois, à la fin du flux,
+    à la fermeture, ou à la destruction si le flux n'a jamais été consommé.
+    """
+
+    def __init__(self, events, limiter: ConcurrencyLimiter):
+        self._events = events
+        self._limiter = limiter
+        self._released = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._events)
+        except StopIteration:
+            self.release()
+            raise
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._limiter.release()
+
+    def close(self):
+        self._events.close()
+        self.release()
+
+    def __del__(self):
+        self.close()
+
+
+class OllamaClient:
+    """Client HTTP Ollama partagé (thread-safe)"""
+
+    def __init__(self, base_url: str, model: str, options: dict = None,
+                 max_in_flight: int = 2, max_waiting: int = 8, queue_timeout: float = 30,
+                 timeout: float = 120, connect_timeout: float = 5, max_retries: int = 2,
+                 retry_backoff: float = 0.5):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.options = options or {}
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.limiter = ConcurrencyLimiter(max_in_flight, max_waiting)
+        self.errors = {}
+
+        # Pool keep-alive dimensionné sur les générations simultanées possibles
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight + 2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _count_error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def _acquire(self, deadline: float):
+        wait = max(0.0, min(self.queue_timeout, deadline - time.monotonic()))
+        if not self.limiter.acquire(wait):
+            self._count_error("busy")
+            raise OllamaBusyError(
+                MSG_BUSY,
+                retry_after=max(1, int(self.queue_timeout))
+            )
+
+    def _post(self, prompt: str, stream: bool, deadline: float):
+        """POST /api/generate avec nouvelle tentative sur erreur de connexion"""
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._count_error("timeout")
+                raise OllamaError(MSG_TIMEOUT)
+
+            try:
+                return self.session.post(
+                    f"{self.base_url}/api/generate",
+                    json={
+                        "model": self.model,
+                        "prompt": prompt,
+                        "stream": stream,
+                        "options": self.options
+                    },
+                    stream=stream,
+                    timeout=(min(self.connect_timeout, remaining), remaining)
+                )
+            except requests.exceptions.ConnectionError:
+                # Erreur transitoire (redémarrage d'Ollama, connexion keep-alive fermée)
+                attempt += 1
+                if attempt > self.max_retries:
+                    self._count_error("connection")
+                    raise OllamaError(MSG_UNAVAILABLE)
+                time.sleep(min(self.retry_backoff * 2 ** (attempt - 1), max(0.0, deadline - time.monotonic())))
+            except requests.exceptions.Timeout:
+                self._count_error("timeout")
+                raise OllamaError(MSG_TIMEOUT)
+            except Exception as e:
+                self._count_error("unexpected")
+                raise OllamaError(f"Une erreur inattendue s'est produite : {str(e)}")
+
+    def _check_status(self, response):
+        if response.status_code != 200:
+            response.close()
+            self._count_error(f"http_{response.status_code}")
+            raise OllamaError(f"Erreur de communication avec le modèle de langage (code {response.status_code}).")
+
+    def complete(self, prompt: str, timeout: float = None) -> dict:
+        """
+        Génère une réponse complète (lève OllamaError / OllamaBusyError en cas d'échec).
+        Renvoie {"response": texte, "stats": compteurs de tokens et durée d'Ollama}.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._acquire(deadline)
+        try:
+            response = self._post(prompt, stream=False, deadline=deadline)
+            self._check_status(response)
+            data = response.json()
+            return {
+                "response": data.get("response", MSG_EMPTY),
+                "stats": generation_stats(data)
+            }
+        finally:
+            self.limiter.release()
+
+    def generate(self, prompt: str, timeout: float = None) -> str:
+        """Génère une réponse complète et ne renvoie que le texte"""
+        return self.complete(prompt, timeout)["response"]
+
+    def open_stream(self, prompt: str, timeout: float = None):
+        """
+        Démarre une génération en streaming.
+        La place est réservée et la connexion ouverte avant le retour, pour que les erreurs
+        de saturation ou de connexion remontent avant l'envoi de la réponse HTTP.
+        Renvoie un itérateur de tuples (type, valeur) : ("token", texte) pour chaque
+        fragment, puis ("done", statistiques) ou ("error", message).
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self._acquire(deadline)
+        try:
+            response = self._post(prompt, stream=True, deadline=deadline)
+            self._check_status(response)
+        except Exception:
+            self.limiter.release()
+            raise
+
+        return GenerationStream(self._iter_stream(response, deadline), self.limiter)
+
+    def _iter_stream(self, response, deadline: float):
+        try:
+            with response:
+                for line in response.iter_lines():
+                    if time.monotonic() > deadline:
+                        self._count_error("timeout")
+                        yield "error", MSG_TIMEOUT
+                        return
+                    if not line:
+                        continue
+                    events = parse_stream_line(line)
+                    for kind, value in events:
+                        if kind == "error":
+                            self._count_error("model")
+                        yield kind, value
+                    if events and events[-1][0] in ("done", "error"):
+                        return
+
+            self._count_error("interrupted")
+            yield "error", MSG_INTERRUPTED
+
+        except requests.exceptions.RequestException:
+            self._count_error("connection")
+            yield "error", MSG_UNAVAILABLE
+        except Exception as e:
+            self._count_error("unexpected")
+            yield "error", f"Une erreur inattendue s'est produite : {str(e)}"
+
+    def info(self) -> dict:
+        """État du client pour /health"""
+        return {
+            "in_flight": self.limiter.in_flight,
+            "waiting": self.limiter.waiting,
+            "max_in_flight": self.limiter.max_in_flight,
+            "max_waiting": self.limiter.max_waiting,
+            "rejected": self.limiter.rejected,
+            "errors": dict(self.errors)
+        }
+
+
+class AsyncConcurrencyLimiter:
+    """Équivalent asyncio de ConcurrencyLimiter (une boucle d'événements par processus)"""
+
+    def __init__(self, max_in_flight: int, max_waiting: int):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._cond = None
+
+    async def acquire(self, timeout: float) -> bool:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        async with self._cond:
+            if self.in_flight < self.max_in_flight and self.waiting == 0:
+                self.in_flight += 1
+                return True
+
+            if self.waiting >= self.max_waiting:
+                self.rejected += 1
+                return False
+
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(
+                    self._cond.wait_for(lambda: self.in_flight < self.max_in_flight),
+                    timeout
+                )
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                return False
+            finally:
+                self.waiting -= 1
+
+            self.in_flight += 1
+            return True
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+
+class AsyncGenerationStream:
+    """Équivalent asynchrone de GenerationStream : libère sa place une seule fois"""
+
+    def __init__(self, events, limiter: AsyncConcurrencyLimiter, response):
+        self._events = events
+        self._limiter = limiter
+        self._response = response
+        self._released = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self._events.__anext__()
+        except StopAsyncIteration:
+            await self.release()
+            raise
+
+    async def release(self):
+        if self._released:
+            return
+        self._released = True
+        await self._response.aclose()
+        await self._limiter.release()
+
+    async def aclose(self):
+        await self._events.aclose()
+        await self.release()
+
+
+class AsyncOllamaClient:
+    """
+    Client Ollama non bloquant (httpx) pour le mode ASGI : une seule boucle d'événements
+    peut attendre des centaines de générations sans occuper de thread.
+    Mêmes garanties que OllamaClient : pool keep-alive, concurrence bornée, échéance unique.
+    """
+
+    def __init__(self, base_url: str, model: str, options: dict = None,
+                 max_in_flight: int = 2, max_waiting: int = 8, queue_timeout: float = 30,
+                 timeout: float = 120, connect_timeout: float = 5, max_retries: int = 2,
+                 retry_backoff: float = 0.5):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.options = options or {}
+        self.queue_timeout = queue_timeout
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.limiter = AsyncConcurrencyLimiter(max_in_flight, max_waiting)
+        self.errors = {}
+        self._max_connections = max_in_flight + 2
+        self._client = None
+
+    def _http(self):
+        # Créé à la première utilisation, dans la boucle d'événements du serveur
+        if self._client is None:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(
+                    max_connections=self._max_connections,
+                    max_keepalive_connections=self._max_connections
+                )
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _count_error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    async def _acquire(self, deadline: float):
+        wait = max(0.0, min(self.queue_timeout, deadline - time.monotonic()))
+        if not await self.limiter.acquire(wait):
+            self._count_error("busy")
+            raise OllamaBusyError(MSG_BUSY, retry_after=max(1, int(self.queue_timeout)))
+
+    async def _send(self, prompt: str, stream: bool, deadline: float):
+        """POST /api/generate avec nouvelle tentative sur erreur de connexion"""
+        import httpx
+
+        client = self._http()
+        attempt = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._count_error("timeout")
+                raise OllamaError(MSG_TIMEOUT)
+
+            request = client.build_request(
+                "POST",
+                "/api/generate",
+                json={
+                    "model": self.model,
+                    "prompt": prompt,
+                    "stream": stream,
+                    "options": self.options
+                },
+                timeout=httpx.Timeout(remaining, connect=min(self.connect_timeout, remaining))
+            )
+            try:
+                response = await client.send(request, stream=True)
+            except httpx.ConnectError:
+                attempt += 1
+                if attempt > self.max_retries:
+                    self._count_error("connection")
+                    raise OllamaError(MSG_UNAVAILABLE)
+                await asyncio.sleep(min(self.retry_backoff * 2 ** (attempt - 1), max(0.0, deadline - time.monotonic())))
+                continue
+            except httpx.TimeoutException:
+                self._count_error("timeout")
+                raise OllamaError(MSG_TIMEOUT)
+            except Exception as e:
+                self._count_error("unexpected")
+                raise OllamaError(f"Une erreur inattendue s'est produite : {str(e)}")
+
+            if response.status_code != 200:
+                await response.aclose()
+                self._count_error(f"http_{response.status_code}")
+                raise OllamaError(f"Erreur de communication avec le modèle de langage (code {response.status_code}).")
+
+            return response
+
+    async def complete(self, prompt: str, timeout: float = None) -> dict:
+        """Génère une réponse complète : {"response": texte, "stats": compteurs}"""
+        import httpx
+
+        deadline = time.monotonic() + (timeout or self.timeout)
+        await self._acquire(deadline)
+        try:
+            response = await self._send(prompt, stream=False, deadline=deadline)
+            try:
+                data = json.loads(await response.aread())
+            except httpx.TimeoutException:
+                self._count_error("timeout")
+                raise OllamaError(MSG_TIMEOUT)
+            finally:
+                await response.aclose()
+            return {
+                "response": data.get("response", MSG_EMPTY),
+                "stats": generation_stats(data)
+            }
+        finally:
+            await self.limiter.release()
+
+    async def open_stream(self, prompt: str, timeout: float = None):
+        """
+        Démarre une génération en streaming (place réservée et connexion ouverte avant le retour).
+        Renvoie un itérateur asynchrone de tuples (type, valeur), comme OllamaClient.open_stream.
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        await self._acquire(deadline)
+        try:
+            response = await self._send(prompt, stream=True, deadline=deadline)
+        except Exception:
+            await self.limiter.release()
+            raise
+
+        return AsyncGenerationStream(self._iter_stream(response, deadline), self.limiter, response)
+
+    async def _iter_stream(self, response, deadline: float):
+        import httpx
+
+        try:
+            async for line in response.aiter_lines():
+                if time.monotonic() > deadline:
+                    self._count_error("timeout")
+                    yield "error", MSG_TIMEOUT
+                    return
+                if not line:
+                    continue
+                events = parse_stream_line(line)
+                for kind, value in events:
+                    if kind == "error":
+                        self._count_error("model")
+                    yield kind, value
+                if events and events[-1][0] in ("done", "error"):
+                    return
+
+            self._count_error("interrupted")
+            yield "error", MSG_INTERRUPTED
+
+        except httpx.HTTPError:
+            self._count_error("connection")
+            yield "error", MSG_UNAVAILABLE
+        except Exception as e:
+            self._count_error("unexpected")
+            yield "error", f"Une erreur inattendue s'est produite : {str(e)}"
+
+    def info(self) -> dict:
+        """État du client pour /health"""
+        return {
+            "in_flight": self.limiter.in_flight,
+            "waiting": self.limiter.waiting,
+            "max_in_flight": self.limiter.max_in_flight,
+            "max_waiting": self.limiter.max_waiting,
+            "rejected": self.limiter.rejected,
+            "errors": dict(self.errors)
+        }
@@ -0,0 +1,47 @@
+"""
+Verrou inter-processus sur fichier (workers gunicorn, CLI d'ingestion)
+Verrou exclusif `fcntl.flock`, libéré à la fermeture du fichier (y compris si le
+processus meurt). Sans fcntl (Windows, serveur de développement mono-processus),
+le verrou est sans effet.
+"""
+
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def acquire_file_lock(lock_path: str, blocking: bool = True):
+    """
+    Prend le verrou `lock_path` ; renvoie le fichier ouvert à passer à release_file_lock,
+    ou None s'il est déjà pris (blocking=False). Un verrou pris par un thread peut être
+    libéré par un autre.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(lock_path)), exist_ok=True)
+    f = open(lock_path, 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return None
+    return f
+
+
+def release_file_lock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    f.close()
+
+
+@contextmanager
+def file_lock(lock_path: str):
+    """Section critique partagée par tous les processus utilisant `lock_path`"""
+    f = acquire_file_lock(lock_path)
+    try:
+        yield
+    finally:
+        release_file_lock(f)
@@ -0,0 +1,205 @@
+"""
+Métriques du chatbot au format texte Prometheus (sans dépendance externe)
+Histogrammes de latence par étape, compteurs de requêtes, et valeurs lues au moment
+de la collecte (taille de la collection, générations en cours, erreurs Ollama).
+Les métriques sont propres à chaque processus : avec plusieurs workers gunicorn,
+chaque collecte de /metrics ne reflète que le worker qui l'a servie.
+"""
+
+import time
+import threading
+import contextlib
+
+# Bornes des histogrammes de latence (secondes) : du BM25 (ms) à la génération (dizaines de s)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Histogramme cumulatif, une série par combinaison d'étiquettes"""
+
+    def __init__(self, name: str, help_text: str, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: {**value, "buckets": list(value["buckets"])} for key, value in self._series.items()}
+        for key, value in sorted(series.items()):
+            for bound, count in zip(self.buckets, value["buckets"]):
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {value['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(value['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {value['count']}")
+        return lines
+
+
+class Counter:
+    """Compteur croissant, une série par combinaison d'étiquettes"""
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = dict(self._series)
+        for key, value in sorted(series.items()):
+            lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """Valeur instantanée (incrémentée et décrémentée)"""
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self) -> list:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Registry:
+    """
+    Ensemble des métriques exposées sur /metrics.
+    Les collecteurs sont des fonctions appelées à chaque collecte, qui renvoient des
+    tuples (nom, type, aide, [(étiquettes, valeur)]) ; ils sont indexés par clé pour
+    qu'un mode de service puisse remplacer celui d'un composant (client Ollama async).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = {}
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def set_collector(self, key: str, collect):
+        self._collectors[key] = collect
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for key, collect in list(self._collectors.items()):
+            try:
+                families = collect()
+            except Exception as e:
+                print(f"Collecteur de métriques {key} en échec : {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "chatbot_stage_seconds",
+    "Durée de chaque étape du traitement d'une question"
+))
+REQUEST_SECONDS = registry.register(Histogram(
+    "chatbot_request_seconds",
+    "Durée totale des requêtes de chat par endpoint et issue"
+))
+REQUESTS = registry.register(Counter(
+    "chatbot_requests_total",
+    "Requêtes de chat par endpoint et issue"
+))
+REQUESTS_IN_FLIGHT = registry.register(Gauge(
+    "chatbot_requests_in_flight",
+    "Requêtes de chat en cours de traitement (réponse en streaming comprise)"
+))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def observe_stage(stage: str, seconds: float, timings: dict = None):
+    """Enregistre la durée d'une étape (histogramme et, si fourni, détail de la requête en ms)"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0) + seconds * 1000, 2)
+
+
+def record_request(endpoint: str, outcome: str, started: float):
+    """Compte une requête de chat terminée et sa durée (depuis `started`, perf_counter)"""
+    REQUESTS.inc(endpoint=endpoint, outcome=outcome)
+    REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, outcome=outcome)
+
+
+def timings_summary(timings: dict, started: float) -> dict:
+    """Bloc `timings` d'une réponse : durées des étapes et total, en millisecondes"""
+    return {**timings, "total": round((time.perf_counter() - started) * 1000, 2)}
+
+
+@contextlib.contextmanager
+def timed(stage: str, timings: dict = None):
+    """Chronomètre un bloc de code comme étape `stage`"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started, timings)
+
+
+def ollama_collector(client):
+    """Collecteur des compteurs d'un client Ollama (sync ou async)"""
+    def collect():
+        info = client.info()
+        return [
+            ("chatbot_ollama_in_flight", "gauge", "Générations Ollama en cours",
+             [({}, info["in_flight"])]),
+            ("chatbot_ollama_waiting", "gauge", "Générations en attente d'une place",
+             [({}, info["waiting"])]),
+            ("chatbot_ollama_rejected_total", "counter", "Générations refusées (file pleine)",
+             [({}, info["rejected"])]),
+            ("chatbot_ollama_errors_total", "counter", "Erreurs Ollama par type",
+             [({"kind": kind}, count) for kind, count in sorted(info["errors"].items())])
+        ]
+    return collect
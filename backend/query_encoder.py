@@ -0,0 +1,93 @@
+"""
+Encodeur de questions ONNX (optionnel)
+Le modèle d'embedding exporté en ONNX, éventuellement quantifié en int8, encode les
+questions sans PyTorch : plus rapide sur CPU et beaucoup plus léger par worker. Les
+documents restent encodés par sentence-transformers à l'ingestion (même espace) : ce
+modèle n'est chargé que par le processus qui ingère, au premier lot à encoder.
+
+Préparation du répertoire (model.onnx ou model_quantized.onnx, tokenizer.json) :
+
+    optimum-cli export onnx --model sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2 onnx_encoder/
+    python -c "from onnxruntime.quantization import quantize_dynamic, QuantType; \\
+        quantize_dynamic('onnx_encoder/model.onnx', 'onnx_encoder/model_quantized.onnx', weight_type=QuantType.QInt8)"
+"""
+
+import os
+import threading
+
+import numpy as np
+
+MODEL_FILES = ("model_quantized.onnx", "model.onnx")
+
+
+class OnnxQueryEncoder:
+    """
+    Appelable `encoder(textes) -> vecteurs` (moyenne des états cachés pondérée par le
+    masque d'attention, comme le pooling de sentence-transformers). Nécessite
+    onnxruntime et tokenizers ; sinon `load()` échoue et l'application garde
+    le modèle sentence-transformers.
+    """
+
+    def __init__(self, model_dir: str, max_length: int = 128, threads: int = 1):
+        self.model_dir = model_dir
+        self.max_length = max_length
+        self.threads = threads
+        self.model_file = None
+        self._session = None
+        self._tokenizer = None
+        self._input_names = ()
+        self._lock = threading.Lock()
+
+    def load(self) -> bool:
+        """Charge le modèle et le tokenizer (au préchauffage) ; False si indisponible"""
+        with self._lock:
+            if self._session is not None:
+                return True
+            try:
+                import onnxruntime
+                from tokenizers import Tokenizer
+
+                self.model_file = next(
+                    (name for name in MODEL_FILES if os.path.exists(os.path.join(self.model_dir, name))),
+                    None
+                )
+                if self.model_file is None:
+                    raise FileNotFoundError(f"aucun de {', '.join(MODEL_FILES)} dans {self.model_dir}")
+
+                options = onnxruntime.SessionOptions()
+                options.intra_op_num_threads = self.threads
+                self._session = onnxruntime.InferenceSession(
+                    os.path.join(self.model_dir, self.model_file),
+                    sess_options=options,
+                    providers=["CPUExecutionProvider"]
+                )
+                self._input_names = tuple(i.name for i in self._session.get_inputs())
+
+                self._tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+                self._tokenizer.enable_truncation(max_length=self.max_length)
+                self._tokenizer.enable_padding()
+                return True
+            except Exception as e:
+                self._session = None
+                print(f"Encodeur ONNX {self.model_dir} indisponible, modèle sentence-transformers conservé : {e}")
+                return False
+
+    @property
+    def loaded(self) -> bool:
+        return self._session is not None
+
+    def __call__(self, texts: list) -> list:
+        encodings = self._tokenizer.encode_batch(list(texts))
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        hidden = self._session.run(None, {name: feeds[name] for name in self._input_names})[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled.tolist()
+
+    def info(self) -> dict:
+        return {"backend": "onnx", "model": self.model_file, "loaded": self.loaded}
@@ -0,0 +1,193 @@
+"""
+Mémoire de conversation par session
+Les derniers échanges de chaque session sont gardés dans un magasin borné : nombre de
+tours par session, expiration après inactivité, nombre de sessions et mémoire totale
+(taille des chaînes comptée explicitement), avec éviction des sessions les moins récentes.
+Sert à reformuler les questions de relance avant la recherche et à donner
+l'historique récent au modèle.
+"""
+
+import re
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+# Coût fixe estimé (octets) d'une session et d'un tour, en plus des chaînes
+SESSION_OVERHEAD = 200
+TURN_OVERHEAD = 64
+
+# Mots qui, en début de message, signalent une relance dépendant de l'échange précédent
+FOLLOW_UP_STARTS = {
+    "et", "mais", "ou", "alors", "donc", "aussi", "sinon", "pareil", "idem",
+    "il", "elle", "ils", "elles", "ce", "cela", "ça", "ca", "celui", "celle", "ceux", "lequel", "laquelle",
+    "dans", "pour", "avec", "sans", "si", "même"
+}
+# Pronoms et reprises qui, dans un message court, renvoient à l'échange précédent
+# (« combien pour lui ? ») ; un message court sans reprise (« plafond déduction PER ») est autonome
+FOLLOW_UP_REFERENCES = {
+    "il", "elle", "ils", "elles", "lui", "eux", "leur", "ce", "cela", "ça", "ca", "celui", "celle",
+    "ceux", "celles", "lequel", "laquelle", "lesquels", "même", "aussi", "pareil", "idem"
+}
+FOLLOW_UP_MAX_WORDS = 3
+
+
+class Session:
+    """Échanges récents d'une session : tuples (question, sujet, réponse tronquée)"""
+
+    __slots__ = ("turns", "last_seen", "size")
+
+    def __init__(self, now: float):
+        self.turns = ()
+        self.last_seen = now
+        self.size = SESSION_OVERHEAD
+
+
+def turn_size(question: str, topic: str, answer: str) -> int:
+    # Le sujet d'une question autonome est la question elle-même (même objet)
+    topic_size = 0 if topic is question else sys.getsizeof(topic)
+    return sys.getsizeof(question) + topic_size + sys.getsizeof(answer) + TURN_OVERHEAD
+
+
+class SessionStore:
+    """Magasin LRU des sessions, borné en nombre, en mémoire et en inactivité (thread-safe)"""
+
+    def __init__(self, max_turns: int = 6, idle_ttl: float = 1800, max_sessions: int = 50000,
+                 max_bytes: int = 64 * 1024 * 1024, max_answer_chars: int = 500):
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_answer_chars = max_answer_chars
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"expired": 0, "evicted": 0}
+
+    def _drop(self, session_id: str):
+        session = self._sessions.pop(session_id)
+        self._bytes -= session.size + sys.getsizeof(session_id)
+
+    def _expire(self, now: float):
+        # L'ordre du dictionnaire est celui de la dernière activité : les sessions
+        # inactives sont en tête, le parcours s'arrête à la première session active
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_seen <= self.idle_ttl:
+                break
+            self._drop(session_id)
+            self.stats["expired"] += 1
+
+    def _enforce_limits(self):
+        while self._sessions and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._sessions)))
+            self.stats["evicted"] += 1
+
+    def history(self, session_id: str) -> tuple:
+        """Tours (question, sujet, réponse) de la session, du plus ancien au plus récent"""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                return ()
+            session.last_seen = now
+            self._sessions.move_to_end(session_id)
+            return session.turns
+
+    def append(self, session_id: str, question: str, topic: str, answer: str):
+        """
+        Ajoute un tour ; `topic` est la question autonome à laquelle se rattache le tour.
+        La réponse est tronquée, les tours les plus anciens sont oubliés.
+        """
+        if len(answer) > self.max_answer_chars:
+            answer = answer[:self.max_answer_chars].rsplit(" ", 1)[0] + "…"
+        now = time.time()
+
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = Session(now)
+                self._bytes += session.size + sys.getsizeof(session_id)
+            else:
+                self._sessions.move_to_end(session_id)
+
+            turns = session.turns + ((question, topic, answer),)
+            if len(turns) > self.max_turns:
+                turns = turns[-self.max_turns:]
+            size = SESSION_OVERHEAD + sum(turn_size(*turn) for turn in turns)
+
+            self._bytes += size - session.size
+            session.turns = turns
+            session.size = size
+            session.last_seen = now
+            self._enforce_limits()
+
+    def clear(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id not in self._sessions:
+                return False
+            self._drop(session_id)
+            return True
+
+    def info(self) -> dict:
+        """Taille du magasin pour /health et /metrics"""
+        with self._lock:
+            self._expire(time.time())
+            return {
+                **self.stats,
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                "max_sessions": self.max_sessions,
+                "max_bytes": self.max_bytes
+            }
+
+
+def is_follow_up(message: str) -> bool:
+    """
+    Relance commençant par un connecteur/pronom (« et pour un PERO ? »), ou message court
+    contenant une reprise (« combien pour lui ? »)
+    """
+    words = re.findall(r"\w+", message.lower())
+    if not words:
+        return False
+    if words[0] in FOLLOW_UP_STARTS:
+        return True
+    return len(words) <= FOLLOW_UP_MAX_WORDS and not FOLLOW_UP_REFERENCES.isdisjoint(words)
+
+
+def conversation_topic(message: str, turns: tuple) -> str:
+    """
+    Sujet d'un message : lui-même s'il est autonome, sinon celui du tour précédent
+    (des relances successives restent rattachées à la dernière question autonome).
+    """
+    if not turns or not is_follow_up(message):
+        return message
+    return turns[-1][1]
+
+
+def rewrite_query(message: str, turns: tuple) -> str:
+    """
+    Requête de recherche : une relance est complétée par le sujet de la conversation
+    (« et pour un PERO ? » après une question sur le plafond de déduction) ;
+    une question autonome est recherchée telle quelle.
+    """
+    topic = conversation_topic(message, turns)
+    return message if topic is message else f"{topic} {message}"
+
+
+def format_history(turns: tuple, counter, budget_tokens: int) -> str:
+    """Derniers échanges, du plus récent au plus ancien, dans la limite de `budget_tokens`"""
+    lines = []
+    used = 0
+    for question, _, answer in reversed(turns):
+        block = f"Utilisateur : {question}\nAssistant : {answer}"
+        cost = counter.count(block)
+        if used + cost > budget_tokens:
+            break
+        lines.insert(0, block)
+        used += cost
+    return "\n\n".join(lines)
@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+# Les modules du backend s'importent à plat (`from indexing import ...`)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Configuration lue à l'import de l'application, commune à tous les tests qui l'importent :
+# encodeur ONNX, index mmap, pas de préchauffage en arrière-plan (preload) et aucun
+# fichier écrit dans le dépôt
+os.environ.update({
+    "QUERY_ENCODER": "onnx",
+    "VECTOR_STORE": "mmap",
+    "PRELOAD_MODELS": "true",
+    "CHROMA_PERSIST_PATH": tempfile.mkdtemp()
+})
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import answer_cache
+from answer_cache import AnswerCache, EXPIRED
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def test_normalized_question_is_an_exact_hit():
+    cache = AnswerCache()
+    cache.put("Quel est le plafond du PER ?", None, {"response": "10 %"})
+
+    assert cache.get_exact("quel est le PLAFOND du per") == {"response": "10 %"}
+    assert cache.info()["exact_hits"] == 1
+
+
+def test_expired_exact_entry_is_dropped_and_counted_as_a_miss(clock):
+    cache = AnswerCache(ttl=60)
+    cache.put("Plafond du PER ?", [1.0, 0.0], {"response": "10 %"})
+
+    clock[0] += 30
+    assert cache.get_exact("Plafond du PER ?") == {"response": "10 %"}
+
+    clock[0] += 31
+    assert cache.get_exact("Plafond du PER ?") is EXPIRED
+    assert cache.get_exact("Plafond du PER ?") is None
+
+    info = cache.info()
+    assert info["size"] == 0 and info["expired"] == 1
+    assert info["exact_hits"] == 1 and info["misses"] == 1 and info["hit_rate"] == 0.5
+
+
+def test_expired_entries_are_not_served_by_similarity(clock):
+    cache = AnswerCache(ttl=60)
+    cache.put("Plafond du PER ?", [1.0, 0.0], {"response": "10 %"})
+    clock[0] += 61
+
+    assert cache.get_similar([1.0, 0.0]) is None
+    assert cache.info()["size"] == 0 and cache.info()["misses"] == 1
+
+
+def test_least_recently_used_entry_is_evicted_first():
+    cache = AnswerCache(max_size=2)
+    cache.put("question a", None, {"response": "a"})
+    cache.put("question b", None, {"response": "b"})
+    cache.get_exact("question a")
+    cache.put("question c", None, {"response": "c"})
+
+    assert cache.get_exact("question b") is None
+    assert cache.get_exact("question a") == {"response": "a"}
+    assert cache.get_exact("question c") == {"response": "c"}
+    assert cache.info()["evictions"] == 1
+
+
+def test_semantic_hit_requires_the_similarity_threshold():
+    cache = AnswerCache(threshold=0.95)
+    cache.put("Plafond du PER ?", [1.0, 0.0], {"response": "per"})
+    cache.put("Rachat de trimestres ?", [0.0, 1.0], {"response": "trimestres"})
+    cache.put("Sans embedding", None, {"response": "exact"})
+
+    # cos = 0.96 : au-dessus du seuil ; cos = 0.8 : en dessous
+    close = np.array([0.96, np.sqrt(1 - 0.96 ** 2)])
+    far = np.array([0.8, 0.6])
+
+    assert cache.get_similar(close * 3) == {"response": "per"}
+    assert cache.get_similar(far) is None
+
+    info = cache.info()
+    assert info["semantic_hits"] == 1 and info["misses"] == 1
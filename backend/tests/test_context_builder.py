@@ -0,0 +1,38 @@
+from context_builder import TokenCounter, build_context
+
+
+def counter():
+    # Modèle sans tokenizer connu : estimation par caractères
+    counter = TokenCounter("modele-local", chars_per_token=1.0)
+    counter.load()
+    return counter
+
+
+def hit(document, distance=0.5):
+    return {"document": document, "distance": distance}
+
+
+def test_far_and_duplicate_chunks_are_dropped():
+    text = "Le plafond de déduction du PER dépend des revenus professionnels de l'année."
+    hits = [hit(text, 0.2), hit(text + " Voir aussi.", 0.3), hit("Rachat de trimestres.", 1.8)]
+
+    selected, context, stats = build_context(hits, counter(), budget_tokens=1000, max_distance=1.0)
+
+    assert selected == hits[:1] and context == text
+    assert stats["dropped_duplicate"] == 1 and stats["dropped_distance"] == 1
+
+
+def test_budget_skips_long_chunks_and_keeps_shorter_ones():
+    hits = [hit("a" * 50), hit("b " * 40), hit("court")]
+
+    selected, _, stats = build_context(hits, counter(), budget_tokens=70)
+
+    assert [h["document"] for h in selected] == ["a" * 50, "court"]
+    assert stats["dropped_budget"] == 1 and stats["context_tokens"] <= 70
+
+
+def test_first_chunk_is_truncated_when_it_does_not_fit_alone():
+    selected, context, stats = build_context([hit("ligne\n" * 40)], counter(), budget_tokens=30)
+
+    assert len(selected) == 1 and stats["truncated"] == 1
+    assert counter().count(context) <= 30
@@ -0,0 +1,46 @@
+import threading
+
+import pytest
+
+from embedding_batcher import EmbeddingBatcher
+
+
+def test_concurrent_calls_are_encoded_together():
+    calls = []
+
+    def embed(texts):
+        calls.append(len(texts))
+        return [[float(len(text))] for text in texts]
+
+    batcher = EmbeddingBatcher(embed, max_batch_size=8, max_wait_ms=200)
+    texts = [f"question {'x' * i}" for i in range(8)]
+    results = {}
+    barrier = threading.Barrier(len(texts))
+
+    def ask(text):
+        barrier.wait()
+        results[text] = batcher.embed(text)
+
+    threads = [threading.Thread(target=ask, args=(text,)) for text in texts]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(results[text] == [float(len(text))] for text in texts)
+    assert len(calls) < len(texts) and sum(calls) == len(texts)
+    assert batcher.info()["items"] == len(texts) and batcher.info()["max_batch"] <= 8
+
+
+def test_error_is_raised_to_every_caller_and_batcher_keeps_running():
+    def embed(texts):
+        if "panne" in texts:
+            raise RuntimeError("modèle indisponible")
+        return [[1.0] for _ in texts]
+
+    batcher = EmbeddingBatcher(embed, max_wait_ms=1)
+
+    with pytest.raises(RuntimeError):
+        batcher.embed("panne", timeout=5)
+    assert batcher.embed("question", timeout=5) == [1.0]
+    assert batcher.info()["errors"] == 1
@@ -0,0 +1,34 @@
+from faq import FAQIndex, build_answers, vet_answers
+
+CONFIG = [{"id": "definition-per", "question": "C'est quoi un PER ?", "variants": ["Que veut dire PER ?"]}]
+MANIFEST = {"00_definitions.md": {"sha256": "abc"}}
+
+
+def generate(question):
+    return {"response": "Le PER est un plan d'épargne retraite.", "sources": ["00_definitions.md"], "chunks": []}
+
+
+def embed(texts):
+    return [[1.0, float(len(text))] for text in texts]
+
+
+def test_generated_answer_is_served_only_after_vetting():
+    answers, report = build_answers(CONFIG, {}, MANIFEST, generate)
+    index = FAQIndex()
+    index.load(CONFIG, answers, MANIFEST, embed)
+    assert report["generated"] == ["definition-per"]
+    assert index.match_exact("c'est quoi un PER ?") is None
+
+    assert vet_answers(answers, ["definition-per", "inconnue"]) == ["inconnue"]
+    index.load(CONFIG, answers, MANIFEST, embed)
+    assert index.match_exact("Que veut dire PER ?")["response"].startswith("Le PER")
+
+
+def test_changed_source_makes_answer_stale():
+    answers, _ = build_answers(CONFIG, {}, MANIFEST, generate)
+    vet_answers(answers, ["definition-per"])
+    index = FAQIndex()
+
+    stale = index.load(CONFIG, answers, {"00_definitions.md": {"sha256": "modifié"}}, embed)
+
+    assert stale == ["definition-per"] and index.size == 0
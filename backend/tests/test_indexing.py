@@ -0,0 +1,67 @@
+from chunking import MarkdownChunker
+from indexing import plan_sync, apply_sync, load_manifest, summarize_plan
+
+
+class FakeCollection:
+    """Collection ChromaDB minimale en mémoire (id -> (document, métadonnées))"""
+
+    def __init__(self):
+        self.items = {}
+
+    def upsert(self, ids, documents, metadatas, embeddings=None):
+        for chunk_id, document, metadata in zip(ids, documents, metadatas):
+            self.items[chunk_id] = (document, metadata)
+
+    def update(self, ids, metadatas):
+        for chunk_id, metadata in zip(ids, metadatas):
+            self.items[chunk_id] = (self.items[chunk_id][0], metadata)
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            del self.items[chunk_id]
+
+
+def sync(kb_path, collection, manifest, chunker):
+    plan = plan_sync(str(kb_path), manifest, set(collection.items), chunker)
+    apply_sync(collection, plan)
+    return plan
+
+
+def test_chunk_offsets_match_file_content(tmp_path):
+    content = "# Titre\n\n## Section A\n\nPremier paragraphe.\n\n## Section B\n\nSecond paragraphe.\n"
+    (tmp_path / "doc.md").write_text(content, encoding="utf-8")
+
+    chunks = list(MarkdownChunker().chunk_file(str(tmp_path / "doc.md"), "doc.md"))
+
+    assert [metadata["heading_path"] for _, metadata in chunks] == ["Titre > Section A", "Titre > Section B"]
+    for text, metadata in chunks:
+        assert content[metadata["start_char"]:metadata["end_char"]] == text
+
+
+def test_modified_file_rewrites_metadata_of_unchanged_chunks(tmp_path):
+    chunker = MarkdownChunker()
+    doc = tmp_path / "doc.md"
+    doc.write_text("## Section B\n\nParagraphe inchangé.\n", encoding="utf-8")
+    collection = FakeCollection()
+    plan = sync(tmp_path, collection, load_manifest(str(tmp_path / "m.json"), chunker.signature()), chunker)
+    (chunk_id,) = collection.items
+
+    content = "## Section A\n\nNouveau paragraphe.\n\n## Section B\n\nParagraphe inchangé.\n"
+    doc.write_text(content, encoding="utf-8")
+    plan = sync(tmp_path, collection, plan["manifest"], chunker)
+
+    assert summarize_plan(plan)["chunks_updated"] == 1
+    text, metadata = collection.items[chunk_id]
+    assert content[metadata["start_char"]:metadata["end_char"]] == text
+    assert metadata["chunk"] == 1
+
+
+def test_unchanged_kb_plans_nothing(tmp_path):
+    chunker = MarkdownChunker()
+    (tmp_path / "doc.md").write_text("## Section\n\nTexte.\n", encoding="utf-8")
+    collection = FakeCollection()
+    plan = sync(tmp_path, collection, load_manifest(str(tmp_path / "m.json"), chunker.signature()), chunker)
+
+    plan = plan_sync(str(tmp_path), plan["manifest"], set(collection.items), chunker)
+
+    assert plan["to_add"]["ids"] == [] and plan["to_update"]["ids"] == [] and plan["to_delete"] == []
@@ -0,0 +1,41 @@
+from lexical import BM25Index, is_confident, reciprocal_rank_fusion, tokenize
+
+IDS = ["plafond", "rachat", "sortie"]
+DOCUMENTS = [
+    "Le plafond de déduction des versements sur un PER est de 10 % des revenus.",
+    "Le rachat de trimestres permet de compléter sa durée d'assurance.",
+    "La sortie en capital peut être fractionnée à la retraite."
+]
+
+
+def index():
+    return BM25Index(IDS, DOCUMENTS, [{"source": f"{i}.md"} for i in IDS])
+
+
+def test_tokenize_folds_accents_and_drops_stop_words():
+    assert tokenize("Déductions des versements") == tokenize("deduction versement")
+    assert "de" not in tokenize("plafond de déduction")
+
+
+def test_search_ranks_matching_chunk_first():
+    hits = index().search("plafond déduction PER")
+
+    assert hits[0]["id"] == "plafond"
+    assert hits[0]["coverage"] == 1.0 and hits[0]["distance"] is None
+    assert index().search("inconnu") == []
+
+
+def test_confident_only_when_best_hit_covers_the_query():
+    assert is_confident(index().search("rachat trimestres"), min_score=0.5, min_margin=1.5)
+    assert not is_confident(index().search("rachat trimestres assurance vie"), min_score=0.5, min_margin=1.5)
+
+
+def test_rrf_merges_lists_and_keeps_fields_of_each():
+    vector = [{"id": "sortie", "distance": 0.2}, {"id": "rachat", "distance": 0.4}]
+    lexical = [{"id": "rachat", "distance": None, "bm25": 3.0}, {"id": "plafond", "distance": None, "bm25": 1.0}]
+
+    fused = reciprocal_rank_fusion([vector, lexical], n_results=3)
+
+    assert [hit["id"] for hit in fused] == ["rachat", "sortie", "plafond"]
+    assert fused[0]["distance"] == 0.4 and fused[0]["bm25"] == 3.0
+    assert len(reciprocal_rank_fusion([vector, lexical], n_results=1)) == 1
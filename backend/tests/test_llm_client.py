@@ -0,0 +1,103 @@
+import os
+import time
+import threading
+
+import pytest
+import requests
+
+from llm_client import ConcurrencyLimiter, OllamaClient, OllamaError, OllamaBusyError
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None):
+        self.status_code = status_code
+        self._data = data or {}
+
+    def json(self):
+        return self._data
+
+    def close(self):
+        pass
+
+
+def saturated_client(queue_timeout=7.5):
+    """Client dont l'unique place est occupée et sans file d'attente"""
+    client = OllamaClient("http://ollama:11434", "modele", max_in_flight=1, max_waiting=0,
+                          queue_timeout=queue_timeout)
+    assert client.limiter.acquire(0)
+    return client
+
+
+def test_full_queue_rejects_immediately():
+    limiter = ConcurrencyLimiter(max_in_flight=1, max_waiting=0)
+    assert limiter.acquire(0)
+
+    assert not limiter.acquire(5)
+    assert limiter.rejected == 1 and limiter.in_flight == 1 and limiter.waiting == 0
+
+
+def test_waiting_request_is_rejected_after_timeout_or_served_on_release():
+    limiter = ConcurrencyLimiter(max_in_flight=1, max_waiting=1)
+    assert limiter.acquire(0)
+
+    assert not limiter.acquire(0.05)
+    assert limiter.rejected == 1 and limiter.waiting == 0
+
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(limiter.acquire(5)))
+    waiter.start()
+    while limiter.waiting == 0:
+        time.sleep(0.001)
+    limiter.release()
+    waiter.join()
+
+    assert results == [True] and limiter.in_flight == 1 and limiter.rejected == 1
+
+
+def test_acquire_timeout_raises_busy_error_with_retry_after():
+    client = saturated_client(queue_timeout=7.5)
+
+    with pytest.raises(OllamaBusyError) as excinfo:
+        client.complete("prompt")
+
+    assert excinfo.value.retry_after == 7
+    assert client.info()["rejected"] == 1 and client.errors == {"busy": 1}
+    assert client.limiter.in_flight == 1
+
+
+def test_slot_is_released_when_generation_fails(monkeypatch):
+    client = OllamaClient("http://ollama:11434", "modele", max_in_flight=1, max_retries=0)
+
+    def timeout(*args, **kwargs):
+        raise requests.exceptions.Timeout()
+
+    monkeypatch.setattr(client.session, "post", timeout)
+    with pytest.raises(OllamaError):
+        client.complete("prompt")
+    assert client.limiter.in_flight == 0
+
+    monkeypatch.setattr(client.session, "post", lambda *args, **kwargs: FakeResponse(500))
+    with pytest.raises(OllamaError):
+        client.open_stream("prompt")
+    assert client.limiter.in_flight == 0
+
+    monkeypatch.setattr(client.session, "post", lambda *args, **kwargs: FakeResponse(200, {"response": "ok"}))
+    assert client.generate("prompt") == "ok"
+    assert client.limiter.in_flight == 0 and client.errors == {"timeout": 1, "http_500": 1}
+
+
+def test_busy_chat_request_gets_503_with_retry_after(monkeypatch):
+    import app as core
+
+    monkeypatch.setitem(core.service_state, "status", "ready")
+    monkeypatch.setitem(core.service_state, "pid", os.getpid())
+    monkeypatch.setattr(core, "llm", saturated_client(queue_timeout=12))
+    monkeypatch.setattr(core, "prepare_answer", lambda message, timings=None, session_id=None: {
+        "cached": None, "prompt": "prompt", "sources": [], "chunks": []
+    })
+
+    response = core.app.test_client().post("/chat", json={"message": "Quel est le plafond du PER ?"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "12"
+    assert "sollicité" in response.get_json()["error"]
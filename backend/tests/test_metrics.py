@@ -0,0 +1,66 @@
+from metrics import Registry, Histogram, Counter, Gauge
+
+
+def samples(text):
+    """Lignes de valeurs {série: valeur} d'une sortie texte Prometheus"""
+    lines = [line for line in text.splitlines() if line and not line.startswith("#")]
+    return dict(line.rsplit(" ", 1) for line in lines)
+
+
+def test_histogram_buckets_are_cumulative_with_sum_count_and_inf():
+    registry = Registry()
+    histogram = registry.register(Histogram("stage_seconds", "Durée", buckets=(0.1, 1, 2.5)))
+    for value in (0.05, 0.5, 0.7, 2.5, 30):
+        histogram.observe(value, stage="generation")
+
+    text = registry.render()
+    values = samples(text)
+
+    assert text.startswith("# HELP stage_seconds Durée\n# TYPE stage_seconds histogram\n")
+    assert values['stage_seconds_bucket{stage="generation",le="0.1"}'] == "1"
+    assert values['stage_seconds_bucket{stage="generation",le="1"}'] == "3"
+    assert values['stage_seconds_bucket{stage="generation",le="2.5"}'] == "4"
+    assert values['stage_seconds_bucket{stage="generation",le="+Inf"}'] == "5"
+    assert float(values['stage_seconds_sum{stage="generation"}']) == 33.75
+    assert values['stage_seconds_count{stage="generation"}'] == "5"
+
+
+def test_each_label_combination_is_a_separate_series():
+    histogram = Histogram("request_seconds", "Durée", buckets=(1,))
+    histogram.observe(0.5, endpoint="/chat", outcome="answered")
+    histogram.observe(2, outcome="cached", endpoint="/chat")
+
+    values = samples("\n".join(histogram.render()))
+
+    assert values['request_seconds_count{endpoint="/chat",outcome="answered"}'] == "1"
+    assert values['request_seconds_bucket{endpoint="/chat",outcome="cached",le="1"}'] == "0"
+    assert values['request_seconds_bucket{endpoint="/chat",outcome="cached",le="+Inf"}'] == "1"
+
+
+def test_label_values_are_escaped():
+    counter = Counter("errors_total", "Erreurs")
+    counter.inc(reason='chemin "C:\\kb"\nligne 2')
+
+    assert counter.render()[2] == 'errors_total{reason="chemin \\"C:\\\\kb\\"\\nligne 2"} 1'
+
+
+def test_counters_gauges_and_collectors():
+    registry = Registry()
+    requests = registry.register(Counter("requests_total", "Requêtes"))
+    in_flight = registry.register(Gauge("in_flight", "En cours"))
+    requests.inc(outcome="answered")
+    requests.inc(outcome="answered")
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    registry.set_collector("cache", lambda: [
+        ("cache_entries", "gauge", "Entrées", [({}, 3), ({"kind": "absent"}, None)])
+    ])
+    registry.set_collector("broken", lambda: 1 / 0)
+
+    text = registry.render()
+    values = samples(text)
+
+    assert "# TYPE in_flight gauge" in text and "# TYPE cache_entries gauge" in text
+    assert values == {'requests_total{outcome="answered"}': "2", "in_flight": "1", "cache_entries": "3"}
+    assert text.endswith("\n")
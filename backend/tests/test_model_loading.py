@@ -0,0 +1,74 @@
+import json
+import time
+
+import pytest
+
+# Encodeur ONNX et préchargement configurés dans conftest.py
+import app
+from faq import FAQIndex
+
+
+class FakeEncoder:
+    loaded = True
+
+    def __init__(self):
+        self.calls = 0
+
+    def load(self):
+        return True
+
+    def __call__(self, texts):
+        self.calls += 1
+        return [[1.0, float(len(text))] for text in texts]
+
+    def info(self):
+        return {"backend": "onnx", "loaded": True}
+
+
+@pytest.fixture
+def onnx_app(monkeypatch):
+    loads = []
+    encoder = FakeEncoder()
+    monkeypatch.setattr(app, "load_embedding_function", lambda: loads.append(1) or encoder)
+    monkeypatch.setattr(app, "query_encoder", encoder)
+    monkeypatch.setattr(app.token_counter, "load", lambda: None)
+    return app, loads, encoder
+
+
+def test_preload_does_not_load_sentence_transformers():
+    assert app.embedding_function is None
+
+
+def test_warm_up_and_queries_use_only_the_onnx_encoder(onnx_app, monkeypatch, tmp_path):
+    core, loads, encoder = onnx_app
+    monkeypatch.setattr(core, "connect_vector_db", lambda: None)
+    monkeypatch.setattr(core, "init_vector_db", lambda: None)
+    monkeypatch.setitem(core.service_state, "status", "starting")
+    monkeypatch.setitem(core.service_state, "started_at", time.time())
+
+    core.warm_up()
+    assert core.service_state["status"] == "ready"
+
+    config = tmp_path / "faq_questions.json"
+    config.write_text(json.dumps({"faq": [{"id": "per", "question": "C'est quoi un PER ?"}]}))
+    answers = tmp_path / "faq_answers.json"
+    answers.write_text(json.dumps({"answers": [{
+        "id": "per", "question": "C'est quoi un PER ?", "response": "Un plan d'épargne retraite.",
+        "sources": [], "chunks": [], "source_hashes": {}, "vetted": True
+    }]}))
+    monkeypatch.setattr(core, "FAQ_CONFIG_PATH", str(config))
+    monkeypatch.setattr(core, "FAQ_ANSWERS_PATH", str(answers))
+    monkeypatch.setattr(core, "faq_index", FAQIndex())
+
+    core.refresh_faq({})
+    core.encode_queries(["plafond déduction PER"])
+
+    assert core.faq_index.size == 1 and encoder.calls == 2
+    assert loads == []
+
+
+def test_ingestion_loads_the_document_model_on_first_batch(onnx_app):
+    core, loads, _ = onnx_app
+
+    assert core.embed_documents(["chunk"]) == [[1.0, 5.0]]
+    assert loads == [1]
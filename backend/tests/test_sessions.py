@@ -0,0 +1,94 @@
+import sys
+from types import SimpleNamespace
+
+import sessions
+from sessions import SessionStore, is_follow_up, rewrite_query, turn_size, SESSION_OVERHEAD
+
+
+def expected_bytes(store):
+    return sum(session.size + sys.getsizeof(session_id) for session_id, session in store._sessions.items())
+
+
+def test_short_standalone_query_is_not_a_follow_up():
+    assert not is_follow_up("plafond déduction PER")
+    assert not is_follow_up("rachat de trimestres")
+    assert not is_follow_up("")
+
+
+def test_connectors_and_pronouns_mark_a_follow_up():
+    assert is_follow_up("et pour un PERO ?")
+    assert is_follow_up("Et lui ?")
+    assert is_follow_up("combien pour lui ?")
+    assert is_follow_up("Pour un couple marié avec deux enfants, le plafond est-il différent ?")
+    # Pronom au milieu d'une question longue : question autonome
+    assert not is_follow_up("quel est le plafond du PER quand il est ouvert par un indépendant ?")
+
+
+def test_rewrite_query_keeps_follow_ups_on_the_standalone_topic():
+    topic = "Quel est le plafond de déduction du PER ?"
+    turns = ((topic, topic, "10 % des revenus."),)
+
+    assert rewrite_query("et pour un PERO ?", turns) == f"{topic} et pour un PERO ?"
+    assert rewrite_query("plafond déduction PER", turns) == "plafond déduction PER"
+    assert rewrite_query("et pour un PERO ?", ()) == "et pour un PERO ?"
+
+    # Relances successives : rattachées à la dernière question autonome
+    turns += (("et pour un PERO ?", topic, "Même plafond."),)
+    assert rewrite_query("et lui ?", turns) == f"{topic} et lui ?"
+
+
+def test_byte_accounting_follows_appends_truncation_and_clear():
+    store = SessionStore(max_turns=2)
+    store.append("session-a", "question 1", "question 1", "réponse 1")
+    store.append("session-b", "question 2", "sujet", "réponse 2")
+    assert store.info()["bytes"] == expected_bytes(store)
+
+    # Tours oubliés au-delà de max_turns : la taille ne compte que les tours gardés
+    store.append("session-a", "question 3", "question 3", "réponse 3")
+    store.append("session-a", "question 4", "question 4", "réponse 4")
+    session = store._sessions["session-a"]
+    assert [turn[0] for turn in session.turns] == ["question 3", "question 4"]
+    assert session.size == SESSION_OVERHEAD + sum(turn_size(*turn) for turn in session.turns)
+    assert store.info()["bytes"] == expected_bytes(store)
+
+    assert store.clear("session-a") and store.clear("session-b")
+    assert not store.clear("session-a")
+    assert store.info()["bytes"] == 0
+
+
+def test_least_recently_used_session_is_evicted_first():
+    store = SessionStore(max_sessions=2)
+    store.append("session-a", "q", "q", "r")
+    store.append("session-b", "q", "q", "r")
+    store.history("session-a")
+    store.append("session-c", "q", "q", "r")
+
+    assert list(store._sessions) == ["session-a", "session-c"]
+    assert store.info()["evicted"] == 1
+
+
+def test_memory_limit_evicts_until_under_budget():
+    store = SessionStore(max_answer_chars=10_000)
+    store.append("session-a", "q", "q", "x" * 1000)
+    store.max_bytes = store.info()["bytes"] + 500
+    store.append("session-b", "q", "q", "y" * 1000)
+
+    info = store.info()
+    assert list(store._sessions) == ["session-b"]
+    assert info["evicted"] == 1 and info["bytes"] == expected_bytes(store) <= store.max_bytes
+
+
+def test_idle_sessions_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sessions, "time", SimpleNamespace(time=lambda: now[0]))
+    store = SessionStore(idle_ttl=60)
+    store.append("session-a", "q", "q", "r")
+    store.append("session-b", "q", "q", "r")
+
+    now[0] += 30
+    store.history("session-b")
+    now[0] += 45
+
+    assert store.history("session-a") == ()
+    assert store.history("session-b")
+    assert store.info()["expired"] == 1 and store.info()["bytes"] == expected_bytes(store)
@@ -0,0 +1,64 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from vector_store import MmapVectorStore, ensure_export
+
+
+class FakeCollection:
+    def __init__(self, vectors, metadatas=None):
+        self.ids = [f"doc-{i}" for i in range(len(vectors))]
+        self.vectors = vectors
+        self.metadatas = metadatas or [{"source": f"{i}.md"} for i in range(len(vectors))]
+
+    def count(self):
+        return len(self.ids)
+
+    def get(self, include, limit=None, offset=0):
+        end = len(self.ids) if limit is None else offset + limit
+        return {
+            "ids": self.ids[offset:end],
+            "documents": [f"texte {chunk_id}" for chunk_id in self.ids[offset:end]],
+            "metadatas": self.metadatas[offset:end],
+            "embeddings": self.vectors[offset:end].tolist()
+        }
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_query_matches_exact_search(tmp_path, dtype):
+    vectors = np.random.default_rng(0).normal(size=(50, 8)).astype(np.float32)
+    store = MmapVectorStore(ensure_export(FakeCollection(vectors), str(tmp_path), dtype))
+    query = vectors[7] + 0.01
+
+    hits = store.query(query, n_results=3)
+
+    expected = np.argsort(((vectors - query) ** 2).sum(axis=1))[:3]
+    assert [hit["id"] for hit in hits] == [f"doc-{i}" for i in expected]
+    assert hits[0]["document"] == "texte doc-7" and hits[0]["metadata"] == {"source": "7.md"}
+
+
+def test_concurrent_exports_publish_one_directory(tmp_path):
+    collection = FakeCollection(np.ones((20, 4), dtype=np.float32))
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        directories = set(pool.map(lambda _: ensure_export(collection, str(tmp_path)), range(8)))
+
+    assert len(directories) == 1
+    assert sorted(os.listdir(tmp_path)) == sorted([".export.lock", os.path.basename(directories.pop())])
+
+
+def test_metadata_change_creates_new_export_and_keeps_previous(tmp_path):
+    vectors = np.ones((3, 4), dtype=np.float32)
+    collection = FakeCollection(vectors)
+    first = ensure_export(collection, str(tmp_path))
+
+    collection.metadatas = [{"source": "autre.md"}] * 3
+    second = ensure_export(collection, str(tmp_path))
+    collection.metadatas = [{"source": "encore.md"}] * 3
+    third = ensure_export(collection, str(tmp_path))
+
+    assert len({first, second, third}) == 3
+    assert not os.path.exists(first) and os.path.exists(second)
+    assert MmapVectorStore(third).query(vectors[0], 1)[0]["metadata"] == {"source": "encore.md"}
@@ -0,0 +1,43 @@
+import pytest
+
+from versions import load_pointer, new_version_name, promote, rollback, save_pointer
+
+
+def version(name):
+    return {"name": name, "created_at": 0}
+
+
+def test_promote_keeps_previous_and_drops_older_versions():
+    pointer = {"active": None, "previous": None, "versions": []}
+    pointer, dropped = promote(pointer, "kb", version("kb-1"))
+    assert (pointer["active"], pointer["previous"], dropped) == ("kb-1", "kb", [])
+
+    pointer, dropped_first = promote(pointer, "kb-1", version("kb-2"))
+    pointer, dropped = promote(pointer, "kb-2", version("kb-3"))
+
+    assert (pointer["active"], pointer["previous"]) == ("kb-3", "kb-2")
+    assert [v["name"] for v in pointer["versions"]] == ["kb-3", "kb-2"]
+    assert dropped_first == ["kb"] and dropped == ["kb-1"]
+
+
+def test_rollback_swaps_active_and_previous():
+    pointer, _ = promote({"active": None, "previous": None, "versions": []}, "kb-1", version("kb-2"))
+
+    restored = rollback(pointer, "kb-2")
+
+    assert (restored["active"], restored["previous"]) == ("kb-1", "kb-2")
+    assert rollback(restored, "kb-1")["active"] == "kb-2"
+    with pytest.raises(ValueError):
+        rollback({"active": "kb-1", "previous": None, "versions": []}, "kb-1")
+
+
+def test_pointer_round_trip_and_unique_names(tmp_path):
+    path = str(tmp_path / "active.json")
+    assert load_pointer(path)["active"] is None
+
+    pointer, _ = promote(load_pointer(path), None, version("kb-1"))
+    save_pointer(path, pointer)
+
+    assert load_pointer(path) == pointer
+    name = new_version_name("kb", set())
+    assert new_version_name("kb", {name}) != name
@@ -0,0 +1,210 @@
+"""
+Index vectoriel compact partagé entre workers (alternative à la recherche ChromaDB)
+Les embeddings d'une version de la collection sont exportés dans une matrice NumPy
+float16 ou int8 (avec une échelle par ligne) ouverte en mmap : tous les workers
+partagent la même copie via le cache de pages. Les chunks (id, texte, métadonnées)
+sont stockés à la suite dans un tampon lui aussi en mmap et ne sont décodés que pour
+les résultats. La recherche est exacte (produit matrice-vecteur par blocs puis top-k)
+et renvoie les distances L2² de ChromaDB.
+Chaque export est écrit une fois dans un répertoire nommé d'après son contenu et n'est
+jamais modifié ; un verrou garantit qu'un seul processus exporte un même contenu.
+ChromaDB reste la référence (ingestion, versions).
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+
+import numpy as np
+
+from locks import file_lock
+
+# Lignes converties en float32 à la fois pendant une recherche (mémoire temporaire bornée)
+BLOCK_ROWS = 65536
+
+DTYPES = ("float16", "int8")
+
+# Fichiers de l'ancien format (export directement dans le répertoire de la version)
+LEGACY_FILES = ("vectors.npy", "sq_norms.npy", "scales.npy", "chunks.json", "info.json")
+
+
+def content_fingerprint(ids: list, metadatas: list) -> str:
+    """Empreinte du contenu d'une collection : ids (dérivés du texte des chunks) et métadonnées"""
+    digest = hashlib.sha1()
+    for chunk_id, metadata in sorted(zip(ids, metadatas), key=lambda item: item[0]):
+        digest.update(chunk_id.encode('utf-8'))
+        digest.update(b"\0")
+        digest.update(json.dumps(metadata or {}, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def export_name(dtype: str, fingerprint: str) -> str:
+    return f"{dtype}-{fingerprint[:16]}"
+
+
+def read_info(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, "info.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def quantize(matrix: np.ndarray, dtype: str):
+    """Matrice stockée et échelles par ligne (int8 symétrique) ou None (float16)"""
+    if dtype == "float16":
+        return matrix.astype(np.float16), None
+    if dtype == "int8":
+        scales = np.abs(matrix).max(axis=1) / 127 if len(matrix) else np.zeros(0, dtype=np.float32)
+        scales[scales == 0] = 1
+        return np.round(matrix / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    raise ValueError(f"Format de vecteurs inconnu : {dtype} (attendu : {', '.join(DTYPES)})")
+
+
+def export_vectors(collection, directory: str, dtype: str = "float16", batch_size: int = 1024) -> dict:
+    """
+    Exporte chunks et embeddings d'une collection ChromaDB dans `directory`, qui ne doit
+    pas exister : écrit dans un répertoire temporaire puis renommé. Renvoie les informations
+    de l'export (celles de l'export existant si un autre processus l'a publié entre-temps).
+    """
+    ids, documents, metadatas, vectors = [], [], [], []
+    total = collection.count()
+    for offset in range(0, total, batch_size):
+        batch = collection.get(include=["documents", "metadatas", "embeddings"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        documents.extend(batch["documents"])
+        metadatas.extend(m or {} for m in batch["metadatas"])
+        vectors.extend(batch["embeddings"])
+
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+    stored, scales = quantize(matrix, dtype)
+
+    records = [
+        json.dumps({"id": chunk_id, "document": document, "metadata": metadata}, ensure_ascii=False).encode('utf-8')
+        for chunk_id, document, metadata in zip(ids, documents, metadatas)
+    ]
+    offsets = np.zeros(len(records) + 1, dtype=np.int64)
+    np.cumsum([len(record) for record in records], out=offsets[1:])
+
+    tmp_dir = f"{directory}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "vectors.npy"), stored)
+    # Normes calculées sur les vecteurs d'origine : distances L2² comme ChromaDB
+    np.save(os.path.join(tmp_dir, "sq_norms.npy"), np.einsum("ij,ij->i", matrix, matrix))
+    if scales is not None:
+        np.save(os.path.join(tmp_dir, "scales.npy"), scales)
+    np.save(os.path.join(tmp_dir, "records.npy"), np.frombuffer(b"".join(records), dtype=np.uint8))
+    np.save(os.path.join(tmp_dir, "offsets.npy"), offsets)
+
+    info = {
+        "dtype": dtype,
+        "count": len(ids),
+        "dimensions": int(matrix.shape[1]) if len(ids) else 0,
+        "bytes": int(stored.nbytes),
+        "records_bytes": int(offsets[-1]),
+        "fingerprint": content_fingerprint(ids, metadatas),
+        "exported_at": time.time()
+    }
+    # info.json écrit en dernier : un répertoire publié est toujours complet
+    with open(os.path.join(tmp_dir, "info.json"), 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+
+    try:
+        os.replace(tmp_dir, directory)
+    except OSError:
+        # Déjà publié (processus sans verrou) : l'export existant est identique
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return read_info(directory)
+    return info
+
+
+def prune_exports(root: str, keep: str):
+    """
+    Supprime les exports d'une version autres que `keep` et le plus récent des autres
+    (un worker qui n'a pas encore basculé peut encore l'ouvrir). Sous POSIX, un worker
+    qui a déjà ouvert des fichiers supprimés les garde jusqu'à sa bascule.
+    """
+    exports = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name in LEGACY_FILES:
+            os.remove(path)
+        elif os.path.isdir(path) and not name.endswith(".tmp") and path != keep:
+            exports.append((read_info(path).get("exported_at") or 0, path))
+    for _, path in sorted(exports, reverse=True)[1:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def ensure_export(collection, root: str, dtype: str = "float16") -> str:
+    """
+    Répertoire de l'export à jour d'une collection : `root/<dtype>-<empreinte>`.
+    Un seul processus à la fois exporte (verrou sur fichier) ; les autres attendent
+    puis ouvrent l'export publié par le premier.
+    """
+    snapshot = collection.get(include=["metadatas"])
+    directory = os.path.join(root, export_name(dtype, content_fingerprint(snapshot["ids"], snapshot["metadatas"])))
+    if read_info(directory):
+        return directory
+
+    os.makedirs(root, exist_ok=True)
+    with file_lock(os.path.join(root, ".export.lock")):
+        if not read_info(directory):
+            export_vectors(collection, directory, dtype)
+            prune_exports(root, keep=directory)
+    return directory
+
+
+class MmapVectorStore:
+    """Recherche exacte des plus proches voisins dans un export (lecture seule, thread-safe)"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.info_data = read_info(directory)
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        self.sq_norms = np.load(os.path.join(directory, "sq_norms.npy"), mmap_mode="r")
+        scales_path = os.path.join(directory, "scales.npy")
+        self.scales = np.load(scales_path, mmap_mode="r") if os.path.exists(scales_path) else None
+        self.records = np.load(os.path.join(directory, "records.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+
+    def count(self) -> int:
+        return len(self.offsets) - 1
+
+    def record(self, i: int) -> dict:
+        """Chunk n° i : {id, document, metadata}, décodé à la demande"""
+        return json.loads(self.records[self.offsets[i]:self.offsets[i + 1]].tobytes())
+
+    def query(self, embedding, n_results: int = 5) -> list:
+        """Chunks les plus proches, au format {id, document, metadata, distance}"""
+        n = self.count()
+        if n == 0 or n_results <= 0:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        dots = np.empty(n, dtype=np.float32)
+        for start in range(0, n, BLOCK_ROWS):
+            block = self.vectors[start:start + BLOCK_ROWS]
+            dots[start:start + len(block)] = block.astype(np.float32) @ query
+        if self.scales is not None:
+            dots *= self.scales
+
+        distances = self.sq_norms - 2 * dots + float(query @ query)
+        k = min(n_results, n)
+        top = np.argpartition(distances, k - 1)[:k]
+        top = top[np.argsort(distances[top])]
+
+        return [{**self.record(i), "distance": max(float(distances[i]), 0.0)} for i in top]
+
+    def info(self) -> dict:
+        """Description de l'export pour /health"""
+        return {
+            "backend": "mmap",
+            "directory": os.path.relpath(self.directory, os.path.dirname(os.path.dirname(self.directory))),
+            **{key: self.info_data.get(key) for key in ("dtype", "count", "dimensions", "bytes", "records_bytes")}
+        }
@@ -0,0 +1,102 @@
+"""
+Versions de la collection ChromaDB (rechargement bleu/vert)
+Chaque rechargement construit une nouvelle collection versionnée à côté de la version
+active. Un pointeur (fichier JSON remplacé de façon atomique) désigne la version active
+et la précédente, gardée pour un retour arrière ; les workers suivent ce pointeur.
+L'état du dernier rechargement est écrit à côté, pour être le même quel que soit le
+worker qui répond.
+"""
+
+import os
+import json
+import time
+
+
+def empty_pointer() -> dict:
+    return {"active": None, "previous": None, "versions": []}
+
+
+def load_pointer(pointer_path: str) -> dict:
+    """Pointeur de version ({active, previous, versions}, la plus récente en tête)"""
+    try:
+        with open(pointer_path, 'r', encoding='utf-8') as f:
+            return {**empty_pointer(), **json.load(f)}
+    except (OSError, ValueError):
+        return empty_pointer()
+
+
+def write_json(path: str, data: dict):
+    """Écrit un fichier JSON de façon atomique (lu par les autres workers)"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def save_pointer(pointer_path: str, pointer: dict):
+    write_json(pointer_path, pointer)
+
+
+def idle_reload_state() -> dict:
+    return {"status": "idle", "full": None, "started_at": None, "finished_at": None,
+            "result": None, "error": None, "progress": None}
+
+
+def load_reload_state(state_path: str) -> dict:
+    """Dernier rechargement, tous processus confondus (idle si aucun)"""
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return {**idle_reload_state(), **json.load(f)}
+    except (OSError, ValueError):
+        return idle_reload_state()
+
+
+def save_reload_state(state_path: str, state: dict):
+    """Écrit l'état du rechargement (par le processus qui détient le verrou de la base)"""
+    write_json(state_path, state)
+
+
+def pointer_mtime(pointer_path: str):
+    """Date de modification du pointeur (None s'il n'existe pas encore)"""
+    try:
+        return os.stat(pointer_path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def new_version_name(base: str, existing: set) -> str:
+    """Nom de collection daté et unique : `<base>-AAAAMMJJ-HHMMSS[-n]`"""
+    name = f"{base}-{time.strftime('%Y%m%d-%H%M%S')}"
+    candidate = name
+    suffix = 1
+    while candidate in existing:
+        suffix += 1
+        candidate = f"{name}-{suffix}"
+    return candidate
+
+
+def promote(pointer: dict, current: str, version: dict, keep: int = 2):
+    """
+    Nouveau pointeur où `version` devient active et `current` la précédente.
+    Renvoie (pointeur, noms des versions à supprimer) : au-delà des `keep` plus
+    récentes, hors version active et précédente.
+    """
+    versions = [v for v in pointer["versions"] if v["name"] != version["name"]]
+    if current and current not in {v["name"] for v in versions}:
+        versions.insert(0, {"name": current, "created_at": None})
+    versions.insert(0, version)
+
+    kept = {version["name"], current}
+    dropped = [v["name"] for v in versions[keep:] if v["name"] not in kept]
+    return {
+        "active": version["name"],
+        "previous": current,
+        "versions": [v for v in versions if v["name"] not in dropped]
+    }, dropped
+
+
+def rollback(pointer: dict, current: str) -> dict:
+    """Pointeur où la version précédente redevient active (ValueError s'il n'y en a pas)"""
+    if not pointer["previous"]:
+        raise ValueError("Aucune version précédente de la collection")
+    return {**pointer, "active": pointer["previous"], "previous": current}
@@ -1,7 +1,10 @@
 import asyncio
 import subprocess
 import os
+import json
 import time
+import signal
+import sqlite3
 import traceback
 import logging
 from collections import deque
@@ -27,154 +30,446 @@ PROJECT_DIR = r"C:\Users\PC\mon_prototype"
 ALLOWED_USERS = [1818672915]
 CLAUDE_CMD = r"C:\Users\PC\AppData\Roaming\npm\claude.cmd"
 TIMEOUT_SECONDS = 600  # 10 min (au lieu de 30)
-HEARTBEAT_INTERVAL = 120  # Message "toujours en cours" toutes les 2 min
-
-# Historique des conversations
-conversations = {}
+HEARTBEAT_INTERVAL = 120  # Mise a jour du temps ecoule toutes les 2 min, meme sans nouvelle sortie
+PROGRESS_EDIT_INTERVAL = 5  # Au plus une edition du message de progression toutes les 5 s
+PROGRESS_TAIL_CHARS = 800  # Fin de la derniere sortie affichee dans le message de progression
+STREAM_LINE_LIMIT = 16 * 1024 * 1024  # Taille max d'une ligne stream-json (resultats d'outils)
+
+# Historique des conversations (SQLite, conserve entre les redemarrages)
+CONVERSATIONS_DB = os.environ.get(
+    "BOT_CONVERSATIONS_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "telegram_conversations.db")
+)
+MAX_TURNS_PER_CHAT = 40  # Au-dela, les plus anciens echanges sont resumes puis supprimes
+MAX_TURN_CHARS = 4000  # Taille max d'un message conserve
+CONVERSATION_MAX_AGE_DAYS = 30  # Echanges et resumes plus anciens supprimes
+CONTEXT_TOKEN_BUDGET = 1500  # Taille max du contexte ajoute au prompt (tokens estimes)
+CHARS_PER_TOKEN = 3.5
+SUMMARY_LINE_CHARS = 160  # Un echange ancien est resume a sa premiere ligne
+SUMMARY_MAX_CHARS = 2000  # Resume des echanges supprimes, par chat
+RESULT_CACHE_TTL = 600  # Reponse reutilisee pour le meme message, tant que le HEAD git n'a pas change
+MAX_WORKERS = int(os.environ.get("BOT_MAX_WORKERS", "2"))  # Jobs Claude en parallele (chats differents)
+FAST_WORKERS = int(os.environ.get("BOT_FAST_WORKERS", "0"))  # Workers reserves aux demandes courtes
+SHORT_PROMPT_CHARS = 200  # Demande courte : prioritaire
+PRIORITY_AGING_SECONDS = 600  # Une demande longue qui attend depuis 10 min devient prioritaire
+PREEMPT_WITHIN_SECONDS = 60  # Job long preemptable pendant sa 1re minute (peu de travail perdu, 0 = jamais)
+STATS_WINDOW_HOURS = 24  # Fenetre par defaut des statistiques (/status, /stats, metriques)
+METRICS_PORT = int(os.environ.get("BOT_METRICS_PORT", "0"))  # Endpoint HTTP /metrics local (0 = desactive)
+
+# Regles donnees a Claude, identiques pour chaque job (construites une fois au demarrage)
+SYSTEM_PROMPT = (
+    "Tu es un assistant de developpement. Voici tes regles OBLIGATOIRES:\n\n"
+
+    "REPONSES:\n"
+    "- Si tu as besoin d'une precision, commence ta reponse par [QUESTION].\n"
+    "- Si tu as besoin d'une autorisation pour une action risquee, commence par [AUTORISATION].\n"
+    "- Si tu as termine avec succes, commence par [OK].\n"
+    "- Si une erreur s'est produite, commence par [ERREUR].\n\n"
+
+    "GIT ET BUILD:\n"
+    "- Avant CHAQUE git push, tu DOIS incrementer le build number dans pubspec.yaml "
+    "(version: X.Y.Z+N devient X.Y.Z+N+1). Ne jamais push sans avoir incremente le build number.\n\n"
+
+    "PYTHON ET REQUIREMENTS:\n"
+    "- Dans requirements.txt, specifie TOUJOURS des versions compatibles (ex: numpy<2.0, flask>=2.0.0).\n"
+    "- Evite les versions trop recentes qui peuvent avoir des incompatibilites.\n"
+    "- Apres avoir cree ou modifie un backend Python, TESTE-LE en executant le fichier principal.\n"
+    "- Si le test echoue, analyse l'erreur, corrige le code, et reteste jusqu'a ce que ca marche.\n"
+    "- Ne push jamais du code backend sans l'avoir teste et verifie qu'il demarre sans erreur.\n\n"
+
+    "IMPORTANT:\n"
+    "- Ne lance JAMAIS de serveur (Flask, FastAPI, etc.) car ils tournent indefiniment et bloquent.\n"
+    "- Pour tester un backend, utilise 'timeout 5 python app.py' ou verifie juste la syntaxe avec 'python -c \"import app\"'.\n"
+    "- Si on te demande de relancer un serveur, dis que c'est impossible depuis Claude Code et qu'il faut le faire manuellement.\n\n"
+
+    "QUALITE:\n"
+    "- Teste toujours ton code avant de push.\n"
+    "- Si tu detectes une erreur, corrige-la automatiquement.\n"
+    "- Sois proactif: anticipe les problemes potentiels."
+)
 
-# File d'attente des messages (au lieu de rejeter quand busy)
-message_queue: deque = deque()
-is_processing = False
-processing_start_time = 0
-current_process: subprocess.Popen | None = None
-current_chat_id: str | None = None
+# Connexion SQLite (ouverte par main, boucle asyncio uniquement) et bot (post_init)
+db: sqlite3.Connection | None = None
+last_purge = 0.0
+bot = None
+metrics_server = None
+stopping = False  # Arret en cours : les jobs annules restent 'running' pour etre signales au redemarrage
+
+# Files d'attente par chat, persistees dans la table jobs : les messages d'un meme chat
+# restent dans l'ordre, des chats differents sont traites en parallele (MAX_WORKERS a la fois).
+# Entre les chats, la tete de file la plus prioritaire passe en premier (puis la plus ancienne).
+# Dans un chat, l'ordre des messages est celui de la conversation (sauf /top).
+# Entree : {"id", "chat_id", "prompt", "key", "merged", "priority", "enqueued_at", "preempted"?}
+# (merged = doublons rattaches, preempted = deja interrompue une fois pour une demande courte)
+chat_queues: dict[str, deque] = {}
+
+# Job en cours par chat : entree de file + {"start", "task", "process", "cancelled", "requeue",
+# "activity", "result", "raw", "returncode", "last_output", "max_silence"}
+# (requeue = preemption en cours : le job sera remis en tete de la file de son chat)
+running_jobs: dict[str, dict] = {}
+
+# Taches des jobs en cours (references gardees pour les annuler a l'arret)
+job_tasks: set = set()
+
+# Reponses recentes : (chat_id, message normalise, dernier echange, HEAD git) -> (expiration, reponse)
+# (dernier echange = id du tour de la reponse : la conversation n'a pas avance depuis)
+result_cache: dict[tuple, tuple] = {}
+
+
+def init_conversation_store():
+    """Ouvre la base des conversations (WAL : ecritures courtes, lectures jamais bloquees)."""
+    global db
+    if db is not None:
+        db.close()
+    db = sqlite3.connect(CONVERSATIONS_DB)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript("""
+        CREATE TABLE IF NOT EXISTS turns (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS turns_chat ON turns(chat_id, id);
+        CREATE INDEX IF NOT EXISTS turns_age ON turns(created_at);
+        CREATE TABLE IF NOT EXISTS summaries (
+            chat_id TEXT PRIMARY KEY,
+            summary TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id TEXT NOT NULL,
+            prompt TEXT NOT NULL,
+            prompt_key TEXT NOT NULL,
+            priority INTEGER NOT NULL,
+            position REAL NOT NULL DEFAULT 0,
+            merged INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            enqueued_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            output_chars INTEGER,
+            returncode INTEGER,
+            max_silence REAL
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, position);
+        CREATE INDEX IF NOT EXISTS jobs_age ON jobs(enqueued_at);
+    """)
+    # Bases creees avant les mesures par job
+    columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+    for column in ("output_chars INTEGER", "returncode INTEGER", "max_silence REAL"):
+        if column.split()[0] not in columns:
+            db.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+    purge_old_conversations()
+
+
+def purge_old_conversations():
+    """Supprime les echanges et resumes plus vieux que CONVERSATION_MAX_AGE_DAYS."""
+    global last_purge
+    last_purge = time.time()
+    cutoff = last_purge - CONVERSATION_MAX_AGE_DAYS * 86400
+    with db:
+        db.execute("DELETE FROM turns WHERE created_at < ?", (cutoff,))
+        db.execute("DELETE FROM summaries WHERE updated_at < ?", (cutoff,))
+        db.execute("DELETE FROM jobs WHERE enqueued_at < ? AND status NOT IN ('queued', 'running')", (cutoff,))
+
+
+def condense_turn(role, content):
+    """Resume d'un echange : sa premiere ligne non vide, tronquee."""
+    first_line = next((line.strip() for line in content.splitlines() if line.strip()), "")
+    if len(first_line) > SUMMARY_LINE_CHARS:
+        first_line = first_line[:SUMMARY_LINE_CHARS].rsplit(" ", 1)[0] + "..."
+    return f"- {role}: {first_line}"
+
+
+def get_summary(chat_id):
+    row = db.execute("SELECT summary FROM summaries WHERE chat_id = ?", (chat_id,)).fetchone()
+    return row[0] if row else ""
 
 
 def get_context(chat_id):
-    if chat_id in conversations:
-        return "\n".join(conversations[chat_id][-10:])
-    return "Nouvelle conversation"
+    """
+    Contexte du prompt dans la limite de CONTEXT_TOKEN_BUDGET : les echanges recents en
+    entier, les plus anciens resumes (une ligne chacun), puis le resume des echanges supprimes.
+    """
+    rows = db.execute("SELECT role, content FROM turns WHERE chat_id = ? ORDER BY id", (chat_id,)).fetchall()
+    summary = get_summary(chat_id)
+    if not rows and not summary:
+        return "Nouvelle conversation"
+
+    budget = int(CONTEXT_TOKEN_BUDGET * CHARS_PER_TOKEN)
+    # Les trois quarts du budget pour les echanges recents, le reste pour le resume
+    recent_budget = budget * 3 // 4
+    recent = []
+    used = 0
+    for role, content in reversed(rows):
+        line = f"{role}: {content}"
+        if recent and used + len(line) > recent_budget:
+            break
+        recent.insert(0, line[:recent_budget])
+        used += len(recent[0])
+
+    summary_lines = [condense_turn(role, content) for role, content in rows[:len(rows) - len(recent)]]
+    summary_lines = summary.splitlines() + summary_lines
+    kept = []
+    remaining = budget - used
+    for line in reversed(summary_lines):
+        if len(line) + 1 > remaining:
+            break
+        kept.insert(0, line)
+        remaining -= len(line) + 1
+
+    parts = []
+    if kept:
+        parts.append("Resume des echanges precedents:\n" + "\n".join(kept))
+    parts.append("\n".join(recent))
+    return "\n\n".join(parts)
+
+
+def last_turn_id(chat_id):
+    """Id du dernier echange enregistre du chat (None si aucun)."""
+    return db.execute("SELECT MAX(id) FROM turns WHERE chat_id = ?", (chat_id,)).fetchone()[0]
 
 
 def save_context(chat_id, role, message):
-    if chat_id not in conversations:
-        conversations[chat_id] = []
-    conversations[chat_id].append(f"{role}: {message}")
-
-
-async def run_claude_async(prompt, chat_id, bot):
-    """Lance Claude CLI dans un thread separe avec heartbeat de progression."""
-    global current_process
-
-    system_prompt = (
-        "Tu es un assistant de developpement. Voici tes regles OBLIGATOIRES:\n\n"
-
-        "REPONSES:\n"
-        "- Si tu as besoin d'une precision, commence ta reponse par [QUESTION].\n"
-        "- Si tu as besoin d'une autorisation pour une action risquee, commence par [AUTORISATION].\n"
-        "- Si tu as termine avec succes, commence par [OK].\n"
-        "- Si une erreur s'est produite, commence par [ERREUR].\n\n"
-
-        "GIT ET BUILD:\n"
-        "- Avant CHAQUE git push, tu DOIS incrementer le build number dans pubspec.yaml "
-        "(version: X.Y.Z+N devient X.Y.Z+N+1). Ne jamais push sans avoir incremente le build number.\n\n"
-
-        "PYTHON ET REQUIREMENTS:\n"
-        "- Dans requirements.txt, specifie TOUJOURS des versions compatibles (ex: numpy<2.0, flask>=2.0.0).\n"
-        "- Evite les versions trop recentes qui peuvent avoir des incompatibilites.\n"
-        "- Apres avoir cree ou modifie un backend Python, TESTE-LE en executant le fichier principal.\n"
-        "- Si le test echoue, analyse l'erreur, corrige le code, et reteste jusqu'a ce que ca marche.\n"
-        "- Ne push jamais du code backend sans l'avoir teste et verifie qu'il demarre sans erreur.\n\n"
-
-        "IMPORTANT:\n"
-        "- Ne lance JAMAIS de serveur (Flask, FastAPI, etc.) car ils tournent indefiniment et bloquent.\n"
-        "- Pour tester un backend, utilise 'timeout 5 python app.py' ou verifie juste la syntaxe avec 'python -c \"import app\"'.\n"
-        "- Si on te demande de relancer un serveur, dis que c'est impossible depuis Claude Code et qu'il faut le faire manuellement.\n\n"
-
-        "QUALITE:\n"
-        "- Teste toujours ton code avant de push.\n"
-        "- Si tu detectes une erreur, corrige-la automatiquement.\n"
-        "- Sois proactif: anticipe les problemes potentiels."
-    )
+    """
+    Ajoute un echange ; au-dela de MAX_TURNS_PER_CHAT, les plus anciens passent dans le resume.
+    Renvoie l'id de l'echange ajoute.
+    """
+    if len(message) > MAX_TURN_CHARS:
+        message = message[:MAX_TURN_CHARS] + "..."
+    now = time.time()
+    with db:
+        turn_id = db.execute(
+            "INSERT INTO turns (chat_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+            (chat_id, role, message, now)
+        ).lastrowid
+        overflow = db.execute(
+            "SELECT id, role, content FROM turns WHERE chat_id = ? ORDER BY id DESC LIMIT -1 OFFSET ?",
+            (chat_id, MAX_TURNS_PER_CHAT)
+        ).fetchall()
+        if overflow:
+            lines = get_summary(chat_id).splitlines()
+            lines += [condense_turn(role, content) for _, role, content in reversed(overflow)]
+            summary = "\n".join(lines)
+            while len(summary) > SUMMARY_MAX_CHARS and "\n" in summary:
+                summary = summary.split("\n", 1)[1]
+            db.execute(
+                "INSERT OR REPLACE INTO summaries (chat_id, summary, updated_at) VALUES (?, ?, ?)",
+                (chat_id, summary, now)
+            )
+            db.execute("DELETE FROM turns WHERE chat_id = ? AND id <= ?", (chat_id, overflow[0][0]))
 
-    full_prompt = f"{system_prompt}\n\nContexte conversation:\n{get_context(chat_id)}\n\nDemande: {prompt}"
+    if now - last_purge > 3600:
+        purge_old_conversations()
+    return turn_id
 
-    prompt_file = os.path.join(PROJECT_DIR, ".claude_prompt.txt")
-    with open(prompt_file, "w", encoding="utf-8") as f:
-        f.write(full_prompt)
 
-    cmd = f'type "{prompt_file}" | "{CLAUDE_CMD}" -p --output-format text --dangerously-skip-permissions'
+def reset_context(chat_id):
+    with db:
+        db.execute("DELETE FROM turns WHERE chat_id = ?", (chat_id,))
+        db.execute("DELETE FROM summaries WHERE chat_id = ?", (chat_id,))
 
-    # Lancer le subprocess avec Popen pour pouvoir le tuer
-    def _blocking_run():
-        global current_process
-        try:
-            current_process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                cwd=PROJECT_DIR,
-                encoding="utf-8",
-                shell=True,
-                errors="replace"
-            )
-            stdout, stderr = current_process.communicate(timeout=TIMEOUT_SECONDS)
-            returncode = current_process.returncode
-            current_process = None
-
-            log.info(f"Claude STDOUT ({len(stdout)} chars): {stdout[:300]}")
-            if stderr:
-                log.warning(f"Claude STDERR: {stderr[:200]}")
-            log.info(f"Claude return code: {returncode}")
-
-            if returncode != 0 and not stdout.strip():
-                return f"[ERREUR] Claude Code a termine avec le code {returncode}. Stderr: {stderr[:500]}"
-
-            return stdout.strip()
-        except subprocess.TimeoutExpired:
-            if current_process:
-                log.warning("Timeout - killing Claude process")
-                current_process.kill()
-                current_process.wait()
-                current_process = None
-            raise
-        except Exception:
-            current_process = None
-            raise
 
-    # Lancer le heartbeat en parallele du traitement
-    heartbeat_task = asyncio.create_task(
-        _heartbeat_loop(bot, int(chat_id))
+async def run_claude_async(prompt, chat_id, bot, job, status_message=None):
+    """Lance Claude CLI en sous-processus asyncio et suit sa progression dans le message de statut."""
+    full_prompt = f"{SYSTEM_PROMPT}\n\nContexte conversation:\n{get_context(chat_id)}\n\nDemande: {prompt}"
+
+    # stream-json : la CLI emet ses etapes (texte, outils) au fil de l'eau, puis le resultat
+    cmd = [CLAUDE_CMD, "-p", "--output-format", "stream-json", "--verbose", "--dangerously-skip-permissions"]
+
+    # Prompt envoye sur stdin (pas de fichier temporaire, pas de shell)
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=PROJECT_DIR,
+        limit=STREAM_LINE_LIMIT,
+        # Groupe de processus a part pour tuer aussi les enfants de la CLI
+        **({} if os.name == "nt" else {"start_new_session": True})
     )
+    job["process"] = process
+
+    stdin_task = asyncio.create_task(_write_stdin(process, full_prompt))
+    progress_task = asyncio.create_task(_progress_loop(bot, chat_id, status_message, job))
+    stderr_task = asyncio.create_task(process.stderr.read())
+
+    async def run_to_completion():
+        # Sortie, fin du processus et stderr : une CLI qui ferme stdout sans se terminer
+        # (ou un enfant qui garde stderr ouvert) est aussi soumise au timeout
+        await _read_stdout(process, job)
+        return await process.wait(), await stderr_task
 
     try:
-        result = await asyncio.to_thread(_blocking_run)
-        return result
+        returncode, stderr = await asyncio.wait_for(run_to_completion(), TIMEOUT_SECONDS)
+        job["returncode"] = returncode
+        stderr = stderr.decode("utf-8", errors="replace")
+    except asyncio.TimeoutError:
+        log.warning("Timeout - killing Claude process")
+        raise subprocess.TimeoutExpired(cmd, TIMEOUT_SECONDS)
+    except asyncio.CancelledError:
+        log.info(f"Cancel - killing Claude process (chat {chat_id})")
+        raise
     finally:
-        heartbeat_task.cancel()
-        try:
-            await heartbeat_task
-        except asyncio.CancelledError:
-            pass
+        # Timeout, annulation ou erreur de lecture (ligne trop longue...) : ne pas laisser
+        # la CLI tourner seule dans le projet
+        if process.returncode is None:
+            await kill_process_tree(process)
+        job["process"] = None
+        stdin_task.cancel()
+        progress_task.cancel()
+        stderr_task.cancel()
+
+    stdout = job["result"] if job["result"] is not None else "".join(job["raw"])
+    log.info(f"Claude STDOUT ({len(stdout)} chars): {stdout[:300]}")
+    if stderr:
+        log.warning(f"Claude STDERR: {stderr[:200]}")
+    log.info(f"Claude return code: {returncode}")
+
+    if returncode != 0 and not stdout.strip():
+        return f"[ERREUR] Claude Code a termine avec le code {returncode}. Stderr: {stderr[:500]}"
 
+    return stdout.strip()
 
-async def _heartbeat_loop(bot, chat_id):
-    """Envoie des messages de progression toutes les HEARTBEAT_INTERVAL secondes."""
-    elapsed = 0
+
+async def _write_stdin(process, text):
+    """Ecrit le prompt sur l'entree de la CLI puis la ferme (lue en parallele de la sortie)."""
     try:
-        while True:
-            await asyncio.sleep(HEARTBEAT_INTERVAL)
-            elapsed += HEARTBEAT_INTERVAL
-            minutes = elapsed // 60
-            remaining = (TIMEOUT_SECONDS - elapsed) // 60
-            await bot.send_message(
-                chat_id,
-                f"Toujours en cours... ({minutes} min ecoulees, timeout dans {remaining} min)\n"
-                f"Envoie /cancel pour annuler."
+        process.stdin.write(text.encode("utf-8"))
+        await process.stdin.drain()
+        process.stdin.close()
+    except (BrokenPipeError, ConnectionResetError):
+        # La CLI s'est arretee avant de tout lire : son code retour et stderr le diront
+        pass
+
+
+async def _read_stdout(process, job):
+    """Lit la sortie de la CLI ligne par ligne et met a jour l'activite du job."""
+    while True:
+        line = await process.stdout.readline()
+        note_output(job)
+        if not line:
+            return
+        handle_output_line(job, line.decode("utf-8", errors="replace"))
+
+
+def note_output(job):
+    """Plus long silence de la CLI (a comparer a HEARTBEAT_INTERVAL et TIMEOUT_SECONDS)."""
+    now = time.time()
+    job["max_silence"] = max(job["max_silence"], now - job["last_output"])
+    job["last_output"] = now
+
+
+def handle_output_line(job, line):
+    """Interprete une ligne stream-json (texte, appel d'outil, resultat) ; sinon sortie brute."""
+    try:
+        event = json.loads(line)
+    except ValueError:
+        job["raw"].append(line)
+        job["activity"] = "".join(job["raw"])[-PROGRESS_TAIL_CHARS:]
+        return
+    if not isinstance(event, dict):
+        return
+
+    if event.get("type") == "assistant":
+        message = event.get("message")
+        content = message.get("content") if isinstance(message, dict) else None
+        for item in content if isinstance(content, list) else []:
+            if not isinstance(item, dict):
+                continue
+            text = item.get("text")
+            if item.get("type") == "text" and isinstance(text, str) and text.strip():
+                job["activity"] = text.strip()[-PROGRESS_TAIL_CHARS:]
+            elif item.get("type") == "tool_use":
+                job["activity"] = f"Outil: {item.get('name')}"
+    elif event.get("type") == "result":
+        result = event.get("result")
+        job["result"] = result if isinstance(result, str) else ""
+
+
+async def kill_process_tree(process):
+    """Tue la CLI et ses sous-processus (claude.cmd lance node) sans thread."""
+    if process.returncode is not None:
+        return
+    try:
+        if os.name == "nt":
+            killer = await asyncio.create_subprocess_exec(
+                "taskkill", "/F", "/T", "/PID", str(process.pid),
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
             )
+            await killer.wait()
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, OSError) as e:
+        log.warning(f"Kill failed: {e}")
+    try:
+        await asyncio.wait_for(process.wait(), 5)
+    except asyncio.TimeoutError:
+        process.kill()
+
+
+def kill_pid_tree(pid):
+    """Version synchrone de kill_process_tree, pour un processus lance par une boucle terminee."""
+    try:
+        if os.name == "nt":
+            subprocess.run(
+                ["taskkill", "/F", "/T", "/PID", str(pid)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10
+            )
+        else:
+            os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, OSError, subprocess.TimeoutExpired) as e:
+        log.warning(f"Kill failed (pid {pid}): {e}")
+
+
+def progress_text(job):
+    elapsed = int(time.time() - job["start"])
+    remaining = max(TIMEOUT_SECONDS - elapsed, 0) // 60
+    text = f"Claude Code travaille... ({elapsed // 60} min {elapsed % 60:02d}s, timeout dans {remaining} min)"
+    if job["activity"]:
+        text += f"\n\n{job['activity']}"
+    return text + "\n\nEnvoie /cancel pour annuler."
+
+
+async def _progress_loop(bot, chat_id, status_message, job):
+    """
+    Edite le message de statut avec la derniere activite de Claude : au plus une fois
+    par PROGRESS_EDIT_INTERVAL, et toutes les HEARTBEAT_INTERVAL pour le temps ecoule.
+    """
+    if status_message is None:
+        return
+    last_activity = job["activity"]
+    last_edit = time.time()
+    try:
+        while True:
+            await asyncio.sleep(PROGRESS_EDIT_INTERVAL)
+            now = time.time()
+            if job["activity"] == last_activity and now - last_edit < HEARTBEAT_INTERVAL:
+                continue
+            last_activity = job["activity"]
+            last_edit = now
+            try:
+                await bot.edit_message_text(
+                    progress_text(job), chat_id=int(chat_id), message_id=status_message.message_id
+                )
+            except Exception as e:
+                log.debug(f"Progress edit failed: {e}")
     except asyncio.CancelledError:
         pass
 
 
-async def send_response(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: str, response: str):
+async def send_response(bot, chat_id: str, response: str):
     """Envoie la reponse formatee sur Telegram."""
     if response.startswith("[QUESTION]"):
         clean = response.replace("[QUESTION]", "").strip()
-        await context.bot.send_message(int(chat_id), f"? {clean}")
+        await bot.send_message(int(chat_id), f"? {clean}")
 
     elif response.startswith("[AUTORISATION]"):
         clean = response.replace("[AUTORISATION]", "").strip()
-        await context.bot.send_message(
+        await bot.send_message(
             int(chat_id),
             f"Claude demande ton autorisation:\n\n{clean}\n\n"
             f"Reponds 'oui' pour valider ou 'non' pour annuler."
@@ -182,66 +477,315 @@ async def send_response(update: Update, context: ContextTypes.DEFAULT_TYPE, chat
 
     elif response.startswith("[OK]"):
         clean = response.replace("[OK]", "").strip()
-        await context.bot.send_message(int(chat_id), f"{clean}")
+        await bot.send_message(int(chat_id), f"{clean}")
 
     elif response.startswith("[ERREUR]"):
         clean = response.replace("[ERREUR]", "").strip()
-        await context.bot.send_message(int(chat_id), f"Erreur: {clean}")
+        await bot.send_message(int(chat_id), f"Erreur: {clean}")
 
     else:
         text = response or "(Reponse vide - Claude Code n'a rien retourne)"
         # Telegram limite a 4096 chars par message
         if len(text) > 4000:
             for i in range(0, len(text), 4000):
-                await context.bot.send_message(int(chat_id), text[i:i+4000])
+                await bot.send_message(int(chat_id), text[i:i+4000])
         else:
-            await context.bot.send_message(int(chat_id), text)
+            await bot.send_message(int(chat_id), text)
 
 
-async def process_queue(context: ContextTypes.DEFAULT_TYPE):
-    """Traite les messages en file d'attente un par un."""
-    global is_processing, processing_start_time, current_chat_id
+def job_priority(prompt):
+    """0 = prioritaire (demande courte), 1 = normale."""
+    return 0 if len(prompt) <= SHORT_PROMPT_CHARS else 1
 
-    if is_processing:
-        return
 
-    is_processing = True
+def effective_priority(entry, now):
+    # Vieillissement : une demande longue ne peut pas etre doublee indefiniment
+    if now - entry["enqueued_at"] >= PRIORITY_AGING_SECONDS:
+        return 0
+    return entry["priority"]
+
+
+def update_job(job_id, **fields):
+    with db:
+        db.execute(
+            f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+            (*fields.values(), job_id)
+        )
+
+
+def enqueue_job(chat_id, prompt, key):
+    """Ajoute une demande a la file du chat (et dans la table jobs). Renvoie l'entree."""
+    now = time.time()
+    priority = job_priority(prompt)
+    with db:
+        cursor = db.execute(
+            "INSERT INTO jobs (chat_id, prompt, prompt_key, priority, status, enqueued_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?)",
+            (chat_id, prompt, key, priority, now)
+        )
+        db.execute("UPDATE jobs SET position = id WHERE id = ?", (cursor.lastrowid,))
+    entry = {
+        "id": cursor.lastrowid, "chat_id": chat_id, "prompt": prompt, "key": key,
+        "merged": 0, "priority": priority, "enqueued_at": now
+    }
+    chat_queues.setdefault(chat_id, deque()).append(entry)
+    return entry
+
+
+def restore_queue():
+    """
+    Recharge les demandes en attente apres un redemarrage. Les jobs qui tournaient
+    au moment de l'arret sont marques interrompus. Renvoie leurs (id, chat_id).
+    """
+    chat_queues.clear()
+    now = time.time()
+    interrupted = db.execute("SELECT id, chat_id FROM jobs WHERE status = 'running'").fetchall()
+    with db:
+        db.execute("UPDATE jobs SET status = 'interrupted', finished_at = ? WHERE status = 'running'", (now,))
+
+    rows = db.execute(
+        "SELECT id, chat_id, prompt, prompt_key, merged, priority, enqueued_at FROM jobs "
+        "WHERE status = 'queued' ORDER BY position"
+    ).fetchall()
+    for job_id, chat_id, prompt, key, merged, priority, enqueued_at in rows:
+        chat_queues.setdefault(chat_id, deque()).append({
+            "id": job_id, "chat_id": chat_id, "prompt": prompt, "key": key,
+            "merged": merged, "priority": priority, "enqueued_at": enqueued_at
+        })
+    return interrupted
+
+
+def next_job():
+    """
+    Tete de file a lancer : parmi les chats sans job en cours, la plus prioritaire puis
+    la plus ancienne. Les demandes longues laissent FAST_WORKERS workers aux courtes.
+    """
+    now = time.time()
+    long_running = sum(1 for job in running_jobs.values() if job["priority"] > 0)
+    long_allowed = long_running < MAX_WORKERS - min(FAST_WORKERS, MAX_WORKERS - 1)
+
+    candidates = [
+        queue[0] for chat_id, queue in chat_queues.items()
+        if queue and chat_id not in running_jobs
+    ]
+    candidates = [e for e in candidates if long_allowed or effective_priority(e, now) == 0]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda e: (effective_priority(e, now), e["id"]))
+
+
+def preemption_victim():
+    """
+    Job long a interrompre pour une demande courte d'un autre chat quand aucun worker
+    n'est libre : le plus recent, lance depuis moins de PREEMPT_WITHIN_SECONDS, jamais
+    deja preempte. Une seule preemption a la fois. Sinon None.
+    """
+    if PREEMPT_WITHIN_SECONDS <= 0 or len(running_jobs) < MAX_WORKERS:
+        return None
+    if any(job["requeue"] for job in running_jobs.values()):
+        return None
+    now = time.time()
+    if not any(
+        queue and chat_id not in running_jobs and effective_priority(queue[0], now) == 0
+        for chat_id, queue in chat_queues.items()
+    ):
+        return None
+    victims = [
+        job for job in running_jobs.values()
+        if effective_priority(job, now) > 0 and not job.get("preempted") and not job["cancelled"]
+        and now - job["start"] < PREEMPT_WITHIN_SECONDS
+    ]
+    return max(victims, key=lambda job: job["start"], default=None)
+
+
+def requeue_job(job):
+    """Remet un job preempte en tete de la file de son chat (relance depuis le debut)."""
+    chat_id = job["chat_id"]
+    entry = {name: job[name] for name in ("id", "chat_id", "prompt", "key", "merged", "priority", "enqueued_at")}
+    entry["preempted"] = True
+    chat_queues.setdefault(chat_id, deque()).appendleft(entry)
+    first = db.execute(
+        "SELECT MIN(position) FROM jobs WHERE chat_id = ? AND status = 'queued'", (chat_id,)
+    ).fetchone()[0]
+    update_job(job["id"], status="queued", started_at=None, position=min(first or job["id"], job["id"]) - 1)
+
+
+def queued_count():
+    return sum(len(queue) for queue in chat_queues.values())
+
+
+def dispatch_jobs():
+    """
+    Lance les demandes en attente tant qu'il reste des workers libres ; sinon preempte
+    un job long qui vient de demarrer si une demande courte attend.
+    """
+    while not stopping and len(running_jobs) < MAX_WORKERS:
+        job = next_job()
+        if job is None:
+            return
+        chat_id = job["chat_id"]
+        chat_queues[chat_id].popleft()
+        if not chat_queues[chat_id]:
+            del chat_queues[chat_id]
+        job.update({
+            "start": time.time(), "task": None, "process": None, "cancelled": False, "requeue": False,
+            "activity": "", "result": None, "raw": [], "returncode": None, "max_silence": 0.0
+        })
+        job["last_output"] = job["start"]
+        update_job(job["id"], status="running", started_at=job["start"])
+        running_jobs[chat_id] = job
+        job["task"] = asyncio.create_task(run_job(chat_id, job))
+        job_tasks.add(job["task"])
+        job["task"].add_done_callback(job_tasks.discard)
+
+    victim = None if stopping else preemption_victim()
+    if victim is not None:
+        # L'annulation de la tache tue le sous-processus ; run_job remet le job en file
+        log.info(f"Job #{victim['id']} preempte pour une demande courte (chat {victim['chat_id']})")
+        victim["preempted"] = True
+        victim["requeue"] = True
+        victim["task"].cancel()
+
+
+async def run_job(chat_id: str, job: dict):
+    """Traite une demande d'un chat puis libere le worker pour la suivante."""
+    status = "error"
+    output_chars = None
     try:
-        while message_queue:
-            update, prompt, chat_id = message_queue.popleft()
-            processing_start_time = time.time()
-            current_chat_id = chat_id
-
-            queue_size = len(message_queue)
-            status_msg = "Claude Code travaille..."
-            if queue_size > 0:
-                status_msg += f" ({queue_size} message(s) en attente apres celui-ci)"
-            status_msg += f"\nTimeout: {TIMEOUT_SECONDS // 60} min. Envoie /cancel pour annuler."
-            await context.bot.send_message(int(chat_id), status_msg)
+        queue_size = len(chat_queues.get(chat_id, ()))
+        status_msg = f"Job #{job['id']} : Claude Code travaille..."
+        if queue_size > 0:
+            status_msg += f" ({queue_size} message(s) en attente apres celui-ci)"
+        status_msg += f"\nTimeout: {TIMEOUT_SECONDS // 60} min. Envoie /cancel pour annuler."
+        status_message = await bot.send_message(int(chat_id), status_msg)
+
+        response = await run_claude_async(job["prompt"], chat_id, bot, job, status_message)
+        elapsed = int(time.time() - job["start"])
+        status = "done" if job["returncode"] == 0 else "error"
+        output_chars = len(response)
+        turn_id = save_context(chat_id, "Claude", response)
+        if job["merged"]:
+            await bot.send_message(
+                int(chat_id), f"Reponse commune a {job['merged'] + 1} messages identiques :"
+            )
+        await send_response(bot, chat_id, response)
+        await store_result(chat_id, job["key"], turn_id, response)
+        log.info(f"Job #{job['id']} completed in {elapsed}s (chat {chat_id})")
 
-            try:
-                response = await run_claude_async(prompt, chat_id, context.bot)
-                elapsed = int(time.time() - processing_start_time)
-                save_context(chat_id, "Claude", response)
-                await send_response(update, context, chat_id, response)
-                log.info(f"Request completed in {elapsed}s")
-
-            except subprocess.TimeoutExpired:
-                await context.bot.send_message(
-                    int(chat_id),
-                    f"Timeout ({TIMEOUT_SECONDS // 60} min) - Claude Code a ete interrompu.\n"
-                    f"La tache etait trop longue. Essaie de decouper ta demande en etapes plus petites."
-                )
-            except Exception as e:
-                await context.bot.send_message(
-                    int(chat_id),
-                    f"Erreur: {str(e)}"
-                )
-                log.error(f"Exception processing message: {traceback.format_exc()}")
+    except subprocess.TimeoutExpired:
+        status = "timeout"
+        await bot.send_message(
+            int(chat_id),
+            f"Timeout ({TIMEOUT_SECONDS // 60} min) - Claude Code a ete interrompu.\n"
+            f"La tache etait trop longue. Essaie de decouper ta demande en etapes plus petites."
+        )
+    except Exception as e:
+        if not job["cancelled"] and not job.get("stale"):
+            await bot.send_message(
+                int(chat_id),
+                f"Erreur: {str(e)}"
+            )
+            log.error(f"Exception processing message: {traceback.format_exc()}")
+    except asyncio.CancelledError:
+        if stopping or job["cancelled"] or not job["requeue"]:
+            raise
+        await bot.send_message(
+            int(chat_id),
+            f"Job #{job['id']} suspendu pour laisser passer une demande courte : "
+            f"il reprendra depuis le debut, en tete de ta file."
+        )
     finally:
-        is_processing = False
-        processing_start_time = 0
-        current_chat_id = None
+        if running_jobs.get(chat_id) is job:
+            running_jobs.pop(chat_id)
+        # A l'arret (ou job d'une boucle precedente), le job reste 'running' :
+        # restore_queue le marquera interrompu et previendra le chat
+        if not stopping and not job.get("stale") and job["requeue"] and not job["cancelled"]:
+            requeue_job(job)
+            dispatch_jobs()
+        elif not stopping and not job.get("stale"):
+            if job["cancelled"]:
+                status = "cancelled"
+            now = time.time()
+            update_job(
+                job["id"], status=status, finished_at=now, output_chars=output_chars,
+                returncode=job["returncode"], max_silence=round(max(job["max_silence"], now - job["last_output"]), 1)
+            )
+            log.info(
+                f"Job #{job['id']} {status}: attente {job['start'] - job['enqueued_at']:.1f}s, "
+                f"execution {now - job['start']:.1f}s, sortie {output_chars} chars, code {job['returncode']}"
+            )
+            dispatch_jobs()
+
+
+def prompt_key(prompt):
+    """Message normalise (casse, espaces) pour reconnaitre un renvoi."""
+    return " ".join(prompt.lower().split())
+
+
+async def git_head():
+    """Commit courant du projet (None si indisponible)."""
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "git", "rev-parse", "HEAD",
+            cwd=PROJECT_DIR, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await process.communicate()
+    except OSError:
+        return None
+    return stdout.decode().strip() if process.returncode == 0 else None
+
+
+async def cached_result(chat_id, key):
+    """
+    Reponse recente au meme message, si la conversation n'a pas avance depuis cette reponse
+    (un "oui" repond a la derniere question du bot, pas a une ancienne) et si le projet est
+    toujours au meme commit.
+    """
+    now = time.time()
+    for cache_key in [k for k, (expires, _) in result_cache.items() if expires < now]:
+        del result_cache[cache_key]
+    turn_id = last_turn_id(chat_id)
+    if not any(k[:3] == (chat_id, key, turn_id) for k in result_cache):
+        return None
+    entry = result_cache.get((chat_id, key, turn_id, await git_head()))
+    # Un job du chat a pu enregistrer sa reponse pendant la lecture du commit
+    if entry is None or last_turn_id(chat_id) != turn_id:
+        return None
+    return entry[1]
+
+
+async def store_result(chat_id, key, turn_id, response):
+    """Garde une reponse reussie, avec son echange et le commit atteint a la fin du job."""
+    if response.startswith("[ERREUR]"):
+        return
+    head = await git_head()
+    if head is not None:
+        result_cache[(chat_id, key, turn_id, head)] = (time.time() + RESULT_CACHE_TTL, response)
+
+
+async def merge_duplicate(update, chat_id, key):
+    """Rattache un message identique au job en cours ou a l'entree en attente du chat."""
+    job = running_jobs.get(chat_id)
+    if job and job["key"] == key:
+        job["merged"] += 1
+        update_job(job["id"], merged=job["merged"])
+        await update.message.reply_text(
+            f"Ce message est deja en cours de traitement (job #{job['id']}, "
+            f"depuis {int(time.time() - job['start'])}s).\n"
+            f"Tu recevras la reponse une seule fois."
+        )
+        return True
+
+    for position, entry in enumerate(chat_queues.get(chat_id, ()), 1):
+        if entry["key"] == key:
+            entry["merged"] += 1
+            update_job(entry["id"], merged=entry["merged"])
+            await update.message.reply_text(
+                f"Ce message est deja dans ta file (job #{entry['id']}, #{position}), "
+                f"il ne sera traite qu'une fois."
+            )
+            return True
+    return False
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -252,53 +796,183 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     prompt = update.message.text
     chat_id = str(update.message.chat_id)
+    key = prompt_key(prompt)
+
+    # Message renvoye alors qu'il est deja en cours ou en attente : rattache, pas relance
+    if await merge_duplicate(update, chat_id, key):
+        return
+
+    cached = await cached_result(chat_id, key)
+    if cached is not None:
+        await update.message.reply_text(
+            "Meme demande traitee il y a peu, projet inchange (meme commit) : voici la reponse."
+        )
+        # Echange enregistre comme les autres ; la reponse reste valable pour un nouveau renvoi
+        save_context(chat_id, "Utilisateur", prompt)
+        turn_id = save_context(chat_id, "Claude", cached)
+        await send_response(context.bot, chat_id, cached)
+        await store_result(chat_id, key, turn_id, cached)
+        return
 
     save_context(chat_id, "Utilisateur", prompt)
 
-    # Ajouter a la queue au lieu de rejeter
-    position = len(message_queue) + 1
-    message_queue.append((update, prompt, chat_id))
+    # Ajouter a la file du chat au lieu de rejeter
+    entry = enqueue_job(chat_id, prompt, key)
+    position = len(chat_queues[chat_id])
 
-    if is_processing:
-        elapsed = int(time.time() - processing_start_time)
+    job = running_jobs.get(chat_id)
+    if job:
+        elapsed = int(time.time() - job["start"])
+        await update.message.reply_text(
+            f"Message recu (job #{entry['id']}) ! Position dans ta file: #{position}.\n"
+            f"Ta demande precedente est en cours depuis {elapsed}s. Il sera traite juste apres."
+        )
+    elif len(running_jobs) >= MAX_WORKERS:
         await update.message.reply_text(
-            f"Message recu ! Position dans la file: #{position}.\n"
-            f"Traitement en cours depuis {elapsed}s. Il sera traite des que Claude Code sera libre."
+            f"Message recu (job #{entry['id']}) ! Les {MAX_WORKERS} workers sont occupes.\n"
+            f"Il sera traite des qu'un worker sera libre"
+            f"{' (demande courte : prioritaire)' if entry['priority'] == 0 else ''}."
         )
 
-    # Lancer le traitement de la queue (si pas deja en cours)
-    asyncio.create_task(process_queue(context))
+    dispatch_jobs()
+
+
+def find_job(job_id):
+    """Job en cours ou en attente par identifiant : (entree, en cours ?) ou (None, False)."""
+    for job in running_jobs.values():
+        if job["id"] == job_id:
+            return job, True
+    for queue in chat_queues.values():
+        for entry in queue:
+            if entry["id"] == job_id:
+                return entry, False
+    return None, False
+
+
+def cancel_job(job_id):
+    """Annule un job par identifiant (tue le process s'il tourne). Renvoie l'entree ou None."""
+    entry, running = find_job(job_id)
+    if entry is None:
+        return None
+    if running:
+        # L'annulation de la tache tue le sous-processus (voir run_claude_async)
+        entry["cancelled"] = True
+        entry["task"].cancel()
+    else:
+        queue = chat_queues[entry["chat_id"]]
+        queue.remove(entry)
+        if not queue:
+            del chat_queues[entry["chat_id"]]
+        update_job(job_id, status="cancelled", finished_at=time.time())
+    return entry
+
+
+def cancel_chat(chat_id):
+    """Tue le job en cours du chat et vide sa file. Renvoie (job annule ou None, messages retires)."""
+    queue = chat_queues.pop(chat_id, ())
+    now = time.time()
+    for entry in queue:
+        update_job(entry["id"], status="cancelled", finished_at=now)
+    job = running_jobs.get(chat_id)
+    if job:
+        job["cancelled"] = True
+        job["task"].cancel()
+    return job, len(queue)
+
+
+def parse_job_id(context):
+    """Identifiant de job passe en argument de commande (/cancel 12), sinon None."""
+    if context.args and context.args[0].lstrip("#").isdigit():
+        return int(context.args[0].lstrip("#"))
+    return None
 
 
 async def cmd_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Annule le traitement en cours en tuant le subprocess Claude."""
-    global current_process, is_processing
-
+    """Annule un job par identifiant (/cancel 12), sinon le traitement en cours et la file de ce chat."""
     if update.message.from_user.id not in ALLOWED_USERS:
         return
 
-    if not is_processing or current_process is None:
+    job_id = parse_job_id(context)
+    if job_id is not None:
+        entry = cancel_job(job_id)
+        if entry is None:
+            await update.message.reply_text(f"Job #{job_id} introuvable (deja termine ?).")
+        else:
+            await update.message.reply_text(f"Job #{job_id} annule.")
+        return
+
+    chat_id = str(update.message.chat_id)
+    if chat_id not in running_jobs and not chat_queues.get(chat_id):
         await update.message.reply_text("Rien en cours a annuler.")
         return
 
     try:
-        elapsed = int(time.time() - processing_start_time)
-        current_process.kill()
-        current_process.wait(timeout=5)
-        current_process = None
-        # Vider la queue aussi
-        cleared = len(message_queue)
-        message_queue.clear()
-        is_processing = False
+        job, cleared = cancel_chat(chat_id)
+        running_info = "Aucune demande en cours."
+        if job:
+            running_info = f"Job #{job['id']} annule ! (etait en cours depuis {int(time.time() - job['start'])}s)"
         await update.message.reply_text(
-            f"Annule ! (etait en cours depuis {elapsed}s)\n"
-            f"File d'attente videe ({cleared} message(s) retires).\n"
-            f"Claude Code est disponible."
+            f"{running_info}\n"
+            f"Ta file d'attente est videe ({cleared} message(s) retires).\n"
+            f"Les demandes des autres chats continuent."
         )
     except Exception as e:
         await update.message.reply_text(f"Erreur lors de l'annulation: {e}")
 
 
+async def cmd_top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Passe un job en attente en tete de la file de son chat, en priorite haute (/top 12)."""
+    if update.message.from_user.id not in ALLOWED_USERS:
+        return
+
+    job_id = parse_job_id(context)
+    entry, running = find_job(job_id) if job_id is not None else (None, False)
+    if entry is None or running:
+        await update.message.reply_text("Usage: /top <id> avec l'identifiant d'un job en attente (voir /queue).")
+        return
+
+    queue = chat_queues[entry["chat_id"]]
+    queue.remove(entry)
+    queue.appendleft(entry)
+    entry["priority"] = 0
+    first = db.execute(
+        "SELECT MIN(position) FROM jobs WHERE chat_id = ? AND status = 'queued'", (entry["chat_id"],)
+    ).fetchone()[0]
+    update_job(job_id, priority=0, position=first - 1)
+    await update.message.reply_text(f"Job #{job_id} passe en tete de file, priorite haute.")
+    dispatch_jobs()
+
+
+def percentile(values, fraction):
+    """Percentile d'une liste triee, interpole lineairement entre les deux rangs voisins."""
+    if not values:
+        return None
+    rank = min(1.0, max(0.0, fraction)) * (len(values) - 1)
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def queue_wait_stats():
+    """Attente en file des jobs demarres sur STATS_WINDOW_HOURS, par priorite."""
+    since = time.time() - STATS_WINDOW_HOURS * 3600
+    rows = db.execute(
+        "SELECT priority, started_at - enqueued_at FROM jobs WHERE started_at IS NOT NULL AND enqueued_at > ?",
+        (since,)
+    ).fetchall()
+    lines = []
+    for priority, label in ((0, "courtes"), (1, "longues")):
+        waits = sorted(wait for p, wait in rows if p == priority)
+        if waits:
+            lines.append(
+                f"  {label}: {len(waits)} jobs, p50 {percentile(waits, 0.5):.0f}s, "
+                f"p95 {percentile(waits, 0.95):.0f}s, max {waits[-1]:.0f}s"
+            )
+    if not lines:
+        return f"Attente en file ({STATS_WINDOW_HOURS}h): aucun job"
+    return f"Attente en file ({STATS_WINDOW_HOURS}h):\n" + "\n".join(lines)
+
+
 async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.from_user.id not in ALLOWED_USERS:
         return
@@ -312,38 +986,171 @@ async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     result = await asyncio.to_thread(_git_log)
 
-    queue_info = f"Messages en attente: {len(message_queue)}"
-    if is_processing:
-        elapsed = int(time.time() - processing_start_time)
-        processing_info = f"Claude: en cours ({elapsed}s)"
-    else:
-        processing_info = "Claude: disponible"
+    chat_id = str(update.message.chat_id)
+    queue_info = (
+        f"Messages en attente: {len(chat_queues.get(chat_id, ()))} (ce chat), {queued_count()} (total)"
+    )
+    processing_info = f"Workers occupes: {len(running_jobs)}/{MAX_WORKERS}"
+    job = running_jobs.get(chat_id)
+    if job:
+        processing_info += f"\nClaude: job #{job['id']} en cours pour ce chat ({int(time.time() - job['start'])}s)"
 
     await update.message.reply_text(
-        f"Derniers commits:\n{result.stdout}\n{processing_info}\n{queue_info}"
+        f"Derniers commits:\n{result.stdout}\n{processing_info}\n{queue_info}\n{queue_wait_stats()}"
     )
 
 
+def job_records(hours):
+    """Jobs termines sur les `hours` dernieres heures : liste de dicts (durees en secondes)."""
+    rows = db.execute(
+        "SELECT status, priority, started_at - enqueued_at, finished_at - started_at, output_chars, "
+        "returncode, max_silence FROM jobs WHERE enqueued_at > ? AND finished_at IS NOT NULL",
+        (time.time() - hours * 3600,)
+    ).fetchall()
+    names = ("status", "priority", "wait", "run", "output_chars", "returncode", "max_silence")
+    return [dict(zip(names, row)) for row in rows]
+
+
+def distribution(records, field):
+    """Valeurs triees d'un champ (None ignores) et leurs percentiles p50/p90/p95/max."""
+    values = sorted(r[field] for r in records if r[field] is not None)
+    if not values:
+        return values, None
+    return values, {
+        "p50": percentile(values, 0.5), "p90": percentile(values, 0.9),
+        "p95": percentile(values, 0.95), "max": values[-1]
+    }
+
+
+def stats_text(hours):
+    records = job_records(hours)
+    if not records:
+        return f"Aucun job termine sur les {hours}h."
+
+    counts = {}
+    for record in records:
+        counts[record["status"]] = counts.get(record["status"], 0) + 1
+    lines = [
+        f"Jobs ({hours}h): {len(records)} - "
+        + ", ".join(f"{status} {count}" for status, count in sorted(counts.items()))
+    ]
+    for field, label, unit in (("wait", "Attente en file", "s"), ("run", "Execution", "s"),
+                               ("max_silence", "Silence max de la CLI", "s"),
+                               ("output_chars", "Taille de reponse", " chars")):
+        values, summary = distribution(records, field)
+        if summary:
+            lines.append(
+                f"{label} ({len(values)}): p50 {summary['p50']:.0f}{unit}, p90 {summary['p90']:.0f}{unit}, "
+                f"p95 {summary['p95']:.0f}{unit}, max {summary['max']:.0f}{unit}"
+            )
+
+    runs, _ = distribution(records, "run")
+    near_timeout = sum(1 for run in runs if run >= 0.8 * TIMEOUT_SECONDS)
+    silences, _ = distribution(records, "max_silence")
+    silent = sum(1 for silence in silences if silence >= HEARTBEAT_INTERVAL)
+    lines.append(
+        f"Timeout {TIMEOUT_SECONDS}s: {counts.get('timeout', 0)} atteint(s), "
+        f"{near_timeout} job(s) au-dela de 80%."
+    )
+    lines.append(f"Heartbeat {HEARTBEAT_INTERVAL}s: {silent} job(s) avec un silence plus long.")
+    failed = sorted({r["returncode"] for r in records if r["returncode"] not in (None, 0)})
+    if failed:
+        lines.append(f"Codes retour en erreur: {', '.join(str(code) for code in failed)}")
+    return "\n".join(lines)
+
+
+async def cmd_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Statistiques des jobs termines (/stats ou /stats 168 pour une semaine)."""
+    if update.message.from_user.id not in ALLOWED_USERS:
+        return
+
+    hours = STATS_WINDOW_HOURS
+    if context.args and context.args[0].isdigit():
+        hours = max(1, int(context.args[0]))
+    await update.message.reply_text(
+        f"{stats_text(hours)}\n"
+        f"Workers occupes: {len(running_jobs)}/{MAX_WORKERS}, en attente: {queued_count()}"
+    )
+
+
+def metrics_text():
+    """Metriques au format texte Prometheus (fenetre de STATS_WINDOW_HOURS)."""
+    records = job_records(STATS_WINDOW_HOURS)
+    lines = [
+        "# TYPE telegram_claude_workers_busy gauge",
+        f"telegram_claude_workers_busy {len(running_jobs)}",
+        "# TYPE telegram_claude_workers_max gauge",
+        f"telegram_claude_workers_max {MAX_WORKERS}",
+        "# TYPE telegram_claude_queued_jobs gauge",
+        f"telegram_claude_queued_jobs {queued_count()}",
+        "# TYPE telegram_claude_timeout_seconds gauge",
+        f"telegram_claude_timeout_seconds {TIMEOUT_SECONDS}",
+        "# TYPE telegram_claude_recent_jobs gauge",
+    ]
+    for status in ("done", "error", "timeout", "cancelled", "interrupted"):
+        count = sum(1 for r in records if r["status"] == status)
+        lines.append(f'telegram_claude_recent_jobs{{status="{status}"}} {count}')
+
+    for field, name in (("wait", "queue_wait_seconds"), ("run", "run_seconds"),
+                        ("max_silence", "max_silence_seconds"), ("output_chars", "output_chars")):
+        values, summary = distribution(records, field)
+        lines.append(f"# TYPE telegram_claude_{name} summary")
+        if summary:
+            for quantile, key in (("0.5", "p50"), ("0.9", "p90"), ("0.95", "p95"), ("1", "max")):
+                lines.append(f'telegram_claude_{name}{{quantile="{quantile}"}} {summary[key]:.3f}')
+        lines.append(f"telegram_claude_{name}_sum {sum(values):.3f}")
+        lines.append(f"telegram_claude_{name}_count {len(values)}")
+    return "\n".join(lines) + "\n"
+
+
+async def handle_metrics_request(reader, writer):
+    """Serveur HTTP minimal : GET /metrics (ecoute sur 127.0.0.1 uniquement)."""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", metrics_text().encode("utf-8")
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server():
+    global metrics_server
+    if not METRICS_PORT:
+        return
+    if metrics_server is not None:
+        # Boucle precedente (redemarrage apres crash) : libere le port
+        metrics_server.close()
+    try:
+        metrics_server = await asyncio.start_server(handle_metrics_request, "127.0.0.1", METRICS_PORT)
+        log.info(f"Metriques: http://127.0.0.1:{METRICS_PORT}/metrics")
+    except OSError as e:
+        metrics_server = None
+        log.warning(f"Endpoint de metriques indisponible (port {METRICS_PORT}): {e}")
+
+
 async def cmd_reset(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    global is_processing, current_process
     if update.message.from_user.id not in ALLOWED_USERS:
         return
 
     chat_id = str(update.message.chat_id)
-    conversations[chat_id] = []
-    message_queue.clear()
+    reset_context(chat_id)
 
-    # Tuer le process en cours si besoin
-    if current_process:
-        try:
-            current_process.kill()
-            current_process.wait(timeout=5)
-        except Exception:
-            pass
-        current_process = None
+    # Tuer le process en cours de ce chat si besoin
+    cancel_chat(chat_id)
 
-    is_processing = False
-    await update.message.reply_text("Conversation reset + file d'attente videe + verrou libere.")
+    await update.message.reply_text("Conversation reset + file d'attente videe + job en cours annule.")
 
 
 async def cmd_revert(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -380,37 +1187,110 @@ async def cmd_version(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def cmd_ping(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Repond instantanement meme si Claude est occupe."""
-    status = "En cours de traitement" if is_processing else "Disponible"
-    queue_size = len(message_queue)
+    chat_id = str(update.message.chat_id)
+    job = running_jobs.get(chat_id)
+    status = "En cours de traitement" if job else "Disponible"
     elapsed_info = ""
-    if is_processing:
-        elapsed = int(time.time() - processing_start_time)
+    if job:
+        elapsed = int(time.time() - job["start"])
         elapsed_info = f"\nEn cours depuis: {elapsed}s"
     await update.message.reply_text(
         f"Pong ! Bot actif\n"
         f"Statut: {status}{elapsed_info}\n"
-        f"File d'attente: {queue_size} message(s)"
+        f"Workers occupes: {len(running_jobs)}/{MAX_WORKERS}\n"
+        f"File d'attente: {len(chat_queues.get(chat_id, ()))} message(s) (ce chat), {queued_count()} (total)"
     )
 
 
 async def cmd_queue(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Affiche la file d'attente."""
-    if not message_queue:
-        await update.message.reply_text("File d'attente vide. Claude est disponible.")
+    """Affiche la file d'attente de ce chat."""
+    chat_id = str(update.message.chat_id)
+    queue = chat_queues.get(chat_id)
+    job = running_jobs.get(chat_id)
+    others = queued_count() - len(queue or ())
+
+    if not queue and not job:
+        await update.message.reply_text(
+            f"File d'attente vide. Workers occupes: {len(running_jobs)}/{MAX_WORKERS}."
+        )
         return
 
+    def merged_info(item):
+        return f" (x{item['merged'] + 1}, doublons fusionnes)" if item["merged"] else ""
+
     lines = []
-    for i, (_, prompt, _) in enumerate(message_queue, 1):
-        preview = prompt[:50] + "..." if len(prompt) > 50 else prompt
-        lines.append(f"  #{i}: {preview}")
+    if job:
+        preview = job["prompt"][:50] + "..." if len(job["prompt"]) > 50 else job["prompt"]
+        lines.append(
+            f"  En cours, job #{job['id']} ({int(time.time() - job['start'])}s): {preview}{merged_info(job)}"
+        )
+    for i, entry in enumerate(queue or (), 1):
+        preview = entry["prompt"][:50] + "..." if len(entry["prompt"]) > 50 else entry["prompt"]
+        priority = " [prioritaire]" if entry["priority"] == 0 else ""
+        lines.append(
+            f"  #{i} job #{entry['id']}{priority}, attend depuis {int(time.time() - entry['enqueued_at'])}s: "
+            f"{preview}{merged_info(entry)}"
+        )
 
     await update.message.reply_text(
-        f"File d'attente ({len(message_queue)} messages):\n" + "\n".join(lines)
+        f"Ta file d'attente ({len(queue or ())} messages):\n" + "\n".join(lines) + "\n"
+        f"Autres chats: {others} message(s) en attente, workers occupes: {len(running_jobs)}/{MAX_WORKERS}.\n"
+        f"/cancel <id> pour annuler un job, /top <id> pour le passer en tete."
     )
 
 
+def drop_stale_jobs():
+    """
+    Jobs d'une boucle precedente (main relance apres un crash sans arret propre) :
+    leurs processus sont tues et leurs workers liberes.
+    """
+    for job in running_jobs.values():
+        job["stale"] = True
+        process = job.get("process")
+        if process is not None and process.returncode is None:
+            log.warning(f"Job #{job['id']} orphelin : arret du processus {process.pid}")
+            kill_pid_tree(process.pid)
+    running_jobs.clear()
+    job_tasks.clear()
+
+
+async def on_startup(application):
+    """Reprend les demandes en attente au demarrage (file persistee)."""
+    global bot, stopping
+    bot = application.bot
+    stopping = False
+    drop_stale_jobs()
+    for job_id, chat_id in restore_queue():
+        try:
+            await bot.send_message(
+                int(chat_id), f"Job #{job_id} interrompu par un redemarrage du bot. Renvoie ta demande si besoin."
+            )
+        except Exception as e:
+            log.warning(f"Notification failed (chat {chat_id}): {e}")
+    if chat_queues:
+        log.info(f"{queued_count()} demande(s) reprise(s) depuis la file persistee")
+    await start_metrics_server()
+    dispatch_jobs()
+
+
+async def on_shutdown(application):
+    """Arrete les jobs en cours (processus Claude tues) avant la fermeture de la boucle."""
+    global stopping
+    stopping = True
+    tasks = list(job_tasks)
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        log.info(f"Arret : {len(tasks)} job(s) en cours interrompu(s)")
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
 def main():
-    app = Application.builder().token(TELEGRAM_TOKEN).job_queue(None).build()
+    init_conversation_store()
+    app = (
+        Application.builder().token(TELEGRAM_TOKEN).job_queue(None)
+        .post_init(on_startup).post_shutdown(on_shutdown).build()
+    )
 
     app.add_handler(CommandHandler("status", cmd_status))
     app.add_handler(CommandHandler("reset", cmd_reset))
@@ -419,12 +1299,14 @@ def main():
     app.add_handler(CommandHandler("ping", cmd_ping))
     app.add_handler(CommandHandler("queue", cmd_queue))
     app.add_handler(CommandHandler("cancel", cmd_cancel))
+    app.add_handler(CommandHandler("top", cmd_top))
+    app.add_handler(CommandHandler("stats", cmd_stats))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
     log.info("Bot Telegram -> Claude Code actif!")
     log.info(f"Projet: {PROJECT_DIR}")
-    log.info(f"Timeout: {TIMEOUT_SECONDS}s ({TIMEOUT_SECONDS // 60} min)")
-    log.info("Commandes: /status /reset /revert /version /ping /queue /cancel")
+    log.info(f"Timeout: {TIMEOUT_SECONDS}s ({TIMEOUT_SECONDS // 60} min), workers: {MAX_WORKERS}")
+    log.info("Commandes: /status /reset /revert /version /ping /queue /cancel [id] /top <id> /stats [heures]")
 
     app.run_polling(drop_pending_updates=True)
 
@@ -0,0 +1,30 @@
+import os
+import sys
+from unittest import mock
+
+import pytest
+
+# telegram_claude.py est a la racine du depot
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Le module s'arrete sans jeton ; les tests n'appellent jamais Telegram
+os.environ.setdefault("TELEGRAM_TOKEN", "test")
+
+try:
+    import telegram  # noqa: F401
+except ImportError:
+    # python-telegram-bot absent : seules les fonctions sans appel a l'API sont testees
+    sys.modules["telegram"] = mock.MagicMock()
+    sys.modules["telegram.ext"] = mock.MagicMock()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Module du bot avec une base de conversations vide, propre au test"""
+    import telegram_claude as bot
+
+    monkeypatch.setattr(bot, "CONVERSATIONS_DB", str(tmp_path / "conversations.db"))
+    bot.init_conversation_store()
+    yield bot
+    bot.db.close()
+    bot.db = None
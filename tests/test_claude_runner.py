@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import asyncio
+
+import pytest
+
+import telegram_claude as bot
+
+
+def new_job():
+    now = time.time()
+    return {"start": now, "last_output": now, "process": None, "activity": "", "result": None,
+            "raw": [], "returncode": None, "max_silence": 0.0}
+
+
+def fake_cli(tmp_path, output):
+    """CLI factice : lit le prompt, ecrit son pid, emet `output` puis reste bloquee"""
+    script = tmp_path / "claude"
+    script.write_text(
+        f"#!{sys.executable}\n"
+        "import os, sys, time\n"
+        "sys.stdin.read()\n"
+        f"open({str(tmp_path / 'pid')!r}, 'w').write(str(os.getpid()))\n"
+        f"sys.stdout.write({output!r})\n"
+        "sys.stdout.flush()\n"
+        "time.sleep(60)\n"
+    )
+    script.chmod(0o755)
+    return str(script)
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+@pytest.mark.skipif(os.name == "nt", reason="CLI factice POSIX")
+def test_cli_is_killed_when_reading_its_output_fails(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "STREAM_LINE_LIMIT", 1024)
+    monkeypatch.setattr(bot, "PROJECT_DIR", str(tmp_path))
+    monkeypatch.setattr(bot, "CLAUDE_CMD", fake_cli(tmp_path, "x" * 4096 + "\n"))
+    job = new_job()
+
+    with pytest.raises(ValueError):
+        asyncio.run(bot.run_claude_async("Bonjour", "42", None, job))
+
+    assert job["process"] is None
+    assert not is_alive(int((tmp_path / "pid").read_text()))
+
+
+def test_unexpected_event_shapes_are_ignored():
+    job = new_job()
+    for line in ['{"type": "assistant", "message": "texte"}',
+                 '{"type": "assistant", "message": {"content": "texte"}}',
+                 '{"type": "assistant", "message": {"content": ["texte", {"type": "text", "text": 3}]}}',
+                 '{"type": "result", "result": {"texte": 1}}',
+                 '[1, 2]']:
+        bot.handle_output_line(job, line)
+
+    assert job["activity"] == "" and job["result"] == ""
+
+    bot.handle_output_line(job, '{"type": "assistant", "message": {"content": [{"type": "tool_use", "name": "Edit"}]}}')
+    assert job["activity"] == "Outil: Edit"
@@ -0,0 +1,51 @@
+import time
+
+import telegram_claude as bot
+
+
+def test_turns_survive_a_restart(store):
+    store.save_context("42", "User", "Ajoute un bouton de simulation")
+    store.save_context("42", "Claude", "Bouton ajoute dans lib/simulation.dart")
+
+    store.init_conversation_store()
+
+    assert store.get_context("42") == (
+        "User: Ajoute un bouton de simulation\nClaude: Bouton ajoute dans lib/simulation.dart"
+    )
+    assert store.get_context("7") == "Nouvelle conversation"
+
+
+def test_oldest_turns_are_moved_into_the_summary(store, monkeypatch):
+    monkeypatch.setattr(bot, "MAX_TURNS_PER_CHAT", 2)
+    for i in range(4):
+        store.save_context("42", "User", f"demande {i}\ndetail {i}")
+
+    turns = store.db.execute("SELECT content FROM turns WHERE chat_id = '42' ORDER BY id").fetchall()
+    assert [content for (content,) in turns] == ["demande 2\ndetail 2", "demande 3\ndetail 3"]
+    assert store.get_summary("42") == "- User: demande 0\n- User: demande 1"
+    assert store.get_context("42").startswith("Resume des echanges precedents:\n- User: demande 0")
+
+
+def test_context_stays_within_the_token_budget(store, monkeypatch):
+    monkeypatch.setattr(bot, "CONTEXT_TOKEN_BUDGET", 100)
+    for i in range(20):
+        store.save_context("42", "User", f"message {i} " + "x" * 80)
+
+    context = store.get_context("42")
+
+    assert len(context) <= 100 * bot.CHARS_PER_TOKEN + len("Resume des echanges precedents:\n\n\n")
+    assert context.endswith("message 19 " + "x" * 80)
+
+
+def test_reset_and_purge_remove_turns(store):
+    store.save_context("42", "User", "ancien")
+    store.save_context("7", "User", "recent")
+    old = time.time() - (bot.CONVERSATION_MAX_AGE_DAYS + 1) * 86400
+    with store.db:
+        store.db.execute("UPDATE turns SET created_at = ? WHERE chat_id = '42'", (old,))
+
+    store.purge_old_conversations()
+    assert store.get_context("42") == "Nouvelle conversation"
+
+    store.reset_context("7")
+    assert store.get_context("7") == "Nouvelle conversation"
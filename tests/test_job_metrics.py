@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+import telegram_claude as bot
+
+
+@pytest.fixture
+def jobs(store, monkeypatch):
+    monkeypatch.setattr(bot, "chat_queues", {})
+    monkeypatch.setattr(bot, "running_jobs", {})
+    monkeypatch.setattr(bot, "MAX_WORKERS", 3)
+    monkeypatch.setattr(bot, "TIMEOUT_SECONDS", 600)
+    return store
+
+
+def finished_job(status, wait, run, output_chars=None, returncode=0, max_silence=None, age=60):
+    """Job termine il y a `age` secondes, insere directement dans la table jobs"""
+    enqueued = time.time() - age
+    with bot.db:
+        bot.db.execute(
+            "INSERT INTO jobs (chat_id, prompt, prompt_key, priority, status, enqueued_at, started_at, "
+            "finished_at, output_chars, returncode, max_silence) VALUES ('1', 'p', 'p', 0, ?, ?, ?, ?, ?, ?, ?)",
+            (status, enqueued, enqueued + wait, enqueued + wait + run, output_chars, returncode, max_silence)
+        )
+
+
+def test_percentile_of_empty_list_is_none():
+    assert bot.percentile([], 0.5) is None
+
+
+def test_percentile_of_one_value_is_that_value():
+    assert bot.percentile([7], 0) == 7
+    assert bot.percentile([7], 0.5) == 7
+    assert bot.percentile([7], 1) == 7
+
+
+def test_percentile_interpolates_between_ranks():
+    values = [10, 20, 30, 40]
+    assert bot.percentile(values, 0) == 10
+    assert bot.percentile(values, 0.5) == 25
+    assert bot.percentile(values, 0.9) == pytest.approx(37)
+    assert bot.percentile(values, 1) == 40
+    assert bot.percentile(values, 1.5) == 40
+
+
+def test_metrics_text_format(jobs):
+    finished_job("done", wait=2, run=100, output_chars=1000, max_silence=10)
+    finished_job("done", wait=4, run=300, output_chars=3000, max_silence=30)
+    finished_job("timeout", wait=6, run=600, returncode=-9)
+    finished_job("done", wait=1, run=1, age=bot.STATS_WINDOW_HOURS * 3600 + 60)
+    bot.enqueue_job("2", "en attente", "en attente")
+
+    lines = bot.metrics_text().splitlines()
+
+    assert bot.metrics_text().endswith("\n")
+    assert lines[:8] == [
+        "# TYPE telegram_claude_workers_busy gauge", "telegram_claude_workers_busy 0",
+        "# TYPE telegram_claude_workers_max gauge", "telegram_claude_workers_max 3",
+        "# TYPE telegram_claude_queued_jobs gauge", "telegram_claude_queued_jobs 1",
+        "# TYPE telegram_claude_timeout_seconds gauge", "telegram_claude_timeout_seconds 600",
+    ]
+    assert 'telegram_claude_recent_jobs{status="done"} 2' in lines
+    assert 'telegram_claude_recent_jobs{status="timeout"} 1' in lines
+    assert 'telegram_claude_recent_jobs{status="cancelled"} 0' in lines
+
+    start = lines.index("# TYPE telegram_claude_run_seconds summary")
+    assert lines[start + 1:start + 7] == [
+        'telegram_claude_run_seconds{quantile="0.5"} 300.000',
+        'telegram_claude_run_seconds{quantile="0.9"} 540.000',
+        'telegram_claude_run_seconds{quantile="0.95"} 570.000',
+        'telegram_claude_run_seconds{quantile="1"} 600.000',
+        "telegram_claude_run_seconds_sum 1000.000",
+        "telegram_claude_run_seconds_count 3",
+    ]
+    assert "telegram_claude_output_chars_count 2" in lines
+
+
+def test_metrics_text_without_jobs_has_empty_summaries(jobs):
+    lines = bot.metrics_text().splitlines()
+
+    start = lines.index("# TYPE telegram_claude_queue_wait_seconds summary")
+    assert lines[start + 1:start + 3] == [
+        "telegram_claude_queue_wait_seconds_sum 0.000",
+        "telegram_claude_queue_wait_seconds_count 0",
+    ]
+    assert bot.stats_text(24) == "Aucun job termine sur les 24h."
+
+
+def test_stats_text_summarizes_recent_jobs(jobs):
+    finished_job("done", wait=2, run=100, output_chars=1000, max_silence=10)
+    finished_job("timeout", wait=6, run=600, returncode=-9, max_silence=400)
+
+    text = bot.stats_text(24)
+
+    assert text.startswith("Jobs (24h): 2 - done 1, timeout 1\n")
+    assert "Execution (2): p50 350s, p90 550s, p95 575s, max 600s" in text
+    assert "Timeout 600s: 1 atteint(s), 1 job(s) au-dela de 80%." in text
+    assert "Codes retour en erreur: -9" in text
@@ -0,0 +1,64 @@
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+import telegram_claude as bot
+
+CHAT = "42"
+
+
+@pytest.fixture
+def chat(store, monkeypatch):
+    async def git_head():
+        return "abc123"
+
+    monkeypatch.setattr(bot, "git_head", git_head)
+    monkeypatch.setattr(bot, "dispatch_jobs", lambda: None)
+    monkeypatch.setattr(bot, "result_cache", {})
+    monkeypatch.setattr(bot, "chat_queues", {})
+    monkeypatch.setattr(bot, "running_jobs", {})
+    return store
+
+
+def send(text):
+    """Message de l'utilisateur autorise ; renvoie le faux bot (reponses envoyees)"""
+    message = SimpleNamespace(from_user=SimpleNamespace(id=bot.ALLOWED_USERS[0]), text=text,
+                              chat_id=int(CHAT), reply_text=AsyncMock())
+    context = SimpleNamespace(bot=SimpleNamespace(send_message=AsyncMock()))
+    asyncio.run(bot.handle_message(SimpleNamespace(message=message), context))
+    return context.bot
+
+
+def answer(prompt, response):
+    """Echange traite par Claude, comme a la fin de run_job"""
+    bot.save_context(CHAT, "Utilisateur", prompt)
+    turn_id = bot.save_context(CHAT, "Claude", response)
+    asyncio.run(bot.store_result(CHAT, bot.prompt_key(prompt), turn_id, response))
+
+
+def contents():
+    return [content for (content,) in bot.db.execute("SELECT content FROM turns ORDER BY id")]
+
+
+def test_short_reply_is_not_replayed_once_the_conversation_moved_on(chat):
+    answer("Supprime le dossier build", "[AUTORISATION] Supprimer build/ ?")
+    answer("oui", "[OK] build/ supprime")
+    answer("Et le cache ?", "[AUTORISATION] Vider .dart_tool/ ?")
+
+    telegram = send("oui")
+
+    telegram.send_message.assert_not_called()
+    assert [entry["prompt"] for entry in bot.chat_queues[CHAT]] == ["oui"]
+
+
+def test_resent_message_is_answered_from_cache_and_recorded(chat):
+    answer("Lance les tests", "[OK] 12 tests passes")
+
+    for _ in range(2):
+        telegram = send("lance les  tests")
+        assert telegram.send_message.await_args.args[1].endswith("12 tests passes")
+
+    assert CHAT not in bot.chat_queues
+    assert contents()[-4:] == ["lance les  tests", "[OK] 12 tests passes"] * 2
@@ -0,0 +1,147 @@
+import time
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+
+import telegram_claude as bot
+
+SHORT = "Corrige la faute dans le titre"
+LONG = "Refactorise tout le module de simulation. " * 10
+
+
+@pytest.fixture
+def scheduler(store, monkeypatch):
+    monkeypatch.setattr(bot, "chat_queues", {})
+    monkeypatch.setattr(bot, "running_jobs", {})
+    monkeypatch.setattr(bot, "job_tasks", set())
+    monkeypatch.setattr(bot, "stopping", False)
+    monkeypatch.setattr(bot, "MAX_WORKERS", 2)
+    monkeypatch.setattr(bot, "FAST_WORKERS", 0)
+    return store
+
+
+def enqueue(chat_id, prompt):
+    return bot.enqueue_job(chat_id, prompt, bot.prompt_key(prompt))
+
+
+def running(chat_id, prompt, started=0.0):
+    """Job en cours (tache factice) occupant un worker"""
+    entry = enqueue(chat_id, prompt)
+    bot.chat_queues[chat_id].remove(entry)
+    if not bot.chat_queues[chat_id]:
+        del bot.chat_queues[chat_id]
+    entry.update({"start": time.time() - started, "cancelled": False, "requeue": False,
+                  "task": SimpleNamespace(cancel=lambda: entry.update(task_cancelled=True))})
+    bot.running_jobs[chat_id] = entry
+    return entry
+
+
+def status(job_id):
+    return bot.db.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+
+def test_short_prompts_go_first_and_long_ones_age(scheduler, monkeypatch):
+    assert bot.job_priority(SHORT) == 0 and bot.job_priority(LONG) == 1
+    long_job = enqueue("1", LONG)
+    short_job = enqueue("2", SHORT)
+    assert bot.next_job() is short_job
+
+    monkeypatch.setitem(long_job, "enqueued_at", time.time() - bot.PRIORITY_AGING_SECONDS)
+    assert bot.next_job() is long_job
+
+
+def test_fast_worker_is_kept_for_short_prompts(scheduler, monkeypatch):
+    monkeypatch.setattr(bot, "FAST_WORKERS", 1)
+    running("1", LONG)
+    long_job = enqueue("2", LONG)
+    assert bot.next_job() is None
+
+    short_job = enqueue("3", SHORT)
+    assert bot.next_job() is short_job
+    assert long_job in bot.chat_queues["2"]
+
+
+def test_cancel_queued_and_running_jobs(scheduler):
+    current = running("1", LONG)
+    queued = enqueue("1", SHORT)
+
+    assert bot.cancel_job(queued["id"]) is queued
+    assert "1" not in bot.chat_queues and status(queued["id"]) == "cancelled"
+
+    assert bot.cancel_job(current["id"]) is current
+    assert current["cancelled"] and current["task_cancelled"]
+    assert bot.cancel_job(12345) is None
+
+
+def test_top_moves_a_job_to_the_head_of_its_chat_across_restarts(scheduler, monkeypatch):
+    monkeypatch.setattr(bot, "dispatch_jobs", lambda: None)
+    first, second, third = (enqueue("1", f"{LONG} {i}") for i in range(3))
+    update = SimpleNamespace(message=SimpleNamespace(
+        from_user=SimpleNamespace(id=bot.ALLOWED_USERS[0]), reply_text=AsyncMock()
+    ))
+
+    asyncio.run(bot.cmd_top(update, SimpleNamespace(args=[f"#{third['id']}"])))
+
+    assert [entry["id"] for entry in bot.chat_queues["1"]] == [third["id"], first["id"], second["id"]]
+    assert third["priority"] == 0
+    bot.restore_queue()
+    assert [entry["id"] for entry in bot.chat_queues["1"]] == [third["id"], first["id"], second["id"]]
+
+
+def test_restore_queue_reloads_waiting_jobs_and_interrupts_running_ones(scheduler):
+    current = running("1", LONG)
+    bot.update_job(current["id"], status="running")
+    waiting = [enqueue("1", SHORT), enqueue("2", LONG)]
+
+    bot.init_conversation_store()
+    interrupted = bot.restore_queue()
+
+    assert interrupted == [(current["id"], "1")] and status(current["id"]) == "interrupted"
+    assert {chat_id: [e["id"] for e in queue] for chat_id, queue in bot.chat_queues.items()} == {
+        "1": [waiting[0]["id"]], "2": [waiting[1]["id"]]
+    }
+
+
+def test_long_job_that_just_started_is_preempted_for_a_short_one(scheduler, monkeypatch):
+    monkeypatch.setattr(bot, "MAX_WORKERS", 1)
+    monkeypatch.setattr(bot, "bot", SimpleNamespace(send_message=AsyncMock()))
+    started = asyncio.Event()
+
+    async def run_claude(prompt, chat_id, telegram, job, status_message=None):
+        job["returncode"] = 0
+        if prompt == LONG:
+            started.set()
+            await asyncio.sleep(60)
+        return "[OK] fait"
+
+    async def git_head():
+        return None
+
+    monkeypatch.setattr(bot, "run_claude_async", run_claude)
+    monkeypatch.setattr(bot, "git_head", git_head)
+
+    async def scenario():
+        long_job = enqueue("1", LONG)
+        bot.dispatch_jobs()
+        await started.wait()
+
+        short_job = enqueue("2", SHORT)
+        bot.dispatch_jobs()
+        assert long_job["requeue"]
+        while status(short_job["id"]) != "done":
+            await asyncio.sleep(0.01)
+
+        # La demande courte est passee, le job long est relance depuis le debut
+        assert bot.running_jobs["1"]["id"] == long_job["id"] and status(long_job["id"]) == "running"
+        # Deja preempte une fois : il ne l'est plus
+        enqueue("3", SHORT)
+        bot.dispatch_jobs()
+        assert bot.preemption_victim() is None
+        for task in list(bot.job_tasks):
+            task.cancel()
+
+    asyncio.run(scenario())
+    messages = [call.args[1] for call in bot.bot.send_message.await_args_list]
+    assert any("suspendu" in message for message in messages)